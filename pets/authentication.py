@@ -0,0 +1,153 @@
+"""
+Authentication classes that resolve the requesting user without a database
+query on every request.
+
+Lookups go through two layers: a small per-process LRU (`LocalTTLCache`)
+and the shared Django cache, and only reach the database on a miss in both.
+Two mappings are cached:
+
+- token key -> user id, dropped when the token is deleted or rotated,
+- user id -> the fields authentication and permissions read
+  (`CACHED_USER_FIELDS`, never the password hash), dropped when the user is
+  saved or deleted.
+
+Signals clear the shared cache and the LRU of the process that made the
+change. Other processes may keep serving their LRU entry for up to
+`TOKEN_CACHE_LOCAL_TTL` seconds, so keep that setting short (0 disables the
+per-process layer).
+
+Queryset `update()` and `delete()` on users send no signals: a user
+deactivated by `User.objects.filter(...).update(is_active=False)` stays
+authenticated for up to `TOKEN_CACHE_TIMEOUT` seconds. Call `forget_user()`
+for each changed user after such an update.
+
+`CachedJWTAuthentication` verifies simplejwt access tokens by signature, so
+only the (cached) user lookup is left.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .cache import LocalTTLCache
+
+# Seconds entries live in the shared cache and in each process
+TOKEN_CACHE_TIMEOUT = getattr(settings, 'TOKEN_CACHE_TIMEOUT', 300)
+TOKEN_CACHE_LOCAL_TTL = getattr(settings, 'TOKEN_CACHE_LOCAL_TTL', 15)
+TOKEN_CACHE_LOCAL_SIZE = getattr(settings, 'TOKEN_CACHE_LOCAL_SIZE', 10000)
+
+# User fields kept in the cache; views reading any other field load it lazily
+CACHED_USER_FIELDS = ('username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser')
+
+_local = LocalTTLCache(TOKEN_CACHE_LOCAL_SIZE, TOKEN_CACHE_LOCAL_TTL)
+
+
+def token_cache_key(key):
+    # Keys are credentials, keep them out of cache keys
+    return 'pets:auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def user_cache_key(user_id):
+    return f'pets:auth:user:fields:{user_id}'
+
+
+def cached(key, load):
+    """Look `key` up locally, then in the shared cache, then with `load()`."""
+    value = _local.get(key)
+    if value is None:
+        value = cache.get(key)
+        if value is None:
+            value = load()
+            if value is None:
+                return None
+            cache.set(key, value, TOKEN_CACHE_TIMEOUT)
+        _local.set(key, value)
+    return value
+
+
+def forget(key):
+    cache.delete(key)
+    _local.delete(key)
+
+
+# Loads read the primary: a token issued a moment ago may not be on a read
+# replica yet, and whatever is loaded stays cached for minutes.
+
+
+def get_token_user_id(key):
+    return cached(token_cache_key(key), lambda: Token.objects.using(DEFAULT_DB_ALIAS).filter(key=key).values_list('user_id', flat=True).first())
+
+
+def get_user(user_id):
+    """A fresh User instance for `user_id`, or None when there is no such user."""
+    User = get_user_model()
+    field_names = [
+        field.attname for field in User._meta.concrete_fields
+        if field.primary_key or field.attname in CACHED_USER_FIELDS
+    ]
+    values = cached(user_cache_key(user_id), lambda: User.objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id).values_list(*field_names).first())
+    if values is None:
+        return None
+    # Every request gets its own instance, so views can modify it safely; the
+    # fields left out are deferred, so save() never writes them back
+    return User.from_db(DEFAULT_DB_ALIAS, field_names, values)
+
+
+def forget_token(key):
+    forget(token_cache_key(key))
+
+
+def forget_user(user_id):
+    forget(user_cache_key(user_id))
+
+
+def issue_jwt(user):
+    """A signed access token and its refresh token for `user`."""
+    refresh = RefreshToken.for_user(user)
+    return {'token': str(refresh.access_token), 'refresh': str(refresh)}
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for `TokenAuthentication` ("Authorization: Token <key>")
+    with cached token and user lookups.
+    """
+
+    def authenticate_credentials(self, key):
+        user_id = get_token_user_id(key)
+        user = get_user(user_id) if user_id is not None else None
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return (user, Token(key=key, user=user))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    Stateless signed tokens ("Authorization: Bearer <jwt>") issued by
+    `UserViewSet.login`. The signature is checked without the database and the
+    user comes from the cache.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        user = get_user(user_id)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
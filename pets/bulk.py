@@ -0,0 +1,42 @@
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Pet, Pet_Tag, Tag
+from .signals import pets_bulk_created
+
+# Rows per INSERT statement
+BATCH_SIZE = 500
+
+
+def resolve_tags(references):
+    """
+    Map tag ids and names to Tag ids with one query.
+    Returns `(lookup, unknown)` where `lookup` maps each known reference to an id.
+    """
+    ids = {int(ref) for ref in references if str(ref).isdigit()}
+    names = {str(ref) for ref in references}
+    lookup = {}
+    for tag_id, name in Tag.objects.filter(Q(id__in=ids) | Q(name__in=names)).values_list('id', 'name'):
+        lookup[name] = tag_id
+        lookup[str(tag_id)] = tag_id
+    unknown = {str(ref) for ref in references} - set(lookup)
+    return lookup, unknown
+
+
+def bulk_create_pets(pets, tag_ids, batch_size=BATCH_SIZE):
+    """
+    Insert unsaved `pets` and their tags (`tag_ids[i]` belongs to `pets[i]`)
+    with batched INSERTs in one transaction.
+
+    bulk_create() skips save signals, so `pets_bulk_created` is sent once the
+    transaction commits to keep the search index and caches current.
+    """
+    with transaction.atomic():
+        created = Pet.objects.bulk_create(pets, batch_size=batch_size)
+        Pet_Tag.objects.bulk_create(
+            [Pet_Tag(pet_id=pet.pk, tag_id=tag_id) for pet, ids in zip(created, tag_ids) for tag_id in set(ids)],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        transaction.on_commit(lambda: pets_bulk_created.send(sender=Pet, pets=created))
+    return created
@@ -0,0 +1,140 @@
+"""
+Versioned cache namespaces.
+
+Cached values embed the current version of their namespace in the key, and
+model signals bump the version when the underlying rows change. Old entries are
+never looked up again and simply expire.
+
+Response caching (see `pets.views.mixins.CachedReadMixin`) uses one namespace
+per resource list (`pets-list`) and one per object (`pets:12`).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.utils.http import urlencode
+
+from .db_routers import record_write
+
+
+class LocalTTLCache:
+    """
+    Size-bounded, thread-safe LRU of per-process values that expire after
+    `ttl` seconds. Sits in front of the shared cache for the hottest keys;
+    a `ttl` of 0 disables it.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+def version_key(namespace):
+    return f'pets:version:{namespace}'
+
+
+def get_version(namespace):
+    version = cache.get(version_key(namespace))
+    if version is None:
+        # Start from the clock so a version lost on eviction or restart never
+        # comes back with a number that old entries were stored under.
+        cache.add(version_key(namespace), int(time.time() * 1000), timeout=None)
+        version = cache.get(version_key(namespace), 0)
+    return version
+
+
+def bump_version(*namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(version_key(namespace))
+        except ValueError:
+            cache.set(version_key(namespace), int(time.time() * 1000), timeout=None)
+    # Until replicas catch up, these entries must be rebuilt from the primary
+    record_write(*namespaces)
+
+
+def params_digest(params, names=None):
+    """Stable digest of query parameters, independent of their order."""
+    items = sorted(
+        (name, value)
+        for name in params
+        if names is None or name in names
+        for value in params.getlist(name)
+    )
+    return hashlib.md5(urlencode(items).encode()).hexdigest()
+
+
+def list_namespace(resource):
+    return f'{resource}-list'
+
+
+def object_namespace(resource, pk):
+    return f'{resource}:{pk}'
+
+
+def invalidate_responses(resource, *pks, lists=True):
+    """Expire cached responses for the given objects and, unless told otherwise, the lists."""
+    namespaces = [object_namespace(resource, pk) for pk in pks if pk is not None]
+    if lists:
+        namespaces.append(list_namespace(resource))
+    bump_version(*namespaces)
+
+
+# Hit / miss metrics, shared by all workers through the cache
+
+
+def metric_key(namespace, outcome):
+    return f'pets:metrics:{namespace}:{outcome}'
+
+
+def record_access(namespace, hit):
+    key = metric_key(namespace, 'hits' if hit else 'misses')
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def access_metrics(namespaces):
+    keys = {metric_key(namespace, outcome): (namespace, outcome) for namespace in namespaces for outcome in ('hits', 'misses')}
+    values = cache.get_many(list(keys))
+    metrics = {namespace: {'hits': 0, 'misses': 0} for namespace in namespaces}
+    for key, (namespace, outcome) in keys.items():
+        metrics[namespace][outcome] = values.get(key, 0)
+    for counts in metrics.values():
+        total = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = round(counts['hits'] / total, 4) if total else None
+    return metrics
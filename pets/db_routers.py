@@ -0,0 +1,154 @@
+"""
+Read-replica routing.
+
+Safe-method requests (GET, HEAD, OPTIONS) read from one of the
+DATABASE_REPLICAS, picked once per request; everything else, and all code
+running outside a request (commands, signals on worker threads), uses the
+primary.
+
+Replicas lag behind the primary, so two kinds of reads stay on the primary
+for REPLICA_STICKY_SECONDS after a write:
+
+- Reads by the client that wrote (read-your-writes). Clients are told apart
+  by their Authorization header or session cookie only: behind a proxy every
+  client shares a few addresses, so writes without credentials pin nothing.
+  Login and registration pin the credentials they hand out instead, a new
+  session cookie here and issued tokens through `stick_to_primary()`.
+- Cached responses of the resources that changed, so the response cache is
+  never filled from a replica that has not caught up (see
+  `primary_if_written`).
+"""
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Replica alias serving the current request's reads; None reads from the primary
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def use_primary():
+    """Send the remaining reads of the current request to the primary."""
+    _read_alias.set(None)
+
+
+def credentials_key(credentials):
+    return f'pets:primary:{hashlib.sha256(credentials.encode()).hexdigest()}'
+
+
+def request_credentials(request):
+    return request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+
+
+def stick_to_primary(credentials):
+    """
+    Keep the reads of requests made with `credentials` (an Authorization
+    header value or a session key) on the primary while replicas catch up.
+    """
+    if replicas():
+        cache.set(credentials_key(credentials), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def written_key(namespace):
+    return f'pets:written:{namespace}'
+
+
+def record_write(*namespaces):
+    """Keep cached reads of `namespaces` on the primary while replicas catch up."""
+    if replicas():
+        cache.set_many({written_key(namespace): True for namespace in namespaces}, settings.REPLICA_STICKY_SECONDS)
+
+
+def primary_if_written(namespaces):
+    """Read from the primary when any of the cache `namespaces` changed recently."""
+    if _read_alias.get() is not None and cache.get_many([written_key(namespace) for namespace in namespaces]):
+        use_primary()
+
+
+def start_request(request):
+    """Pick where the request reads from."""
+    alias = None
+    if request.method in SAFE_METHODS:
+        credentials = request_credentials(request)
+        if not credentials or not cache.get(credentials_key(credentials)):
+            alias = random.choice(replicas())
+    _read_alias.set(alias)
+
+
+def finish_request(request, response):
+    # Not a token reset: with ASGI the variable is set in a copy of this context
+    _read_alias.set(None)
+    if request.method in SAFE_METHODS:
+        return
+    credentials = request_credentials(request)
+    if credentials:
+        stick_to_primary(credentials)
+    # A session started by this request (e.g. a login) sticks from its first request on
+    session = response.cookies.get(settings.SESSION_COOKIE_NAME) if response is not None else None
+    if session is not None and session.value:
+        stick_to_primary(session.value)
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replicas():
+            return self.get_response(request)
+        start_request(request)
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            finish_request(request, response)
+
+    async def __acall__(self, request):
+        if not replicas():
+            return await self.get_response(request)
+        # Sync views and the async ORM's threads run with a copy of this context
+        await sync_to_async(start_request)(request)
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            await sync_to_async(finish_request)(request, response)
+
+
+class ReplicaRouter:
+    """Reads go where `ReplicaRoutingMiddleware` decided, writes and migrations to the primary."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication
+        return False if db in replicas() else None
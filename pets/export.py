@@ -0,0 +1,115 @@
+"""
+Streaming export of the pet catalogue as NDJSON or CSV.
+
+Pets are read with `iterator(chunk_size=...)`, which also runs the tag
+prefetch once per chunk, and every row is encoded as soon as it is read, so
+memory use does not grow with the size of the catalogue.
+
+Under ASGI, Django would read a sync iterator to the end before sending
+anything, so `aexport_pets` reads keyset pages of pets off the event loop
+instead and hands each one over as soon as it is encoded.
+"""
+import csv
+import json
+from datetime import datetime, time
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.utils.encoders import JSONEncoder
+
+from .serializers import PetSerializer
+
+CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """File-like object handing back whatever the csv writer writes."""
+
+    def write(self, value):
+        return value
+
+
+def parse_since(value):
+    """
+    An aware datetime from an ISO 8601 date or datetime, or None when the
+    value is not one. Naive values are taken in the current time zone.
+    """
+    try:
+        since = parse_datetime(value)
+        if since is None:
+            day = parse_date(value)
+            since = datetime.combine(day, time.min) if day else None
+    except ValueError:
+        return None
+    if since is not None and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def export_rows(pets, chunk_size=CHUNK_SIZE):
+    """Yield the serialized representation of every pet in `pets`."""
+    # One serializer for all rows, so its fields are built only once
+    serializer = PetSerializer()
+    for pet in pets.iterator(chunk_size=chunk_size):
+        yield serializer.to_representation(pet)
+
+
+def ndjson_lines(rows):
+    encoder = JSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, dict):
+        # e.g. the srcset of each image format
+        return json.dumps(value, separators=(',', ':'))
+    return value
+
+
+def csv_lines(rows, tag_separator='|', header=True):
+    writer = csv.writer(Echo())
+    fields = list(PetSerializer().fields)
+    if header:
+        yield writer.writerow(fields)
+    for row in rows:
+        row['tags'] = tag_separator.join(str(tag) for tag in row['tags'])
+        yield writer.writerow([csv_value(row[field]) for field in fields])
+
+
+def export_pets(pets, output='ndjson'):
+    """Lines of the export of `pets` in the given output format."""
+    rows = export_rows(PetSerializer.setup_eager_loading(pets.order_by('id')))
+    return ndjson_lines(rows) if output == 'ndjson' else csv_lines(rows)
+
+
+def export_page(pets, after, output, chunk_size):
+    """`(text, last id)` of the pets past id `after`, one keyset page, or `('', None)` past the end."""
+    page = list((pets if after is None else pets.filter(id__gt=after))[:chunk_size])
+    if not page:
+        return '', None
+    serializer = PetSerializer()
+    rows = (serializer.to_representation(pet) for pet in page)
+    lines = ndjson_lines(rows) if output == 'ndjson' else csv_lines(rows, header=False)
+    return ''.join(lines), page[-1].pk
+
+
+async def aexport_pets(pets, output='ndjson', chunk_size=CHUNK_SIZE):
+    """`export_pets` as an async iterator, one page of `chunk_size` pets at a time."""
+    pets = PetSerializer.setup_eager_loading(pets.order_by('id'))
+    if output == 'csv':
+        yield next(csv_lines([]))
+    after = None
+    while True:
+        text, after = await sync_to_async(export_page)(pets, after, output, chunk_size)
+        if after is None:
+            return
+        yield text
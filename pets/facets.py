@@ -0,0 +1,58 @@
+from django.core.cache import cache
+from django.db.models import Count
+
+from .cache import get_version, params_digest, record_access
+from .db_routers import primary_if_written
+from .filters import PET_FILTER_PARAMS, filter_pets
+from .models import Pet, Pet_Tag
+
+FACET_NAMESPACE = 'facets'
+FACET_TIMEOUT = 60 * 10
+# Values returned per facet, most frequent first
+FACET_LIMIT = 50
+
+
+def pet_facets(params):
+    """
+    Facet counts for the pets matching the listing filters in `params`,
+    cached per filter combination until a pet or its tags change.
+    """
+    key = f'pets:facets:{get_version(FACET_NAMESPACE)}:{params_digest(params, PET_FILTER_PARAMS)}'
+    facets = cache.get(key)
+    record_access(FACET_NAMESPACE, hit=facets is not None)
+    if facets is None:
+        primary_if_written([FACET_NAMESPACE])
+        facets = count_facets(filter_pets(Pet.objects.all(), params))
+        cache.set(key, facets, FACET_TIMEOUT)
+    return facets
+
+
+def count_facets(pets):
+    """One grouped aggregate query per facet over the filtered pets."""
+    pets = pets.order_by()
+    # The tag filter joins Pet_Tag, so count each pet once
+    count = Count('id', distinct=True)
+
+    def grouped(queryset, value, label=None):
+        fields = [value, label] if label else [value]
+        rows = queryset.values(*fields).annotate(count=count).order_by('-count', value)[:FACET_LIMIT]
+        return [
+            {'value': row[value], 'label': row[label] if label else row[value], 'count': row['count']}
+            for row in rows
+        ]
+
+    tagged = Pet_Tag.objects.filter(pet__in=pets.values('id')).order_by()
+    return {
+        'count': pets.aggregate(count=count)['count'],
+        'facets': {
+            'pet_type': grouped(pets, 'pet_type'),
+            'gender': grouped(pets, 'gender'),
+            'status': grouped(pets, 'status'),
+            'shelter': grouped(pets, 'shelter', 'shelter__name'),
+            'tag': [
+                {'value': row['tag'], 'label': row['tag__name'], 'count': row['count']}
+                for row in tagged.values('tag', 'tag__name').annotate(count=Count('pet', distinct=True))
+                .order_by('-count', 'tag')[:FACET_LIMIT]
+            ],
+        },
+    }
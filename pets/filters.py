@@ -0,0 +1,37 @@
+# Query parameters understood by filter_pets
+PET_FILTER_PARAMS = ('shelter', 'tag', 'like', 'user', 'gender')
+
+
+def filter_pets(queryset, params):
+    """
+    Apply the pet listing filters found in `params` to `queryset`.
+
+    Shared by every pet listing so nested routes, search and facets all accept
+    the same query parameters as `/pets/`.
+    """
+    # Filtering by shelter
+    shelter_id = params.get('shelter', None)
+    if shelter_id is not None:
+        queryset = queryset.filter(shelter=shelter_id)
+
+    # Filtering by tags
+    tag_id = params.get('tag', None)
+    if tag_id is not None:
+        queryset = queryset.filter(tags__id=tag_id)
+
+    # Filtering by likes
+    like_id = params.get('like', None)
+    if like_id is not None:
+        queryset = queryset.filter(like__id=like_id)
+
+    # Filtering by user (creator)
+    user_id = params.get('user', None)
+    if user_id is not None:
+        queryset = queryset.filter(user=user_id)
+
+    # Filtering by Gender
+    gender = params.get('gender', None)
+    if gender is not None:
+        queryset = queryset.filter(gender=gender)
+
+    return queryset
@@ -0,0 +1,281 @@
+"""
+Offline geocoding and "near me" search.
+
+Free-text locations ("Austin, TX", "paris") are looked up in the gazetteer
+bundled as pets/data/gazetteer.csv, major cities with their coordinates, so
+no geocoding service is called. Pets, shelters and profiles store the
+result in `latitude` / `longitude`; a pet whose own location is unknown
+takes its shelter's. Unknown places ("Couch") stay null.
+
+Pets also store a geohash of their position: the base-32 cell name, where
+pets sharing a prefix are in the same cell, so a B-tree index over it is a
+spatial index. A radius query turns into a few index range scans, one per
+cell covering the circle's bounding box (two boxes when it crosses the
+antimeridian), then an exact-enough distance test on the rows found.
+Distances use the equirectangular approximation, plain arithmetic the
+database evaluates natively, within 1% of the great-circle distance up to
+MAX_RADIUS_KM.
+"""
+import csv
+import functools
+import math
+import re
+import unicodedata
+from pathlib import Path
+
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from .models import Pet, Shelter
+
+GAZETTEER_PATH = Path(__file__).resolve().parent / 'data' / 'gazetteer.csv'
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+# About 5 x 5 m cells, far below the gazetteer's precision
+GEOHASH_PRECISION = 9
+# Index ranges scanned by one radius query, at most
+MAX_CELLS = 16
+MAX_RADIUS_KM = 500
+KM_PER_DEGREE = 111.32
+
+# State names, so "Portland, Maine" is not read as the larger Portland, Oregon
+US_STATES = {
+    'alabama': 'al', 'alaska': 'ak', 'arizona': 'az', 'arkansas': 'ar', 'california': 'ca', 'colorado': 'co',
+    'connecticut': 'ct', 'delaware': 'de', 'district of columbia': 'dc', 'florida': 'fl', 'georgia': 'ga',
+    'hawaii': 'hi', 'idaho': 'id', 'illinois': 'il', 'indiana': 'in', 'iowa': 'ia', 'kansas': 'ks',
+    'kentucky': 'ky', 'louisiana': 'la', 'maine': 'me', 'maryland': 'md', 'massachusetts': 'ma',
+    'michigan': 'mi', 'minnesota': 'mn', 'mississippi': 'ms', 'missouri': 'mo', 'montana': 'mt',
+    'nebraska': 'ne', 'nevada': 'nv', 'new hampshire': 'nh', 'new jersey': 'nj', 'new mexico': 'nm',
+    'new york': 'ny', 'north carolina': 'nc', 'north dakota': 'nd', 'ohio': 'oh', 'oklahoma': 'ok',
+    'oregon': 'or', 'pennsylvania': 'pa', 'puerto rico': 'pr', 'rhode island': 'ri', 'south carolina': 'sc',
+    'south dakota': 'sd', 'tennessee': 'tn', 'texas': 'tx', 'utah': 'ut', 'vermont': 'vt', 'virginia': 'va',
+    'washington': 'wa', 'west virginia': 'wv', 'wisconsin': 'wi', 'wyoming': 'wy',
+}
+
+
+def normalize(text):
+    """Lowercase ASCII words: "São Paulo" -> "sao paulo", "St. Louis" -> "st louis"."""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+@functools.lru_cache(maxsize=None)
+def gazetteer_rows():
+    """The gazetteer's places as dicts, most populous first."""
+    with open(GAZETTEER_PATH, newline='', encoding='utf-8') as file:
+        return sorted(csv.DictReader(file), key=lambda row: -int(row['population']))
+
+
+@functools.lru_cache(maxsize=None)
+def gazetteer():
+    """Normalized place name, alone or with its region or country code -> `(latitude, longitude)`."""
+    places = {}
+    # Most populous first: an ambiguous bare name is the largest place
+    for row in gazetteer_rows():
+        name = normalize(row['name'])
+        point = (float(row['latitude']), float(row['longitude']))
+        places.setdefault(name, point)
+        for qualifier in (row['admin'], row['country']):
+            if qualifier:
+                places.setdefault(f'{name} {normalize(qualifier)}', point)
+    return places
+
+
+def geocode(location):
+    """`(latitude, longitude)` of a free-text location, or None."""
+    if not location:
+        return None
+    places = gazetteer()
+    parts = [part for part in map(normalize, location.split(',')) if part]
+    if not parts:
+        return None
+    # Qualifiers only: "New York" the place is not "NY" the state
+    parts[1:] = [US_STATES.get(part, part) for part in parts[1:]]
+    # "Springfield, IL, USA": the place, then the place qualified by each other part
+    candidates = [' '.join(parts), *(f'{parts[0]} {qualifier}' for qualifier in parts[1:]), parts[0]]
+    for candidate in candidates:
+        if candidate in places:
+            return places[candidate]
+    return None
+
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash of a point: alternate longitude and latitude bisections, 5 bits per character."""
+    bounds = [[-180.0, 180.0], [-90.0, 90.0]]
+    value = (longitude, latitude)
+    cell = []
+    bits = 0
+    for bit in range(precision * 5):
+        axis = bounds[bit % 2]
+        middle = (axis[0] + axis[1]) / 2
+        if value[bit % 2] >= middle:
+            bits = bits * 2 + 1
+            axis[0] = middle
+        else:
+            bits *= 2
+            axis[1] = middle
+        if bit % 5 == 4:
+            cell.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+    return ''.join(cell)
+
+
+def cell_size(precision):
+    """`(height, width)` in degrees of the geohash cells of `precision`."""
+    bits = precision * 5
+    return 180 / 2 ** (bits // 2), 360 / 2 ** (bits - bits // 2)
+
+
+def bounding_boxes(latitude, longitude, radius_km):
+    """
+    `(south, north, west, east)` boxes around a circle, within the map: one,
+    or two when the circle crosses the antimeridian, split at ±180.
+    """
+    delta_latitude = radius_km / KM_PER_DEGREE
+    delta_longitude = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    south, north = max(latitude - delta_latitude, -90), min(latitude + delta_latitude, 90)
+    west, east = longitude - delta_longitude, longitude + delta_longitude
+    if east - west >= 360:
+        return [(south, north, -180, 180)]
+    if west < -180:
+        return [(south, north, west + 360, 180), (south, north, -180, east)]
+    if east > 180:
+        return [(south, north, west, 180), (south, north, -180, east - 360)]
+    return [(south, north, west, east)]
+
+
+def covering_cells(south, north, west, east):
+    """The finest geohash cells, MAX_CELLS at most, covering a bounding box."""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor((north + 90) / height) - math.floor((south + 90) / height) + 1
+        columns = math.floor((east + 180) / width) - math.floor((west + 180) / width) + 1
+        if rows * columns <= MAX_CELLS or precision == 1:
+            break
+    cells = set()
+    first_row, first_column = math.floor((south + 90) / height), math.floor((west + 180) / width)
+    for row in range(rows):
+        for column in range(columns):
+            # The center of each cell, kept inside the map
+            cell_latitude = min((first_row + row + 0.5) * height - 90, 90 - height / 2)
+            cell_longitude = min((first_column + column + 0.5) * width - 180, 180 - width / 2)
+            cells.add(geohash(cell_latitude, cell_longitude, precision))
+    return sorted(cells)
+
+
+def next_prefix(prefix):
+    """The first geohash after every geohash starting with `prefix`, or None."""
+    while prefix and prefix[-1] == GEOHASH_ALPHABET[-1]:
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + GEOHASH_ALPHABET[GEOHASH_ALPHABET.index(prefix[-1]) + 1]
+
+
+def nearest(queryset, latitude, longitude, radius_km):
+    """
+    Rows of `queryset` (geocoded, with a `geohash`) within `radius_km` of a
+    point, nearest first, read through the geohash index. Each row gets a
+    `distance_squared`, see `distance_km`.
+    """
+    boxes = bounding_boxes(latitude, longitude, radius_km)
+    cells = longitudes = Q()
+    for south, north, west, east in boxes:
+        for prefix in covering_cells(south, north, west, east):
+            upper = next_prefix(prefix)
+            cells |= Q(geohash__gte=prefix, geohash__lt=upper) if upper else Q(geohash__gte=prefix)
+        longitudes |= Q(longitude__range=(west, east))
+
+    row_longitude = F('longitude')
+    if len(boxes) > 1 or boxes[0][2:] == (-180, 180):
+        # Across the antimeridian, measure rows from the point's side of it
+        row_longitude = Case(
+            When(longitude__gt=longitude + 180, then=F('longitude') - 360),
+            When(longitude__lt=longitude - 180, then=F('longitude') + 360),
+            default=F('longitude'),
+        )
+
+    # Squared equirectangular distance in degrees of latitude, with the cosine
+    # of the mid latitude to first order: no square root nor trigonometry per
+    # row, which SQLite would run in Python
+    delta_latitude = F('latitude') - latitude
+    delta_longitude = (row_longitude - longitude) * (
+        math.cos(math.radians(latitude)) - math.sin(math.radians(latitude)) * math.pi / 360 * delta_latitude
+    )
+    distance_squared = delta_latitude * delta_latitude + delta_longitude * delta_longitude
+    return (
+        queryset.filter(cells, longitudes, latitude__range=boxes[0][:2])
+        .annotate(distance_squared=distance_squared)
+        .filter(distance_squared__lte=(radius_km / KM_PER_DEGREE) ** 2)
+        .order_by('distance_squared', 'id')
+    )
+
+
+def distance_km(distance_squared):
+    """Kilometers from a `distance_squared` of `nearest`."""
+    return KM_PER_DEGREE * math.sqrt(distance_squared)
+
+
+def shelter_point(shelter_id):
+    if shelter_id is None:
+        return None
+    point = Shelter.objects.filter(pk=shelter_id, latitude__isnull=False).values_list('latitude', 'longitude').first()
+    return tuple(point) if point else None
+
+
+def geocode_instance(instance):
+    """
+    Set the coordinates of an unsaved pet, shelter or profile from its
+    location. Returns whether they changed.
+    """
+    before = (instance.latitude, instance.longitude)
+    point = geocode(instance.location)
+    if point is None and isinstance(instance, Pet):
+        point = shelter_point(instance.shelter_id)
+    instance.latitude, instance.longitude = point or (None, None)
+    if isinstance(instance, Pet):
+        instance.geohash = geohash(*point) if point else None
+    return before != (instance.latitude, instance.longitude)
+
+
+def geocode_rows(queryset, chunk_size=2000):
+    """
+    Store the coordinates of the pets, shelters or profiles in `queryset`
+    from their locations, in chunks, one UPDATE per distinct place. Returns
+    the number of rows whose coordinates changed.
+    """
+    model = queryset.model
+    fields = ('pk', 'location', 'latitude', 'longitude', 'shelter_id') if model is Pet else ('pk', 'location', 'latitude', 'longitude')
+    changed = 0
+    chunk = []
+    for row in queryset.order_by('pk').values_list(*fields).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            changed += store_points(model, chunk)
+            chunk = []
+    return changed + store_points(model, chunk)
+
+
+def store_points(model, rows):
+    shelters = {}
+    if model is Pet:
+        shelter_ids = {row[4] for row in rows if row[4] is not None}
+        shelters = {
+            pk: (latitude, longitude) for pk, latitude, longitude
+            in Shelter.objects.filter(pk__in=shelter_ids, latitude__isnull=False).values_list('pk', 'latitude', 'longitude')
+        }
+    pks_by_point = {}
+    for row in rows:
+        point = geocode(row[1])
+        if point is None and model is Pet:
+            point = shelters.get(row[4])
+        if point != ((row[2], row[3]) if row[2] is not None else None):
+            pks_by_point.setdefault(point, []).append(row[0])
+    for point, pks in pks_by_point.items():
+        values = {'latitude': point[0], 'longitude': point[1]} if point else {'latitude': None, 'longitude': None}
+        if model is Pet:
+            values['geohash'] = geohash(*point) if point else None
+            # update() skips auto_now; exports track changes by date_updated
+            values['date_updated'] = timezone.now()
+        model.objects.filter(pk__in=pks).update(**values)
+    return sum(len(pks) for pks in pks_by_point.values())
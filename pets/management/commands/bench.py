@@ -0,0 +1,408 @@
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, WSGIServer
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from pets.seeding import SEED_PASSWORD, SEED_USERNAME, seed_dataset
+
+ENDPOINTS = (
+    'pets_list', 'pet_detail', 'shelters_list', 'shelter_detail', 'users_all', 'pet_comments', 'user_likes',
+    'login', 'register',
+    'async_pets_list', 'async_pet_detail', 'async_shelters_list', 'async_shelter_detail', 'async_pet_comments',
+)
+# threaded: a thread per request; sync: one request at a time, like a sync
+# gunicorn worker; asgi: one uvicorn worker (event loop)
+SERVERS = ('threaded', 'sync', 'asgi')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchWSGIServer(WSGIServer):
+    # Queue every client's connection instead of refusing some
+    request_queue_size = 1024
+
+
+class ThreadedBenchWSGIServer(ThreadedWSGIServer):
+    request_queue_size = 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the API over HTTP. Seeds a throwaway database (the test database), serves it with a '
+        'WSGI or ASGI server and drives each endpoint with concurrent clients. Prints throughput, '
+        'p50/p95/p99 latency and requests in flight per endpoint as JSON; --compare prints the change '
+        'against an earlier run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pets', type=int, default=2000, help='Pets to seed.')
+        parser.add_argument('--users', type=int, default=200, help='Users to seed.')
+        parser.add_argument('--comments', type=int, default=10000, help='Comments to seed.')
+        parser.add_argument('--likes', type=int, default=10000, help='Likes to seed.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the dataset and of the request mix.')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per endpoint before measuring.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients.')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help=f"Comma-separated subset of: {', '.join(ENDPOINTS)}.")
+        parser.add_argument('--server', choices=SERVERS, default='threaded', help='How the API is served (default: threaded WSGI).')
+        parser.add_argument('--query-delay', type=float, default=0, help='Milliseconds added to every SQL query, to mimic a remote database.')
+        parser.add_argument('--authenticated', action='store_true', help='Send a token with every request (bypasses the anonymous response cache).')
+        parser.add_argument('--count-queries', action='store_true', help='Also report SQL queries per request (instruments every request).')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--compare', help='Earlier JSON report to compare against.')
+
+    def handle(self, *args, **options):
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}.")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        workdir = tempfile.mkdtemp(prefix='pets-bench-')
+        # The search index, cache entries and (for SQLite) the database itself
+        # must not mix with the development ones.
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+        # Query counts are read from the Server-Timing headers, not the logs
+        logging.getLogger('pets.queries').setLevel(logging.WARNING)
+        caches = {alias: dict(config, KEY_PREFIX=f'bench-{os.getpid()}') for alias, config in settings.CACHES.items()}
+        try:
+            with override_settings(SEARCH_INDEX_DIR=workdir, CACHES=caches, QUERY_SAMPLE_RATE=1 if options['count_queries'] else 0):
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                try:
+                    report = self.run(endpoints, options)
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if baseline:
+            # Keep stdout valid JSON when the report goes there
+            stream = self.stdout if options['output'] else self.stderr
+            stream.write(self.comparison(baseline, report))
+
+    def run(self, endpoints, options):
+        started = time.perf_counter()
+        dataset = seed_dataset(
+            users=options['users'], pets=options['pets'], comments=options['comments'],
+            likes=options['likes'], seed=options['seed'],
+        )
+        if not dataset['pets'] or not dataset['users']:
+            raise CommandError('The benchmark needs at least one pet and one user.')
+        seeding_time = time.perf_counter() - started
+        token = Token.objects.create(user_id=dataset['users'][0]).key
+
+        if options['query_delay']:
+            delay = options['query_delay'] / 1000
+
+            def slow_execute(execute, sql, params, many, context):
+                time.sleep(delay)
+                return execute(sql, params, many, context)
+
+            def add_delay(sender, connection, **kwargs):
+                # Fired again each time a thread's connection reconnects
+                if slow_execute not in connection.execute_wrappers:
+                    connection.execute_wrappers.append(slow_execute)
+
+            # Connections opened by the server from now on
+            connection_created.connect(add_delay, weak=False, dispatch_uid='bench-query-delay')
+
+        self.in_flight = InFlight()
+        port, stop_server = self.start_server(options['server'])
+        base_url = f'http://127.0.0.1:{port}/api'
+        try:
+            client = Client(base_url, token if options['authenticated'] else None, token)
+            rng = random.Random(options['seed'])
+            results = {}
+            for name in endpoints:
+                make_request = getattr(self, f'request_{name}')
+                requests = [make_request(rng, dataset) for _ in range(options['warmup'] + options['requests'])]
+                results[name] = self.measure(client, requests[:options['warmup']], requests[options['warmup']:], options['concurrency'])
+                self.stderr.write(
+                    f"{name}: {results[name]['rps']} req/s, p50 {results[name]['p50_ms']} ms, "
+                    f"p95 {results[name]['p95_ms']} ms, p99 {results[name]['p99_ms']} ms"
+                )
+        finally:
+            stop_server()
+            connection_created.disconnect(dispatch_uid='bench-query-delay')
+
+        return {
+            'meta': {
+                'commit': git_commit(),
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'dataset': {key: options[key] for key in ('users', 'pets', 'comments', 'likes', 'seed')},
+                'seeding_s': round(seeding_time, 2),
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'authenticated': options['authenticated'],
+                'server': options['server'],
+                'query_delay_ms': options['query_delay'],
+            },
+            'endpoints': results,
+        }
+
+    def start_server(self, kind):
+        """Serve the API on a free port. Returns the port and a function stopping the server."""
+        if kind == 'asgi':
+            try:
+                import uvicorn
+            except ImportError:
+                raise CommandError('--server asgi needs uvicorn (pip install uvicorn).')
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            handler = ASGIHandler()
+
+            async def application(scope, receive, send):
+                self.in_flight.change(1)
+                try:
+                    await handler(scope, receive, send)
+                finally:
+                    self.in_flight.change(-1)
+
+            server = uvicorn.Server(uvicorn.Config(application, lifespan='off', log_level='warning', backlog=1024))
+            thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+            thread.start()
+            while not server.started:
+                if not thread.is_alive():
+                    raise CommandError('The ASGI server failed to start.')
+                time.sleep(0.01)
+
+            def stop():
+                server.should_exit = True
+                thread.join()
+                sock.close()
+            return sock.getsockname()[1], stop
+
+        server_class = ThreadedBenchWSGIServer if kind == 'threaded' else BenchWSGIServer
+        server = server_class(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+        handler = WSGIHandler()
+
+        def application(environ, start_response):
+            self.in_flight.change(1)
+            try:
+                return handler(environ, start_response)
+            finally:
+                self.in_flight.change(-1)
+
+        server.set_app(application)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+        return server.server_address[1], stop
+
+    # Request factories: (method, path, JSON body, requires a token)
+
+    def request_pets_list(self, rng, dataset):
+        return ('GET', '/pets/', None, False)
+
+    def request_pet_detail(self, rng, dataset):
+        return ('GET', f"/pets/{rng.choice(dataset['pets'])}/", None, False)
+
+    def request_shelters_list(self, rng, dataset):
+        return ('GET', '/shelters/', None, False)
+
+    def request_shelter_detail(self, rng, dataset):
+        return ('GET', f"/shelters/{rng.choice(dataset['shelters'])}/", None, False)
+
+    def request_users_all(self, rng, dataset):
+        return ('GET', '/users/all/', None, False)
+
+    def request_pet_comments(self, rng, dataset):
+        return ('GET', f"/pets/{rng.choice(dataset['pets'])}/comments/", None, False)
+
+    def request_user_likes(self, rng, dataset):
+        # Listing likes requires authentication
+        return ('GET', f"/users/{dataset['users'][0]}/likes/", None, True)
+
+    def request_login(self, rng, dataset):
+        username = SEED_USERNAME.format(rng.choice(dataset['users']))
+        return ('POST', '/login/', {'username': username, 'password': SEED_PASSWORD}, False)
+
+    _registrations = itertools.count()
+
+    def request_register(self, rng, dataset):
+        number = next(self._registrations)
+        return ('POST', '/register/', {
+            'username': f'bench_{number}', 'email': f'bench_{number}@example.com', 'password': SEED_PASSWORD,
+            'first_name': 'Bench', 'last_name': str(number),
+        }, False)
+
+    def request_async_pets_list(self, rng, dataset):
+        return ('GET', '/async/pets/', None, False)
+
+    def request_async_pet_detail(self, rng, dataset):
+        return ('GET', f"/async/pets/{rng.choice(dataset['pets'])}/", None, False)
+
+    def request_async_shelters_list(self, rng, dataset):
+        return ('GET', '/async/shelters/', None, False)
+
+    def request_async_shelter_detail(self, rng, dataset):
+        return ('GET', f"/async/shelters/{rng.choice(dataset['shelters'])}/", None, False)
+
+    def request_async_pet_comments(self, rng, dataset):
+        return ('GET', f"/async/pets/{rng.choice(dataset['pets'])}/comments/", None, False)
+
+    def measure(self, client, warmup, requests, concurrency):
+        for request in warmup:
+            client.send(*request)
+        self.in_flight.reset()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            started = time.perf_counter()
+            outcomes = list(executor.map(lambda request: client.send(*request), requests))
+            elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for latency, _, _ in outcomes)
+        result = {
+            'requests': len(outcomes),
+            'errors': sum(1 for _, status, _ in outcomes if not 200 <= status < 300),
+            'rps': round(len(outcomes) / elapsed, 1) if elapsed else None,
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        }
+        for percentile in (50, 95, 99):
+            result[f'p{percentile}_ms'] = round(nearest_rank(latencies, percentile) * 1000, 2) if latencies else None
+        result['max_ms'] = round(latencies[-1] * 1000, 2) if latencies else None
+        # Requests inside the application at once, queued connections excluded
+        result['in_flight_avg'], result['in_flight_max'] = self.in_flight.stats()
+        queries = [count for _, _, count in outcomes if count is not None]
+        if queries:
+            result['queries'] = round(sum(queries) / len(queries), 1)
+        return result
+
+    def comparison(self, baseline, report):
+        lines = [f"Compared with {baseline['meta'].get('commit') or 'baseline'}:"]
+        for name, result in report['endpoints'].items():
+            before = baseline.get('endpoints', {}).get(name)
+            if not before:
+                continue
+            changes = []
+            for metric in ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'in_flight_avg'):
+                old, new = before.get(metric), result.get(metric)
+                if old and new is not None:
+                    changes.append(f'{metric} {old} -> {new} ({(new - old) / old * 100:+.1f}%)')
+            lines.append(f"  {name}: {', '.join(changes)}")
+        return '\n'.join(lines)
+
+
+class InFlight:
+    """Time-weighted average and peak of the requests being handled at once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.peak = self.current
+            self.area = 0.0
+            self.since = self.last = time.perf_counter()
+
+    def change(self, delta):
+        with self.lock:
+            now = time.perf_counter()
+            self.area += self.current * (now - self.last)
+            self.last = now
+            self.current += delta
+            self.peak = max(self.peak, self.current)
+
+    def stats(self):
+        """`(average, peak)` since the last reset."""
+        self.change(0)
+        elapsed = self.last - self.since
+        return (round(self.area / elapsed, 1) if elapsed else None), self.peak
+
+
+class Client:
+    """Plain urllib client, one connection per request like most API clients."""
+
+    def __init__(self, base_url, token=None, auth_token=None):
+        self.base_url = base_url
+        # Token sent with every request, and the one for endpoints requiring authentication
+        self.token = token
+        self.auth_token = auth_token
+        self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+    def send(self, method, path, body, requires_token):
+        """Return `(latency in seconds, HTTP status, SQL queries or None)`."""
+        headers = {'Accept': 'application/json'}
+        token = self.auth_token if requires_token else self.token
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=120) as response:
+                response.read()
+                status, timing = response.status, response.headers.get('Server-Timing')
+        except urllib.error.HTTPError as exc:
+            exc.read()
+            status, timing = exc.code, exc.headers.get('Server-Timing')
+        except OSError:
+            status, timing = 0, None
+        return time.perf_counter() - started, status, query_count(timing)
+
+
+def query_count(server_timing):
+    """The query count of a `db;desc="N queries"` Server-Timing entry."""
+    if not server_timing or 'db;desc="' not in server_timing:
+        return None
+    return int(server_timing.split('db;desc="', 1)[1].split(' ', 1)[0])
+
+
+def nearest_rank(sorted_values, percentile):
+    index = max(0, min(len(sorted_values) - 1, -(-len(sorted_values) * percentile // 100) - 1))
+    return sorted_values[index]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
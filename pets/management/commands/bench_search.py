@@ -0,0 +1,80 @@
+import itertools
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from pets.search import SearchIndex
+
+
+WORDS = (
+    'playful calm shy friendly energetic loyal gentle curious lazy fluffy tiny giant senior puppy kitten '
+    'house trained cuddly independent vocal quiet smart stubborn active sweet goofy brave anxious social '
+    'loves walks fetch naps treats children cats dogs garden couch sun water toys running climbing belly rubs'
+).split()
+SYLLABLES = 'ba be bo ka ki ko la li lo ma mi mo na ni no pa pi po ra ri ro sa si so ta ti to'.split()
+
+
+def vocabulary(rng, size):
+    """Common pet words followed by made-up words for the long tail."""
+    words = list(WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class Command(BaseCommand):
+    help = 'Measure search index build, snapshot and query latency on a synthetic catalogue (no database needed).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pets', type=int, default=100000, help='Number of synthetic pets to index.')
+        parser.add_argument('--queries', type=int, default=500, help='Number of timed queries.')
+        parser.add_argument('--vocabulary', type=int, default=20000, help='Number of distinct words.')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = vocabulary(rng, options['vocabulary'])
+        # Zipf word frequencies so a few terms are common and most are rare
+        weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+
+        def text(length):
+            return ' '.join(rng.choices(words, cum_weights=weights, k=length))
+
+        index = SearchIndex()
+        started = time.perf_counter()
+        for pet_id in range(1, options['pets'] + 1):
+            index.add(pet_id, f'{text(2)} {text(rng.randint(10, 40))} {text(rng.randint(3, 12))}')
+        build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        snapshot = index.dumps()
+        dump = time.perf_counter() - started
+        started = time.perf_counter()
+        SearchIndex.loads(snapshot)
+        load = time.perf_counter() - started
+
+        latencies = []
+        for _ in range(options['queries']):
+            query = text(rng.randint(1, 3))
+            started = time.perf_counter()
+            index.search(query, limit=20)
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+        self.stdout.write(f'pets:          {len(index)}')
+        self.stdout.write(f'terms:         {len(index.postings)}')
+        self.stdout.write(f'build:         {build:.2f}s')
+        self.stdout.write(f'snapshot:      {len(snapshot) / 1024 / 1024:.1f} MiB, dump {dump:.2f}s, load {load:.2f}s')
+        self.stdout.write(
+            f'query latency: p50 {percentile(50):.1f}ms  p95 {percentile(95):.1f}ms  '
+            f'p99 {percentile(99):.1f}ms  mean {statistics.mean(latencies):.1f}ms'
+        )
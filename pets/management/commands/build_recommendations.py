@@ -0,0 +1,24 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pets.recommendations import build_recommendations, refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Compute the pet recommendations of every user from the likes, for /api/users/{id}/recommendations/. '
+        'With --pending, only refresh the users who liked or unliked a pet since the last run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pending', action='store_true', help='Incremental refresh of the queued users only.')
+        parser.add_argument('--workers', type=int, default=settings.SIMILAR_PETS_WORKERS or 1, help='Scoring processes.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        refresh = refresh_recommendations if options['pending'] else build_recommendations
+        users = refresh(workers=options['workers'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Computed the recommendations of {users} user(s) in {elapsed:.1f}s.'))
@@ -0,0 +1,24 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pets.similarity import build_similar_pets, refresh_similar_pets
+
+
+class Command(BaseCommand):
+    help = (
+        'Compute the most similar pets of every pet for /api/pets/{id}/similar/. With --pending, only '
+        'refresh the pets whose tags, type, shelter or age changed since the last run, and those around them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pending', action='store_true', help='Incremental refresh of the queued pets only.')
+        parser.add_argument('--workers', type=int, default=settings.SIMILAR_PETS_WORKERS or 1, help='Scoring processes.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        refresh = refresh_similar_pets if options['pending'] else build_similar_pets
+        pets = refresh(workers=options['workers'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Computed the similar pets of {pets} pet(s) in {elapsed:.1f}s.'))
@@ -0,0 +1,60 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pets.models import Pet, Shelter, UserProfile
+from pets.thumbnails import render_variants, source_path, store_hash
+
+# Model -> image field
+IMAGE_FIELDS = ((Pet, 'img'), (Shelter, 'img'), (UserProfile, 'image'))
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the thumbnail variants of pet, shelter and profile images that have none yet, '
+        'e.g. images saved while the thumbnail queue was full or before thumbnails existed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-render every image, not only those without thumbnails.')
+        parser.add_argument('--workers', type=int, default=settings.THUMBNAIL_WORKERS or 1, help='Rendering processes.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        # Each distinct image is rendered once, whatever the number of rows using it
+        jobs = {}
+        skipped = 0
+        for model, field in IMAGE_FIELDS:
+            rows = model.objects.exclude(**{field: ''})
+            if not options['all']:
+                rows = rows.filter(thumbnail_hash='')
+            for pk, name in rows.values_list('pk', field).iterator(chunk_size=2000):
+                path = source_path(name)
+                if path is None:
+                    skipped += 1
+                    continue
+                jobs.setdefault(path, []).append((model, pk, name))
+
+        failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {path: executor.submit(render_variants, path, str(settings.MEDIA_ROOT)) for path in jobs}
+            for path, future in futures.items():
+                try:
+                    content_hash = future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'{path}: {exc}')
+                    continue
+                pks_by_image = {}
+                for model, pk, name in jobs[path]:
+                    pks_by_image.setdefault((model, name), []).append(pk)
+                for (model, name), pks in pks_by_image.items():
+                    store_hash(model, pks, content_hash, name)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {len(jobs) - failed} image(s) in {elapsed:.1f}s, {failed} failed, '
+            f'{skipped} row(s) without a media image skipped.'
+        ))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pets.geo import geocode_rows
+from pets.models import Pet, Shelter, UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        'Geocode the locations of shelters, pets and user profiles against the bundled gazetteer '
+        '(pets/data/gazetteer.csv), e.g. after an import or an update of the gazetteer. Only rows whose '
+        'coordinates change are written.'
+    )
+
+    def handle(self, *args, **options):
+        # Shelters first: pets without a known location of their own take their shelter's
+        for model in (Shelter, Pet, UserProfile):
+            started = time.perf_counter()
+            changed = geocode_rows(model.objects.all())
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{model._meta.verbose_name_plural.capitalize()}: {changed} updated in {elapsed:.1f}s.')
+        self.stdout.write(self.style.SUCCESS('Geocoded all locations.'))
@@ -0,0 +1,145 @@
+import csv
+import json
+import os
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from pets.bulk import bulk_create_pets
+from pets.models import ImportCheckpoint, Pet, Shelter, Tag
+from pets.serializers import PetBulkSerializer
+
+# Row columns describing the pet's shelter rather than the pet
+SHELTER_COLUMNS = {'shelter': 'name', 'shelter_location': 'location', 'shelter_description': 'description'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream pets (and their shelters and tags) from a CSV or JSONL file into the database '
+        'in batched inserts. Shelters and tags are matched by name and created when missing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file, or - for stdin.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Input format (default: from the file extension).')
+        parser.add_argument('--user', required=True, help='Username owning the imported pets and new shelters.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Pets inserted per transaction.')
+        parser.add_argument('--tag-separator', default='|', help='Separator of the tags column in CSV files.')
+        parser.add_argument('--checkpoint', help='Checkpoint name (default: the absolute input path).')
+        parser.add_argument('--resume', action='store_true', help='Skip the rows committed before the last failure.')
+        parser.add_argument('--strict', action='store_true', help='Stop at the first invalid row instead of skipping it.')
+
+    def handle(self, *args, **options):
+        try:
+            self.user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist.")
+
+        path = options['path']
+        input_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        if path == '-' and not options['format']:
+            raise CommandError('--format is required when reading from stdin.')
+        checkpoint = options['checkpoint'] or (None if path == '-' else os.path.abspath(path))
+        skip = self.read_checkpoint(checkpoint) if options['resume'] else 0
+        self.tag_separator = options['tag_separator']
+        self.strict = options['strict']
+        # One serializer validates every row, so its fields are built only once
+        self.validator = PetBulkSerializer()
+
+        # In-memory name -> id maps, so rows never look up shelters or tags one by one
+        self.shelters = dict(Shelter.objects.values_list('name', 'id'))
+        self.tags = dict(Tag.objects.values_list('name', 'id'))
+
+        handle = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        started = time.perf_counter()
+        imported = skipped = 0
+        row_number = 0
+        pets, tag_ids = [], []
+        try:
+            for row_number, row in enumerate(self.read_rows(handle, input_format), start=1):
+                if row_number <= skip:
+                    continue
+                pet, pet_tag_ids = self.build_pet(row_number, row)
+                if pet is None:
+                    skipped += 1
+                    continue
+                pets.append(pet)
+                tag_ids.append(pet_tag_ids)
+                if len(pets) >= options['batch_size']:
+                    imported += self.flush(pets, tag_ids, row_number, checkpoint, started, imported)
+                    pets, tag_ids = [], []
+            imported += self.flush(pets, tag_ids, row_number, checkpoint, started, imported)
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+
+        elapsed = time.perf_counter() - started
+        if checkpoint:
+            ImportCheckpoint.objects.filter(name=checkpoint).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} pets in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:.0f} rows/s), '
+            f'skipped {skipped} invalid row(s), resumed after {skip} row(s).'
+        ))
+
+    def read_rows(self, handle, input_format):
+        """Yield one dict per input row without reading the whole file."""
+        if input_format == 'csv':
+            yield from csv.DictReader(handle)
+            return
+        for line in handle:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+    def build_pet(self, row_number, row):
+        """An unsaved Pet and its tag ids, or (None, None) for an invalid row."""
+        row = {key: value for key, value in row.items() if value not in (None, '')}
+        shelter_fields = {field: row.pop(column) for column, field in SHELTER_COLUMNS.items() if column in row}
+        tags = row.pop('tags', [])
+        if isinstance(tags, str):
+            tags = [tag.strip() for tag in tags.split(self.tag_separator) if tag.strip()]
+
+        try:
+            data = dict(self.validator.run_validation(row))
+        except ValidationError as exc:
+            message = f'Row {row_number}: {json.dumps(exc.detail)}'
+            if self.strict:
+                raise CommandError(message)
+            self.stderr.write(message)
+            return None, None
+        data.pop('tags', None)
+        shelter_id = self.shelter_id(shelter_fields) if shelter_fields.get('name') else None
+        return Pet(shelter_id=shelter_id, user=self.user, **data), [self.tag_id(name) for name in tags]
+
+    def shelter_id(self, fields):
+        name = fields['name']
+        if name not in self.shelters:
+            self.shelters[name] = Shelter.objects.create(user=self.user, **fields).id
+        return self.shelters[name]
+
+    def tag_id(self, name):
+        if name not in self.tags:
+            self.tags[name] = Tag.objects.get_or_create(name=name)[0].id
+        return self.tags[name]
+
+    def flush(self, pets, tag_ids, row_number, checkpoint, started, imported):
+        """Insert one batch and record its last row in the same transaction."""
+        with transaction.atomic():
+            if pets:
+                bulk_create_pets(pets, tag_ids)
+            if checkpoint:
+                ImportCheckpoint.objects.update_or_create(name=checkpoint, defaults={'row': row_number})
+        total = imported + len(pets)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{total} pets imported, row {row_number} ({total / elapsed if elapsed else 0:.0f} rows/s)')
+        return len(pets)
+
+    @staticmethod
+    def read_checkpoint(checkpoint):
+        if not checkpoint:
+            return 0
+        return ImportCheckpoint.objects.filter(name=checkpoint).values_list('row', flat=True).first() or 0
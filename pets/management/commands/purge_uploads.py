@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pets.models import Upload
+from pets.uploads import remove_files
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that were started but not finished, and their part files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Age after which an unfinished upload is abandoned.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        abandoned = Upload.objects.filter(status='pending', date_created__lt=cutoff)
+        total = 0
+        for upload in abandoned.iterator():
+            remove_files(upload)
+            total += 1
+        abandoned.delete()
+        # Finished uploads are only kept for their clients to read the result
+        Upload.objects.filter(status='complete', date_created__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Purged {total} abandoned upload(s).'))
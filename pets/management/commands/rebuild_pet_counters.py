@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from pets.models import Comment, Like, Pet
+
+
+class Command(BaseCommand):
+    help = 'Recompute Pet.like_count and Pet.comment_count and report the pets that had drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted counters, do not fix them.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of pets updated per query.')
+
+    def handle(self, *args, **options):
+        drifted = (
+            Pet.objects.annotate(actual_likes=self.count_of(Like), actual_comments=self.count_of(Comment))
+            .filter(~Q(like_count=F('actual_likes')) | ~Q(comment_count=F('actual_comments')))
+            .only('id', 'like_count', 'comment_count')
+            .order_by('id')
+        )
+
+        # Batches by primary key range, each fully read before it is written:
+        # updating rows under an open cursor over the same table is unsafe
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(drifted.filter(id__gt=last_id)[:options['batch_size']])
+            for pet in batch:
+                self.stdout.write(
+                    f'Pet {pet.id}: likes {pet.like_count} -> {pet.actual_likes}, '
+                    f'comments {pet.comment_count} -> {pet.actual_comments}'
+                )
+                pet.like_count = pet.actual_likes
+                pet.comment_count = pet.actual_comments
+            self.save(batch, options['dry_run'])
+            total += len(batch)
+            if len(batch) < options['batch_size']:
+                break
+            last_id = batch[-1].id
+
+        action = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{total} drifted pet counter(s) {action}.'))
+
+    @staticmethod
+    def count_of(model):
+        rows = model.objects.filter(pet=OuterRef('pk')).order_by().values('pet').annotate(n=Count('id')).values('n')
+        return Coalesce(Subquery(rows), 0)
+
+    @staticmethod
+    def save(pets, dry_run):
+        if pets and not dry_run:
+            Pet.objects.bulk_update(pets, ['like_count', 'comment_count'])
@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from pets.search import rebuild_index
+from pets.seeding import SEED_PASSWORD, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a large, skewed, reproducible dataset of users, shelters, tags, pets, likes and comments '
+        'with batched inserts in parallel worker processes. The defaults create about 5M rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--shelters', type=int, default=2000)
+        parser.add_argument('--tags', type=int, default=500)
+        parser.add_argument('--pets', type=int, default=500000)
+        parser.add_argument('--likes', type=int, default=2000000, help='Approximate number of likes.')
+        parser.add_argument('--comments', type=int, default=1500000, help='Approximate number of comments.')
+        parser.add_argument('--seed', type=int, default=0, help='Same seed and sizes, same data.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes (SQLite always uses 1).')
+        parser.add_argument('--no-index', action='store_true', help='Skip rebuilding the search index afterwards.')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and options['workers'] > 1:
+            self.stdout.write('SQLite allows a single writer, seeding in one process.')
+
+        started = time.perf_counter()
+        total = 0
+
+        def progress(rows):
+            nonlocal total
+            total += rows
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{total} rows ({total / elapsed if elapsed else 0:.0f} rows/s)')
+
+        sizes = {key: options[key] for key in ('users', 'shelters', 'tags', 'pets', 'likes', 'comments')}
+        try:
+            ranges = seed_dataset(seed=options['seed'], workers=options['workers'], progress=progress, **sizes)
+        except ValueError as exc:
+            raise CommandError(exc)
+        elapsed = time.perf_counter() - started
+
+        if not options['no_index']:
+            self.stdout.write('Rebuilding the search index...')
+            rebuild_index()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s). "
+            f"Users {ranges['users'].start}-{ranges['users'].stop - 1} log in with password '{SEED_PASSWORD}'."
+        ))
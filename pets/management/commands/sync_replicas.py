@@ -0,0 +1,33 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the SQLite primary database onto the SQLite replicas in DB_REPLICA_URLS, standing in for '
+        'replication when trying the read-replica routing locally. Run it again to "replicate" new writes.'
+    )
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No replicas configured, set DB_REPLICA_URLS.')
+        aliases = [DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS]
+        if any(connections[alias].vendor != 'sqlite' for alias in aliases):
+            raise CommandError('Only SQLite databases can be copied; other databases replicate themselves.')
+
+        primary = sqlite3.connect(connections[DEFAULT_DB_ALIAS].settings_dict['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                connections[alias].close()
+                replica = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                try:
+                    # Online backup: a consistent copy even while the primary is in use
+                    primary.backup(replica)
+                finally:
+                    replica.close()
+                self.stdout.write(f'Copied the primary to {alias}.')
+        finally:
+            primary.close()
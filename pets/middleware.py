@@ -0,0 +1,179 @@
+"""
+Per-request SQL instrumentation.
+
+A sampled request runs with an `execute_wrapper` on every database connection
+that counts queries, adds up their time and keeps the slowest statement. The
+totals, tagged with the resolved view and action (e.g. `PetViewSet.list`), are
+returned in a `Server-Timing` header and logged as one JSON line on the
+`pets.queries` logger.
+
+QUERY_SAMPLE_RATE is the fraction of requests instrumented. At 0 (the
+default) the middleware only checks the setting, so leaving it installed costs
+nothing measurable.
+
+Queries run while a streaming response is being sent (e.g. the pet export)
+happen after the middleware returns and are not counted.
+"""
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+logger = logging.getLogger('pets.queries')
+
+# Longest SQL kept in log lines
+SQL_PREVIEW_LENGTH = 300
+
+
+class QueryStats:
+    """`execute_wrapper` callable collecting the queries of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_duration = 0.0
+        self.slowest_sql = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if duration > self.slowest_duration:
+                self.slowest_duration = duration
+                self.slowest_sql = sql
+
+
+def view_name(request):
+    """`ViewSet.action` for DRF views, else the view's name."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None, None
+    view = match.func
+    cls = getattr(view, 'cls', None)
+    if cls is None:
+        return getattr(view, '__name__', match.view_name), None
+    actions = getattr(view, 'actions', None) or {}
+    return cls.__name__, actions.get(request.method.lower(), request.method.lower())
+
+
+def instrument(stats):
+    """An ExitStack with `stats` wrapped around every connection of this thread."""
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(stats))
+    return stack
+
+
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'QUERY_SAMPLE_RATE', 0)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        return self.sample_rate and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        stats = QueryStats()
+        started = time.perf_counter()
+        with instrument(stats):
+            response = self.get_response(request)
+        return self.report(request, response, stats, started)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        stats = QueryStats()
+        started = time.perf_counter()
+        # The async ORM runs queries on the request's sync thread, whose
+        # connections are not the event loop's, so wrap those.
+        stack = await sync_to_async(instrument)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.report(request, response, stats, started)
+
+    def report(self, request, response, stats, started):
+        total = time.perf_counter() - started
+
+        view, action = view_name(request)
+        response['Server-Timing'] = (
+            f'db;desc="{stats.count} queries";dur={stats.duration * 1000:.2f}, '
+            f'db-slowest;dur={stats.slowest_duration * 1000:.2f}, '
+            f'total;dur={total * 1000:.2f}'
+        )
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'view': view,
+            'action': action,
+            'queries': stats.count,
+            'db_ms': round(stats.duration * 1000, 2),
+            'slowest_ms': round(stats.slowest_duration * 1000, 2),
+            'slowest_sql': stats.slowest_sql[:SQL_PREVIEW_LENGTH] if stats.slowest_sql else None,
+            'total_ms': round(total * 1000, 2),
+        }))
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that also runs in async mode. A sync-only middleware anywhere
+    in the stack makes Django run every ASGI request through a thread.
+    In async mode files are streamed by an async iterator, which Django's
+    ASGI handler would otherwise read whole into memory first.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        # A dict lookup of the path; static files are rare on this API
+        response = self.process_request(request)
+        if response is None:
+            return await self.get_response(request)
+        if getattr(response, 'file_to_stream', None) is not None:
+            response.streaming_content = read_async(response.file_to_stream, response.block_size)
+        return response
+
+
+async def read_async(file, block_size):
+    """The blocks of `file`, each read in a worker thread."""
+    read = sync_to_async(file.read, thread_sensitive=False)
+    while True:
+        block = await read(block_size)
+        if not block:
+            return
+        yield block
@@ -0,0 +1,81 @@
+# Generated by Django 4.2.15 on 2026-10-18 20:31
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+    Keep the oldest Like per (pet, user) and Pet_Tag per (pet, tag) so the
+    unique constraints can be created.
+    """
+    for model_name, fields in (('Like', ('pet', 'user')), ('Pet_Tag', ('pet', 'tag'))):
+        model = apps.get_model('pets', model_name)
+        duplicates = (
+            model.objects.values(*fields)
+            .annotate(keep_id=Min('id'), rows=Count('id'))
+            .filter(rows__gt=1)
+        )
+        for duplicate in duplicates:
+            model.objects.filter(**{field: duplicate[field] for field in fields}).exclude(
+                id=duplicate['keep_id']
+            ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pets', '0005_userprofile'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='comment',
+            options={'ordering': ['date_commented']},
+        ),
+        migrations.AlterModelOptions(
+            name='pet',
+            options={'ordering': ['id']},
+        ),
+        migrations.AlterModelOptions(
+            name='shelter',
+            options={'ordering': ['name']},
+        ),
+        migrations.AlterModelOptions(
+            name='userprofile',
+            options={'ordering': ['user__username']},
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['pet', 'date_commented', 'id'], name='comment_pet_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['user', 'date_commented'], name='comment_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(condition=models.Q(('shelter__isnull', False)), fields=['shelter', 'id'], name='pet_shelter_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['user', 'id'], name='pet_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['gender', 'id'], name='pet_gender_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pet_tag',
+            index=models.Index(fields=['tag', 'pet'], name='pet_tag_tag_pet_idx'),
+        ),
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('pet', 'user'), name='unique_like_pet_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='pet_tag',
+            constraint=models.UniqueConstraint(fields=('pet', 'tag'), name='unique_pet_tag'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.15 on 2026-10-18 20:32
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counts(apps, schema_editor):
+    Pet = apps.get_model('pets', 'Pet')
+    Like = apps.get_model('pets', 'Like')
+    Comment = apps.get_model('pets', 'Comment')
+
+    def count_of(model):
+        rows = model.objects.filter(pet=OuterRef('pk')).order_by().values('pet').annotate(n=Count('id')).values('n')
+        return Coalesce(Subquery(rows), 0)
+
+    Pet.objects.update(like_count=count_of(Like), comment_count=count_of(Comment))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pets', '0006_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pet',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pet',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['like_count', 'id'], name='pet_popularity_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.15 on 2026-10-18 21:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pets', '0007_pet_like_count_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pet',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='pet',
+            index=models.Index(fields=['date_updated', 'id'], name='pet_updated_idx'),
+        ),
+    ]
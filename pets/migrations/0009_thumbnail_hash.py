@@ -0,0 +1,28 @@
+# Generated by Django 4.2.15 on 2026-10-18 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pets', '0008_pet_date_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pet',
+            name='thumbnail_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='shelter',
+            name='thumbnail_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='thumbnail_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.15 on 2026-10-18 21:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pets', '0010_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarPetRefresh',
+            fields=[
+                ('pet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='pets.pet')),
+                ('date_requested', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SimilarPet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(help_text='0 for the most similar pet')),
+                ('score', models.FloatField(help_text='Cosine similarity of the two pets, 0 to 1')),
+                ('pet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_pets', to='pets.pet')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pets.pet')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='similarpet',
+            constraint=models.UniqueConstraint(fields=('pet', 'rank'), name='unique_similar_pet_rank'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.15 on 2026-10-18 22:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pets', '0014_comment_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('name', models.CharField(help_text='The --checkpoint name, by default the input path', max_length=255, primary_key=True, serialize=False)),
+                ('row', models.PositiveIntegerField(help_text='Last input row committed')),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
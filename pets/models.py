@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -7,6 +9,11 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='user_images/')
     location = models.CharField(max_length=100)
+    # Geocoded from location, see pets/geo.py
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # Content hash naming the thumbnail variants of the image, see pets/thumbnails.py
+    thumbnail_hash = models.CharField(max_length=32, blank=True, default='')
     
     class Meta:
         ordering = ['user__username']
@@ -19,8 +26,12 @@ class Shelter(models.Model):
     img = models.CharField(max_length=255, null=True, blank=True, default='default_shelter.jpg')
     name = models.CharField(max_length=200, default='Shelter Angels on Earth')
     location = models.CharField(max_length=200, default='Heaven')
+    # Geocoded from location, see pets/geo.py
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
     description = models.TextField(default='A place for animals to live.')
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False, blank=False, related_name='shelters', default='1')
+    thumbnail_hash = models.CharField(max_length=32, blank=True, default='')
     
     class Meta:
         ordering = ['name'] 
@@ -42,13 +53,33 @@ class Pet(models.Model):
     description = models.TextField(default='A pet shrouded in adorable mystery.')
     status = models.CharField(max_length=100, default='Looking for belly rubs')
     location = models.CharField(max_length=255, null=True, blank=True, default='Couch')
+    # Geocoded from location, else the shelter's, see pets/geo.py
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, null=True, blank=True)
     shelter = models.ForeignKey(Shelter, related_name='pets', on_delete=models.CASCADE, null=True, blank=True)
     date_posted = models.DateField(auto_now_add=True, null=True, blank=True)
+    date_updated = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, default=1)
     tags = models.ManyToManyField('Tag', through='Pet_Tag', related_name='pets')
+    # Denormalized counters, maintained by the signals in pets/signals.py
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    thumbnail_hash = models.CharField(max_length=32, blank=True, default='')
     
     class Meta:
         ordering = ['id'] 
+        # Pet listings filter on one of these columns and seek on id (cursor pagination)
+        indexes = [
+            models.Index(fields=['shelter', 'id'], name='pet_shelter_id_idx', condition=models.Q(shelter__isnull=False)),
+            models.Index(fields=['user', 'id'], name='pet_user_id_idx'),
+            models.Index(fields=['gender', 'id'], name='pet_gender_id_idx'),
+            models.Index(fields=['like_count', 'id'], name='pet_popularity_idx'),
+            models.Index(fields=['date_updated', 'id'], name='pet_updated_idx'),
+            # Spatial index of the nearby search: range scans over geohash prefixes,
+            # covering the distance test so only the page's pets are read
+            models.Index(fields=['geohash', 'latitude', 'longitude', 'id'], name='pet_geohash_idx', condition=models.Q(geohash__isnull=False)),
+        ]
         
     def __str__(self):
         return self.name
@@ -62,6 +93,12 @@ class Comment(models.Model):
     
     class Meta:
         ordering = ['date_commented'] 
+        # Comment threads are read per pet, per user or site-wide, by keyset on (date_commented, id)
+        indexes = [
+            models.Index(fields=['pet', 'date_commented', 'id'], name='comment_pet_date_idx'),
+            models.Index(fields=['user', 'date_commented', 'id'], name='comment_user_date_idx'),
+            models.Index(fields=['date_commented', 'id'], name='comment_date_idx'),
+        ]
         
     def __str__(self):
         return self.text
@@ -73,6 +110,11 @@ class Like(models.Model):
     date_liked = models.DateField(auto_now_add=True)
     pet = models.ForeignKey(Pet, on_delete=models.CASCADE, default='3')
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False, blank=False, related_name='likes')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['pet', 'user'], name='unique_like_pet_user'),
+        ]
     
 
 # Tags for Pet Personality Traits Table
@@ -86,3 +128,73 @@ class Tag(models.Model):
 class Pet_Tag(models.Model):
     pet = models.ForeignKey(Pet, on_delete=models.CASCADE)
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['pet', 'tag'], name='unique_pet_tag'),
+        ]
+        # Filtering pets by tag walks the junction table from the tag side
+        indexes = [
+            models.Index(fields=['tag', 'pet'], name='pet_tag_tag_pet_idx'),
+        ]
+
+# Chunked image uploads in progress, see pets/uploads.py
+class Upload(models.Model):
+    TARGET_CHOICES = [('profile', 'Profile image'), ('pet', 'Pet image')]
+    STATUS_CHOICES = [('pending', 'Pending'), ('complete', 'Complete')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, null=True, blank=True)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(help_text='Total size in bytes')
+    sha256 = models.CharField(max_length=64, help_text='Hex SHA-256 of the whole file')
+    received = models.PositiveBigIntegerField(default=0, help_text='Bytes stored so far')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size})'
+
+# Precomputed "you may also like" neighbors of each pet, see pets/similarity.py
+class SimilarPet(models.Model):
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='similar_pets')
+    similar = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField(help_text='0 for the most similar pet')
+    score = models.FloatField(help_text='Cosine similarity of the two pets, 0 to 1')
+
+    class Meta:
+        # Also the index serving a pet's neighbors in rank order
+        constraints = [
+            models.UniqueConstraint(fields=['pet', 'rank'], name='unique_similar_pet_rank'),
+        ]
+
+# Pets whose neighbors must be recomputed by the next incremental refresh
+class SimilarPetRefresh(models.Model):
+    pet = models.OneToOneField(Pet, on_delete=models.CASCADE, primary_key=True)
+    date_requested = models.DateTimeField(auto_now_add=True)
+
+# Precomputed recommendations for each user from their likes, see pets/recommendations.py
+class UserRecommendation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    pet = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField(help_text='0 for the best recommendation')
+    score = models.FloatField(help_text="Summed similarity of the pet to the user's liked pets")
+
+    class Meta:
+        # Also the index serving a user's recommendations in rank order
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'rank'], name='unique_user_recommendation_rank'),
+        ]
+
+# Users whose recommendations must be recomputed by the next incremental refresh
+class UserRecommendationRefresh(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    date_requested = models.DateTimeField(auto_now_add=True)
+
+# Progress of an import_pets run, written in the transaction of each batch
+class ImportCheckpoint(models.Model):
+    name = models.CharField(max_length=255, primary_key=True, help_text='The --checkpoint name, by default the input path')
+    row = models.PositiveIntegerField(help_text='Last input row committed')
+    date_updated = models.DateTimeField(auto_now=True)
@@ -0,0 +1,249 @@
+import base64
+import binascii
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, Cursor, CursorPagination, LimitOffsetPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class PetCursorPagination(CursorPagination):
+    """
+    Keyset pagination for every pet listing.
+
+    Pages are addressed by an opaque cursor over the primary key instead of a
+    page number, so the database seeks straight to the next page and never runs
+    a COUNT(*). Page 1000 costs the same as page 1.
+
+    Query Parameters:
+    - `cursor`: Opaque cursor taken from the `next` / `previous` links
+    - `page_size`: Number of pets per page (max 100)
+    - `ordering=popular`: Most liked pets first, read from the indexed `like_count`
+
+    DRF cursors hold a single field and step over ties with offsets, which
+    would scan every pet sharing a like count. Popular pages carry the whole
+    `(like_count, id)` position in the cursor instead and seek on the
+    `(like_count, id)` index, like `CommentKeysetPagination`.
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        if request.query_params.get('ordering') == 'popular':
+            return ('-like_count', '-id')
+        return super().get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.popular = request.query_params.get('ordering') == 'popular'
+        if not self.popular:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        position, reverse = None, False
+        if self.cursor is not None:
+            position, reverse = self.decode_position(self.cursor.position), self.cursor.reverse
+        rows = list(self.seek(queryset, position, reverse)[:self.page_size + 1])
+        self.page, more = rows[:self.page_size], len(rows) > self.page_size
+        if reverse:
+            self.page.reverse()
+
+        # Less popular pets: past a full page, or past the cursor of a previous page
+        self.has_next = reverse or more
+        self.has_previous = more if reverse else position is not None
+        self.next_position = self.position(self.page[-1]) if self.page else position
+        self.previous_position = self.position(self.page[0]) if self.page else position
+        return self.page
+
+    def get_next_link(self):
+        if not self.popular:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if not self.popular:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.previous_position))
+
+    @staticmethod
+    def seek(queryset, position, reverse):
+        if reverse:
+            queryset = queryset.order_by('like_count', 'id')
+            if position is None:
+                return queryset
+            count, pk = position
+            return queryset.filter(Q(like_count__gt=count) | Q(like_count=count, id__gt=pk), like_count__gte=count)
+        queryset = queryset.order_by('-like_count', '-id')
+        if position is None:
+            return queryset
+        count, pk = position
+        # The range on like_count alone lets the index seek
+        return queryset.filter(Q(like_count__lt=count) | Q(like_count=count, id__lt=pk), like_count__lte=count)
+
+    @staticmethod
+    def position(pet):
+        return f'{pet.like_count} {pet.pk}'
+
+    def decode_position(self, position):
+        """`(like_count, id)` of a popular cursor."""
+        try:
+            count, pk = position.split(' ')
+            return int(count), int(pk)
+        except (AttributeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class NearbyPagination(LimitOffsetPagination):
+    """
+    Limit/offset pages of a nearby search, without a `count`.
+
+    Rows come nearest first, so the database reads every match to sort them
+    anyway; a COUNT(*) would read them all a second time. One extra row is
+    fetched instead to tell whether there is a next page.
+
+    Query Parameters:
+    - `limit`: Number of pets per page (max 100)
+    - `offset`: Number of pets to skip
+    """
+    max_limit = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        # What the parent's next link needs: past this page exactly when there is more
+        self.count = self.offset + len(rows)
+        return rows[:self.limit]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class CommentKeysetPagination(BasePagination):
+    """
+    Keyset pagination of comment threads, newest first.
+
+    Pages seek on `(date_commented, id)` through the comment indexes instead
+    of counting rows, so the last page of a viral pet's thread costs the same
+    as the first. The first page also gives a `poll` link returning only the
+    comments posted since, oldest first, with a `poll` link of its own.
+
+    Query Parameters:
+    - `cursor`: Opaque cursor taken from the `next` (older) / `previous` (newer) links
+    - `since`: Opaque cursor taken from a `poll` link
+    - `page_size`: Number of comments per page (max 100)
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        size = self.get_page_size(request)
+        self.next = self.previous = self.poll = None
+
+        if 'since' in request.query_params:
+            # Polling: the comments after the position, oldest first
+            position = self.decode(request.query_params['since'])
+            self.base_url = remove_query_param(self.base_url, 'cursor')
+            page = list(self.after(queryset, position)[:size])
+            self.poll = self.link('since', self.encode(self.position(page[-1]) if page else position))
+            return page
+
+        position, older = None, True
+        if 'cursor' in request.query_params:
+            cursor = request.query_params['cursor']
+            if cursor[:1] not in ('o', 'n'):
+                raise NotFound(self.invalid_cursor_message)
+            position, older = self.decode(cursor[1:]), cursor[:1] == 'o'
+        if older:
+            rows = list(self.before(queryset, position)[:size + 1])
+            page, more = rows[:size], len(rows) > size
+        else:
+            rows = list(self.after(queryset, position)[:size + 1])
+            page, more = rows[:size][::-1], len(rows) > size
+
+        # Older comments: past a full page, or past the cursor of a newer page
+        if page and (more or not older):
+            self.next = self.link('cursor', 'o' + self.encode(self.position(page[-1])))
+        newer = position is not None if older else more
+        if newer and page:
+            self.previous = self.link('cursor', 'n' + self.encode(self.position(page[0])))
+        elif not newer:
+            # The newest comments are on this page: poll from the newest
+            self.poll = self.link('since', self.encode(self.position(page[0]) if page else position))
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.next),
+            ('previous', self.previous),
+            ('poll', self.poll),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    @staticmethod
+    def before(queryset, position):
+        queryset = queryset.order_by('-date_commented', '-id')
+        if position is None:
+            return queryset
+        date, pk = position
+        # The range on date_commented alone lets the index seek
+        return queryset.filter(Q(date_commented__lt=date) | Q(id__lt=pk), date_commented__lte=date)
+
+    @staticmethod
+    def after(queryset, position):
+        queryset = queryset.order_by('date_commented', 'id')
+        if position is None:
+            return queryset
+        date, pk = position
+        return queryset.filter(Q(date_commented__gt=date) | Q(id__gt=pk), date_commented__gte=date)
+
+    @staticmethod
+    def position(comment):
+        return comment.date_commented, comment.pk
+
+    @staticmethod
+    def encode(position):
+        text = f'{position[0].isoformat()} {position[1]}' if position else ''
+        return base64.urlsafe_b64encode(text.encode()).decode()
+
+    def decode(self, encoded):
+        """`(date_commented, id)` of a cursor, None before the first comment."""
+        try:
+            position = base64.b64decode(encoded.encode(), altchars=b'-_', validate=True).decode()
+            if not position:
+                return None
+            date, pk = position.split(' ')
+            return datetime.fromisoformat(date), int(pk)
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def link(self, param, value):
+        url = remove_query_param(self.base_url, 'since' if param == 'cursor' else 'cursor')
+        return replace_query_param(url, param, value)
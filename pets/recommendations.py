@@ -0,0 +1,162 @@
+"""
+Personal recommendations from like history, precomputed.
+
+Item-item collaborative filtering over `Like`: two pets are similar when the
+same users like them, by the cosine of their columns in the binary
+user-by-pet like matrix, |likers of both| / sqrt(|likers of one| * |likers
+of the other|). A user's score for a pet is its summed similarity to the
+pets they liked. The best RECOMMENDATIONS_K pets they have not liked (nor
+posted) are stored in `UserRecommendation`, so serving them is one indexed
+read.
+
+The matrix is kept sparse in both layouts (a user's likes, a pet's likers)
+and scores follow the likes two hops: from a user's liked pets to the users
+who liked them too, and on to the other pets those users liked. The hops
+follow the LIKES_PER_USER most recent likes of a user and the
+LIKERS_PER_PET most recent likers of a pet, which bounds the work for heavy
+users and popular pets; similarities are still normalized by the full
+counts. Batches of users are scored on a process pool, as in
+pets/similarity.py.
+
+New and removed likes queue their user in `UserRecommendationRefresh` (see
+pets/signals.py), and `refresh_recommendations` recomputes those users. A
+like also shifts the similarities seen by other users, which a full
+`build_recommendations` now and then catches up with.
+"""
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from .models import Like, Pet, UserRecommendation, UserRecommendationRefresh
+from .similarity import RowIndex, ranges, write_top
+
+LIKES_PER_USER = 200
+LIKERS_PER_PET = 200
+# Scores summed in one dense block, users x liked pets
+DENSE_CELLS = 4_000_000
+RECOMMENDATION_FIELDS = ('user', 'pet', 'rank', 'score')
+
+
+class LikeIndex(RowIndex):
+    """The like matrix, rows are users with at least one like."""
+
+    def __init__(self, like_user_ids, like_pet_ids, pet_ids, pet_owner_ids):
+        # Likes come newest first, and the stable sorts below keep that order
+        # within each user and each pet
+        user_ids, users = np.unique(like_user_ids, return_inverse=True)
+        super().__init__(user_ids)
+        self.pet_ids, pets = np.unique(like_pet_ids, return_inverse=True)
+        users, pets = users.ravel(), pets.ravel()
+
+        # Owner of each liked pet, -1 for pets deleted since the likes were read
+        owners = np.full(len(self.pet_ids), -1, dtype=np.int64)
+        positions = np.searchsorted(self.pet_ids, pet_ids)
+        known = positions < len(self.pet_ids)
+        known[known] = self.pet_ids[positions[known]] == pet_ids[known]
+        owners[positions[known]] = pet_owner_ids[known]
+        self.owners = owners
+
+        likers = np.bincount(pets, minlength=len(self.pet_ids))
+        self.inverse_norms = 1 / np.sqrt(np.maximum(likers, 1))
+
+        # User layout: the pets each user liked, all of them
+        order = np.argsort(users, kind='stable')
+        self.user_ptr = np.concatenate(([0], np.cumsum(np.bincount(users, minlength=self.size))))
+        self.user_pets = pets[order]
+
+        # Pet layout: the most recent likers of each pet
+        order = np.argsort(pets, kind='stable')
+        sorted_pets = pets[order]
+        position = np.arange(len(order)) - np.concatenate(([0], np.cumsum(likers)))[sorted_pets]
+        keep = position < LIKERS_PER_PET
+        self.pet_ptr = np.concatenate(([0], np.cumsum(np.bincount(sorted_pets[keep], minlength=len(self.pet_ids)))))
+        self.pet_users = users[order][keep]
+
+    def recent_likes(self, rows):
+        """`(row positions, pets)` of the most recent likes of each of `rows`."""
+        lengths = np.minimum(self.user_ptr[rows + 1] - self.user_ptr[rows], LIKES_PER_USER)
+        return np.repeat(np.arange(len(rows)), lengths), self.user_pets[ranges(self.user_ptr[rows], lengths)]
+
+    def top(self, rows, k):
+        """
+        `(user ids, pet ids, ranks, scores)` of the best `k` recommendations
+        of each user in `rows`, as flat arrays.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        # Scores are summed in a dense users x pets block of about DENSE_CELLS
+        chunk = max(1, DENSE_CELLS // max(len(self.pet_ids), 1))
+        results = [self.top_dense(rows[start:start + chunk], k) for start in range(0, len(rows), chunk)]
+        return tuple(np.concatenate(arrays) for arrays in zip(*results)) if results else (np.zeros(0),) * 4
+
+    def top_dense(self, rows, k):
+        users, pets_count = self.size, len(self.pet_ids)
+
+        # Liked pets -> users who liked them too, weighted by 1/sqrt(likers)
+        local, liked = self.recent_likes(rows)
+        lengths = self.pet_ptr[liked + 1] - self.pet_ptr[liked]
+        pair_local = np.repeat(local, lengths)
+        pair_users = self.pet_users[ranges(self.pet_ptr[liked], lengths)]
+        pair_weights = np.repeat(self.inverse_norms[liked], lengths)
+        other = pair_users != rows[pair_local]
+        keys, inverse = np.unique(pair_local[other] * users + pair_users[other], return_inverse=True)
+        weights = np.bincount(inverse.ravel(), weights=pair_weights[other], minlength=len(keys))
+        local, co_likers = keys // users, keys % users
+
+        # Co-likers -> the pets they liked, weighted by 1/sqrt(likers) again
+        co_local, pets = self.recent_likes(co_likers)
+        cells = local[co_local] * pets_count + pets
+        scores = np.bincount(cells, weights=weights[co_local] * self.inverse_norms[pets], minlength=len(rows) * pets_count)
+
+        # Not the pets the user already liked or posted
+        lengths = self.user_ptr[rows + 1] - self.user_ptr[rows]
+        scores[np.repeat(np.arange(len(rows)), lengths) * pets_count + self.user_pets[ranges(self.user_ptr[rows], lengths)]] = 0
+        scores[cells[self.owners[pets] == self.ids[rows[local[co_local]]]]] = 0
+
+        # Best k per user, best first
+        scores = scores.reshape(len(rows), pets_count)
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k] if pets_count > k else np.tile(np.arange(pets_count), (len(rows), 1))
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.lexsort((best, -best_scores), axis=1)
+        best, best_scores = np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+        ranks = np.broadcast_to(np.arange(best.shape[1]), best.shape)
+        local = np.broadcast_to(np.arange(len(rows))[:, None], best.shape)
+        found = best_scores > 0
+        return self.ids[rows[local[found]]], self.pet_ids[best[found]], ranks[found], best_scores[found]
+
+
+def load_index():
+    """A `LikeIndex` of every like, read in two queries."""
+    likes = np.array(list(Like.objects.order_by('-id').values_list('user_id', 'pet_id').iterator(chunk_size=10000)), dtype=np.int64).reshape(-1, 2)
+    pets = np.array(list(Pet.objects.order_by('id').values_list('id', 'user_id').iterator(chunk_size=10000)), dtype=np.int64).reshape(-1, 2)
+    return LikeIndex(likes[:, 0], likes[:, 1], pets[:, 0], pets[:, 1])
+
+
+def write_recommendations(index, rows, workers):
+    return write_top(UserRecommendation, RECOMMENDATION_FIELDS, index, rows, workers, settings.RECOMMENDATIONS_K)
+
+
+def build_recommendations(workers=1):
+    """Recompute the recommendations of every user. Returns the number of users."""
+    # Likes queued from here on are not in the index
+    queued_before = UserRecommendationRefresh.objects.aggregate(latest=Max('date_requested'))['latest']
+    index = load_index()
+    write_recommendations(index, np.arange(index.size), workers)
+    # Users who no longer like anything have nothing to go on
+    UserRecommendation.objects.exclude(user_id__in=Like.objects.values('user_id')).delete()
+    if queued_before is not None:
+        UserRecommendationRefresh.objects.filter(date_requested__lte=queued_before).delete()
+    return index.size
+
+
+def refresh_recommendations(workers=1):
+    """Recompute the recommendations of the users queued for a refresh. Returns the number of users."""
+    queued = dict(UserRecommendationRefresh.objects.values_list('user_id', 'date_requested'))
+    if not queued:
+        return 0
+    index = load_index()
+    rows = index.rows_of(sorted(queued))
+    write_recommendations(index, rows, workers)
+    UserRecommendation.objects.filter(user_id__in=set(queued) - set(index.ids[rows].tolist())).delete()
+    # Entries queued again while this ran stay for the next refresh
+    UserRecommendationRefresh.objects.filter(user_id__in=list(queued), date_requested__lte=max(queued.values())).delete()
+    return len(queued)
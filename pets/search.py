@@ -0,0 +1,476 @@
+"""
+In-process full-text search over pet names, descriptions and characteristics.
+
+The index is a plain inverted index (term -> {pet id: term frequency}) ranked
+with BM25. It lives in memory in every worker and is persisted next to the
+database as two files:
+
+- `<name>.snapshot`: zlib-compressed JSON with delta-encoded pet ids, written
+  by `rebuild_search_index` or when the journal grows too long.
+- `<name>.journal`: one JSON line per pet saved or deleted since the snapshot.
+
+Workers boot by loading the snapshot and replaying the journal, and pick up
+each other's changes by replaying whatever was appended since their last read.
+Entries are appended once the transaction that changed the pet commits. With
+no snapshot yet, one worker builds the index in a background thread while
+the others wait for its snapshot; searches raise `IndexNotReady` meanwhile.
+"""
+import fcntl
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sys
+import threading
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+INDEXED_FIELDS = ('name', 'description', 'characteristics')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Journal size after which the snapshot is rewritten
+COMPACT_AFTER_BYTES = 4 * 1024 * 1024
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset(
+    'a an and are as at be but by for from has have he her his i in is it its '
+    'of on or she so that the their them they this to was were will with you'.split()
+)
+
+
+def stem(word):
+    """
+    Light English suffix stripping, enough to match "playful puppies" with
+    "playing puppy". Not a full Porter stemmer.
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('sses'):
+        return word[:-2]
+    if word.endswith(('ches', 'shes', 'xes', 'zes')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        word = word[:-1]
+    for suffix in ('ingly', 'edly', 'ness', 'ful', 'ing', 'ed', 'ly'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            # "running" -> "runn" -> "run"
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in 'lsz':
+                word = word[:-1]
+            break
+    return word
+
+
+def tokenize(text):
+    """Lowercase, split on non-alphanumerics, drop stop words and stem."""
+    if not text:
+        return []
+    return [stem(token) for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def pet_text(pet):
+    """The searchable text of a Pet instance or of a `values()` row."""
+    get = pet.get if isinstance(pet, dict) else (lambda field: getattr(pet, field))
+    return ' '.join(get(field) or '' for field in INDEXED_FIELDS)
+
+
+class SearchIndex:
+    """
+    Inverted index with BM25 ranking. Not thread-safe on its own; the module
+    level helpers serialize access to the shared instance.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.doc_lengths = {}
+        # The terms of each document, so removing one only visits its own postings
+        self.doc_terms = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id, text):
+        """Index `text` under `doc_id`, replacing any previous version."""
+        self.remove(doc_id)
+        # Interned, so doc_terms shares the strings of the postings keys
+        terms = Counter(sys.intern(term) for term in tokenize(text))
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.doc_terms[doc_id] = list(terms)
+        length = sum(terms.values())
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+
+    def remove(self, doc_id):
+        length = self.doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in self.doc_terms.pop(doc_id):
+            docs = self.postings[term]
+            del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+
+    def search(self, query, limit=None):
+        """
+        Return `(doc_id, score)` pairs for documents matching any query term,
+        best first. `limit=None` returns every match.
+        """
+        n = len(self.doc_lengths)
+        if not n:
+            return []
+        # BM25 length normalization, K1 * (1 - B + B * length / average length)
+        average_length = self.total_length / n or 1
+        base, per_token = K1 * (1 - B), K1 * B / average_length
+        lengths = self.doc_lengths
+        scores = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            weight = idf * (K1 + 1)
+            for doc_id, frequency in docs.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * frequency / (frequency + base + per_token * lengths[doc_id])
+        if limit is None:
+            return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+    # Persistence
+
+    def dumps(self):
+        """Serialize to the compact snapshot format."""
+        doc_ids = sorted(self.doc_lengths)
+        terms = {}
+        for term, docs in self.postings.items():
+            ids = sorted(docs)
+            terms[term] = [delta_encode(ids), [docs[doc_id] for doc_id in ids]]
+        payload = {
+            'version': FORMAT_VERSION,
+            'docs': [delta_encode(doc_ids), [self.doc_lengths[doc_id] for doc_id in doc_ids]],
+            'terms': terms,
+        }
+        return zlib.compress(json.dumps(payload, separators=(',', ':')).encode(), 6)
+
+    @classmethod
+    def loads(cls, data):
+        payload = json.loads(zlib.decompress(data))
+        if payload.get('version') != FORMAT_VERSION:
+            raise ValueError('Unsupported search index format.')
+        index = cls()
+        doc_ids, lengths = payload['docs']
+        index.doc_lengths = dict(zip(delta_decode(doc_ids), lengths))
+        index.total_length = sum(lengths)
+        index.doc_terms = {doc_id: [] for doc_id in index.doc_lengths}
+        for term, (ids, frequencies) in payload['terms'].items():
+            term = sys.intern(term)
+            ids = delta_decode(ids)
+            index.postings[term] = dict(zip(ids, frequencies))
+            for doc_id in ids:
+                index.doc_terms[doc_id].append(term)
+        return index
+
+    def apply(self, entry):
+        """Replay one journal entry."""
+        if entry['op'] == 'add':
+            self.add(entry['id'], entry['text'])
+        else:
+            self.remove(entry['id'])
+
+
+def delta_encode(ids):
+    previous = 0
+    deltas = []
+    for value in ids:
+        deltas.append(value - previous)
+        previous = value
+    return deltas
+
+
+def delta_decode(deltas):
+    total = 0
+    ids = []
+    for delta in deltas:
+        total += delta
+        ids.append(total)
+    return ids
+
+
+# Shared per-process index
+
+
+class IndexNotReady(Exception):
+    """The index is still being built for the first time."""
+
+
+class IndexStore:
+    """
+    The per-process index together with its snapshot and journal files.
+    A store without a base path keeps the index in memory only.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.index = None
+        self.snapshot_mtime = None
+        self.journal_offset = 0
+        self.builder = None
+        self.lock = threading.RLock()
+
+    @property
+    def snapshot_path(self):
+        return f'{self.base_path}.snapshot'
+
+    @property
+    def journal_path(self):
+        return f'{self.base_path}.journal'
+
+    def get(self):
+        """The up-to-date index, loading it on first use."""
+        with self.lock:
+            if self.index is None:
+                self.load()
+            elif self.base_path:
+                self.refresh()
+            if self.index is None:
+                raise IndexNotReady()
+            return self.index
+
+    def load(self):
+        if self.base_path and os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f:
+                self.index = SearchIndex.loads(f.read())
+            self.snapshot_mtime = os.path.getmtime(self.snapshot_path)
+            self.journal_offset = 0
+            self.replay()
+        elif self.base_path:
+            # Keep serving the current index, if any, while a new one is built
+            self.build_in_background()
+        else:
+            # In-memory database (tests): nothing to share, build in place
+            self.rebuild()
+
+    def refresh(self):
+        """Pick up snapshots and journal entries written by other workers."""
+        if modified_time(self.snapshot_path) != self.snapshot_mtime:
+            self.load()
+        else:
+            self.replay()
+
+    def replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self.journal_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Partially written entry, read it next time
+                    break
+                self.index.apply(json.loads(line))
+                self.journal_offset += len(line)
+
+    def build_in_background(self):
+        if self.builder is None or not self.builder.is_alive():
+            self.builder = threading.Thread(target=self.build, name='search-index-build', daemon=True)
+            self.builder.start()
+
+    def build(self):
+        """Runs on the builder thread: one worker on the host scans, the others load its snapshot."""
+        try:
+            os.makedirs(os.path.dirname(self.base_path), exist_ok=True)
+            with FileLock(f'{self.base_path}.build'):
+                if os.path.exists(self.snapshot_path):
+                    with self.lock:
+                        self.load()
+                else:
+                    self.rebuild()
+        except Exception:
+            logger.exception('Building the search index failed')
+        finally:
+            # This thread is not managed by a request, so close its connection ourselves
+            connection.close()
+
+    def rebuild(self):
+        """
+        Index every pet from the database and write a fresh snapshot.
+
+        Entries appended to the journal during the scan are replayed on top
+        of it. If another worker rewrote the snapshot meanwhile, the entries
+        it folded in are gone from the journal, so the scan starts over.
+        """
+        from .models import Pet
+
+        while True:
+            start = self.journal_state()
+            index = SearchIndex()
+            for row in Pet.objects.values('id', *INDEXED_FIELDS).order_by().iterator(chunk_size=2000):
+                index.add(row['id'], pet_text(row))
+            with self.lock:
+                if self.install(index, start):
+                    return
+
+    def journal_state(self):
+        """`(snapshot mtime, journal size)`: where a database scan starting now begins."""
+        if not self.base_path:
+            return None, 0
+        os.makedirs(os.path.dirname(self.base_path), exist_ok=True)
+        with self.journal_locked():
+            return modified_time(self.snapshot_path), file_size(self.journal_path)
+
+    def install(self, index, start):
+        """Make `index`, scanned from journal state `start` on, current and persist it."""
+        if not self.base_path:
+            self.index = index
+            return True
+        with self.journal_locked():
+            if modified_time(self.snapshot_path) != start[0]:
+                return False
+            self.index = index
+            self.snapshot_mtime, self.journal_offset = start
+            self.save()
+        return True
+
+    def write_snapshot(self):
+        """Persist the index with whatever other workers appended since the last read."""
+        if not self.base_path:
+            return
+        with self.journal_locked():
+            self.refresh()
+            self.save()
+
+    def save(self):
+        """Write the snapshot and empty the journal. Call with the journal lock held."""
+        self.replay()
+        temp_path = f'{self.snapshot_path}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(self.index.dumps())
+        os.replace(temp_path, self.snapshot_path)
+        open(self.journal_path, 'wb').close()
+        self.snapshot_mtime = os.path.getmtime(self.snapshot_path)
+        self.journal_offset = 0
+
+    def record(self, *entries):
+        """Apply changes locally and append them to the journal in one write."""
+        with self.lock:
+            if not self.base_path:
+                if self.index is not None:
+                    for entry in entries:
+                        self.index.apply(entry)
+                return
+            os.makedirs(os.path.dirname(self.base_path), exist_ok=True)
+            lines = b''.join(json.dumps(entry, separators=(',', ':')).encode() + b'\n' for entry in entries)
+            with self.journal_locked():
+                with open(self.journal_path, 'ab') as f:
+                    f.write(lines)
+                    journal_size = f.tell()
+            if self.index is None:
+                # Not loaded in this worker yet; the journal carries the change.
+                return
+            self.refresh()
+            if journal_size > COMPACT_AFTER_BYTES:
+                self.write_snapshot()
+
+    def journal_locked(self):
+        return FileLock(f'{self.base_path}.lock')
+
+
+def modified_time(path):
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return None
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class FileLock:
+    """Exclusive advisory lock shared by all workers on the host."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def index_base_path():
+    """
+    Where the index of the current database is persisted, or None for an
+    in-memory database (e.g. the test database).
+    """
+    name = connection.settings_dict['NAME']
+    if connection.vendor == 'sqlite' and connection.creation.is_in_memory_db(name):
+        return None
+    return os.path.join(settings.SEARCH_INDEX_DIR, os.path.basename(str(name)) or 'default')
+
+
+def get_store():
+    base_path = index_base_path()
+    with _stores_lock:
+        if base_path not in _stores:
+            _stores[base_path] = IndexStore(base_path)
+        return _stores[base_path]
+
+
+def search_pets(query, limit=None):
+    """Rank pet ids for `query`, best first."""
+    return get_store().get().search(query, limit=limit)
+
+
+def record_on_commit(*entries):
+    """
+    Journal `entries` once the current transaction commits, so other workers
+    never index a change that is rolled back.
+    """
+    transaction.on_commit(lambda: get_store().record(*entries))
+
+
+def index_pet(pet):
+    record_on_commit({'op': 'add', 'id': pet.pk, 'text': pet_text(pet)})
+
+
+def index_pets(pets):
+    """Index many pets with a single journal write (bulk inserts send no post_save)."""
+    entries = [{'op': 'add', 'id': pet.pk, 'text': pet_text(pet)} for pet in pets]
+    if entries:
+        record_on_commit(*entries)
+
+
+def unindex_pet(pet_id):
+    record_on_commit({'op': 'remove', 'id': pet_id})
+
+
+def rebuild_index():
+    store = get_store()
+    store.rebuild()
+    return store.index
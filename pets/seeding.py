@@ -0,0 +1,344 @@
+"""
+Synthetic datasets for benchmarks, load tests and local development.
+
+Data is skewed like a real catalogue: pet popularity, user activity, shelter
+size and tag usage all follow Zipf distributions, so a few pets collect most
+likes and comments while most tags are rare.
+
+Generation is deterministic for a given seed and sizes. Users, shelters,
+tags and pets get explicit primary keys from ranges allocated up front, and
+rows are produced in fixed-size chunks, each with its own random generator.
+Chunks are therefore independent and run in parallel worker processes.
+Everything a pet owns (tags, likes, comments) is generated with the pet,
+which keeps `like_count` and `comment_count` exact without a second pass.
+
+Locations are gazetteer places (pets/geo.py) drawn by population and stored
+with their coordinates; pets in a shelter are at the shelter's.
+
+Rows are written with `bulk_create`, so no model signals run. `seed_dataset`
+expires the cached responses when it is done; the search index must be
+rebuilt separately (the `seed` command does it).
+"""
+import bisect
+import itertools
+import multiprocessing
+import random
+from datetime import timedelta
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .cache import bump_version, invalidate_responses
+from .facets import FACET_NAMESPACE
+from .geo import gazetteer_rows, geohash
+from .models import Comment, Like, Pet, Pet_Tag, Shelter, Tag, UserProfile
+
+SEED_USERNAME = 'seed_user_{}'
+SEED_PASSWORD = 'seed-password'
+
+PET_TYPES = ('Dog', 'Cat', 'Rabbit', 'Bird', 'Hamster', 'Turtle')
+GENDERS = ('Male', 'Female', 'Unknown')
+STATUSES = ('Available', 'Pending', 'Adopted')
+WORDS = (
+    'playful calm friendly shy curious loyal gentle energetic fluffy small large '
+    'young senior cuddly smart quiet vocal independent trained house garden'
+).split()
+
+# Rows generated per task, and per INSERT statement
+USER_CHUNK = 20000
+PET_CHUNK = 5000
+BATCH_SIZE = 2000
+
+# Zipf exponents: weight of the item of rank r is 1 / r**s
+POPULARITY_SKEW = 0.8
+ACTIVITY_SKEW = 1.0
+SHELTER_SKEW = 1.0
+TAG_SKEW = 1.1
+
+# Comments are spread over this period before the seeding time
+COMMENT_PERIOD = timedelta(days=730)
+
+
+class Zipf:
+    """Ranks 0..n-1 drawn with probability proportional to 1 / (rank + 1)**s."""
+
+    def __init__(self, n, s):
+        self.cumulative = list(itertools.accumulate(1 / (rank + 1) ** s for rank in range(n)))
+        self.total = self.cumulative[-1] if n else 0.0
+
+    def weight(self, rank):
+        previous = self.cumulative[rank - 1] if rank else 0.0
+        return (self.cumulative[rank] - previous) / self.total
+
+    def draw(self, rng):
+        return bisect.bisect(self.cumulative, rng.random() * self.total)
+
+
+class Place:
+    """A gazetteer place, as stored on seeded rows."""
+
+    def __init__(self, location, latitude, longitude):
+        self.location = location
+        self.latitude = latitude
+        self.longitude = longitude
+        self.geohash = geohash(latitude, longitude)
+
+
+class Places:
+    """Gazetteer places drawn with probability proportional to their population."""
+
+    def __init__(self):
+        rows = gazetteer_rows()
+        self.places = [
+            Place(f"{row['name']}, {row['admin'] or row['country']}", float(row['latitude']), float(row['longitude']))
+            for row in rows
+        ]
+        self.cumulative = list(itertools.accumulate(int(row['population']) for row in rows))
+
+    def draw(self, rng):
+        return self.places[bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+def scatter(rank, n):
+    """
+    Spread ranks over 0..n-1 (a fixed permutation), so popular pets, busy
+    users and big shelters are not simply the lowest ids.
+    """
+    if n < 2:
+        return rank
+    step = 7919  # prime
+    while n % step == 0:
+        step += 2
+    return rank * step % n
+
+
+def sentence(rng, words=8):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def rounded(rng, expected):
+    """`expected` rounded up or down at random, so totals match on average."""
+    whole = int(expected)
+    return whole + (rng.random() < expected - whole)
+
+
+def next_id(model):
+    return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+
+class Plan:
+    """Sizes, seed and id ranges of one dataset. Sent to worker processes."""
+
+    def __init__(self, users, shelters, tags, pets, comments, likes, seed):
+        self.users = users
+        self.shelters = shelters
+        self.tags = tags
+        self.pets = pets
+        self.comments = comments
+        self.likes = likes
+        self.seed = seed
+        self.first_user = next_id(User)
+        self.first_shelter = next_id(Shelter)
+        self.first_tag = next_id(Tag)
+        self.first_pet = next_id(Pet)
+        self.password = make_password(SEED_PASSWORD)
+        self.now = timezone.now()
+
+    def rng(self, *parts):
+        return random.Random('-'.join(str(part) for part in (self.seed, *parts)))
+
+    def ranges(self):
+        return {
+            'users': range(self.first_user, self.first_user + self.users),
+            'shelters': range(self.first_shelter, self.first_shelter + self.shelters),
+            'tags': range(self.first_tag, self.first_tag + self.tags),
+            'pets': range(self.first_pet, self.first_pet + self.pets),
+        }
+
+
+# Tasks, run in worker processes. Each returns the number of rows written.
+
+_distributions = {}
+
+
+def distributions(plan):
+    """Zipf samplers and places of the plan, built once per process."""
+    key = (plan.seed, plan.users, plan.shelters, plan.tags, plan.pets, plan.first_shelter)
+    if key not in _distributions:
+        _distributions.clear()
+        places = Places()
+        _distributions[key] = {
+            'popularity': Zipf(plan.pets, POPULARITY_SKEW),
+            'activity': Zipf(plan.users, ACTIVITY_SKEW),
+            'shelters': Zipf(plan.shelters, SHELTER_SKEW),
+            'tags': Zipf(plan.tags, TAG_SKEW),
+            'places': places,
+            # Drawn from the shelter id, so every process agrees on them
+            'shelter_places': {
+                shelter_id: places.draw(plan.rng('shelter', shelter_id)) for shelter_id in plan.ranges()['shelters']
+            },
+        }
+    return _distributions[key]
+
+
+def seed_users(plan, chunk):
+    rng = plan.rng('users', chunk)
+    places = distributions(plan)['places']
+    start = chunk * USER_CHUNK
+    user_ids = range(plan.first_user + start, plan.first_user + min(start + USER_CHUNK, plan.users))
+    users = [
+        User(id=user_id, username=SEED_USERNAME.format(user_id), email=f'seed{user_id}@example.com',
+             first_name=rng.choice(WORDS).title(), last_name=rng.choice(WORDS).title(), password=plan.password)
+        for user_id in user_ids
+    ]
+    profiles = []
+    for user_id in user_ids:
+        place = places.draw(rng)
+        profiles.append(UserProfile(user_id=user_id, location=place.location, latitude=place.latitude, longitude=place.longitude))
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+        UserProfile.objects.bulk_create(profiles, batch_size=BATCH_SIZE)
+    return len(users) + len(profiles)
+
+
+def seed_pets(plan, chunk):
+    rng = plan.rng('pets', chunk)
+    zipf = distributions(plan)
+
+    def pick_user():
+        return plan.first_user + scatter(zipf['activity'].draw(rng), plan.users)
+
+    pets, pet_tags, likes, comments = [], [], [], []
+    start = chunk * PET_CHUNK
+    for index in range(start, min(start + PET_CHUNK, plan.pets)):
+        pet_id = plan.first_pet + index
+        # The rank of this pet in the popularity order drives its likes and comments
+        weight = zipf['popularity'].weight(scatter(index, plan.pets))
+        like_count = min(rounded(rng, plan.likes * weight), plan.users)
+        comment_count = rounded(rng, plan.comments * weight)
+
+        shelter_id = None
+        if plan.shelters and rng.random() < 0.85:
+            shelter_id = plan.first_shelter + scatter(zipf['shelters'].draw(rng), plan.shelters)
+            place = zipf['shelter_places'][shelter_id]
+        else:
+            place = zipf['places'].draw(rng)
+        pets.append(Pet(
+            id=pet_id,
+            name=f'{rng.choice(WORDS).title()} {pet_id}',
+            pet_type=rng.choice(PET_TYPES),
+            characteristics=sentence(rng, 4),
+            age=rng.randrange(1, 180),
+            gender=rng.choice(GENDERS),
+            description=sentence(rng),
+            status=rng.choice(STATUSES),
+            shelter_id=shelter_id,
+            location=place.location,
+            latitude=place.latitude,
+            longitude=place.longitude,
+            geohash=place.geohash,
+            user_id=pick_user(),
+            like_count=like_count,
+            comment_count=comment_count,
+        ))
+
+        if plan.tags:
+            tag_ranks = {zipf['tags'].draw(rng) for _ in range(rng.randrange(5))}
+            pet_tags.extend(Pet_Tag(pet_id=pet_id, tag_id=plan.first_tag + rank) for rank in tag_ranks)
+
+        # Likes are unique per user. Active users come first; once they
+        # mostly repeat, the rest are drawn uniformly.
+        likers = set()
+        draws = 0
+        while len(likers) < like_count:
+            draws += 1
+            likers.add(pick_user() if draws <= like_count else plan.first_user + rng.randrange(plan.users))
+        likes.extend(Like(pet_id=pet_id, user_id=user_id) for user_id in likers)
+
+        for _ in range(comment_count):
+            comments.append(Comment(
+                text=sentence(rng, rng.randrange(3, 15)),
+                date_commented=plan.now - COMMENT_PERIOD * rng.random(),
+                pet_id=pet_id,
+                user_id=pick_user(),
+            ))
+
+    with transaction.atomic():
+        Pet.objects.bulk_create(pets, batch_size=BATCH_SIZE)
+        Pet_Tag.objects.bulk_create(pet_tags, batch_size=BATCH_SIZE)
+        Like.objects.bulk_create(likes, batch_size=BATCH_SIZE)
+        Comment.objects.bulk_create(comments, batch_size=BATCH_SIZE)
+    return len(pets) + len(pet_tags) + len(likes) + len(comments)
+
+
+def run_task(task):
+    function, plan, chunk = task
+    return function(plan, chunk)
+
+
+def init_worker():
+    # Needed with the "spawn" start method; a no-op after fork
+    django.setup()
+
+
+def run_tasks(tasks, workers, progress):
+    """Run `(function, plan, chunk)` tasks, in `workers` processes when above 1."""
+    if workers <= 1:
+        for task in tasks:
+            progress(run_task(task))
+        return
+    # Children must open their own connections, not share the parent's
+    connections.close_all()
+    with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+        for rows in pool.imap_unordered(run_task, tasks):
+            progress(rows)
+
+
+def seed_dataset(users=200, shelters=20, tags=30, pets=2000, comments=10000, likes=10000, seed=0,
+                 workers=1, progress=None):
+    """
+    Generate a dataset and return the id ranges of the new rows,
+    `{'users': range(...), 'pets': range(...), ...}`. Every seeded user's
+    password is `SEED_PASSWORD`. `progress(rows)` is called after each chunk.
+
+    SQLite allows a single writer, so it always seeds in one process.
+    """
+    if users < 1 and (pets or shelters):
+        raise ValueError('Pets and shelters need at least one user.')
+    progress = progress or (lambda rows: None)
+    if connection.vendor == 'sqlite':
+        workers = 1
+    plan = Plan(users, shelters, tags, pets, comments, likes, seed)
+    ranges = plan.ranges()
+
+    run_tasks([(seed_users, plan, chunk) for chunk in range(-(-users // USER_CHUNK))], workers, progress)
+
+    rng = plan.rng('catalogue')
+    shelter_places = distributions(plan)['shelter_places']
+    with transaction.atomic():
+        Shelter.objects.bulk_create([
+            Shelter(id=shelter_id, name=f'{rng.choice(WORDS).title()} Shelter {shelter_id}',
+                    location=shelter_places[shelter_id].location, latitude=shelter_places[shelter_id].latitude,
+                    longitude=shelter_places[shelter_id].longitude, description=sentence(rng),
+                    user_id=plan.first_user + rng.randrange(users))
+            for shelter_id in ranges['shelters']
+        ], batch_size=BATCH_SIZE)
+        Tag.objects.bulk_create([Tag(id=tag_id, name=f'tag-{tag_id}') for tag_id in ranges['tags']], batch_size=BATCH_SIZE)
+    progress(shelters + tags)
+
+    run_tasks([(seed_pets, plan, chunk) for chunk in range(-(-pets // PET_CHUNK))], workers, progress)
+
+    # Explicit ids leave the sequences behind on PostgreSQL
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [User, Shelter, Tag, Pet]):
+            cursor.execute(sql)
+
+    for resource in ('pets', 'shelters', 'tags'):
+        invalidate_responses(resource)
+    bump_version(FACET_NAMESPACE)
+    return ranges
@@ -1,44 +1,220 @@
+from django.conf import settings
+from django.db.models import Prefetch
 from rest_framework import serializers
-from .models import Shelter, Pet, Comment, Like, Tag, Pet_Tag, UserProfile
+from rest_framework.validators import UniqueTogetherValidator
+from .models import Shelter, Pet, Comment, Like, Tag, Pet_Tag, UserProfile, Upload
+from .thumbnails import thumbnail_srcset
 from django.contrib.auth.models import User
 
-class ShelterSerializer(serializers.ModelSerializer):
+
+def query_names(request, param):
+    """The comma-separated names of a query parameter, as a set, or None when absent."""
+    if request is None or param not in request.query_params:
+        return None
+    return {name.strip() for name in request.query_params[param].split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets and inline related objects for GET requests.
+
+    - `?fields=name,age` keeps only the named fields (and `id`),
+      `?exclude=description` drops the named ones. Unknown names are
+      ignored. Only the top-level serializer of the request is trimmed, not
+      nested ones, and write requests never are.
+    - `?expand=shelter,tags` inlines the related objects listed in
+      `Meta.expandable_fields` instead of their IDs.
+
+    `narrow()` makes the queryset match: `.only()` / `.defer()` leave out
+    the columns no remaining field reads, prefetches of dropped fields are
+    skipped and expanded relations are joined or prefetched. Fields reading
+    columns under other names (method fields) list them in
+    `Meta.field_columns`.
+    """
+
+    def get_request(self):
+        request = self.context.get('request')
+        return request if request is not None and request.method in ('GET', 'HEAD') else None
+
+    def is_top_level(self):
+        return self.root is self or (self.parent is self.root and isinstance(self.root, serializers.ListSerializer))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.get_request()
+        if request is None or not self.is_top_level():
+            return fields
+        kept, dropped = query_names(request, 'fields'), query_names(request, 'exclude') or set()
+        return {
+            name: field for name, field in fields.items()
+            if (kept is None or name in kept or name == 'id') and name not in dropped
+        }
+
+    def get_expand(self):
+        """Names of `?expand=` that this serializer can expand."""
+        request = self.get_request()
+        if request is None or not self.is_top_level():
+            return set()
+        return (query_names(request, 'expand') or set()) & set(getattr(self.Meta, 'expandable_fields', {}))
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        for name in self.get_expand() & set(data):
+            serializer_class = self.Meta.expandable_fields[name]
+            value = getattr(instance, name)
+            if hasattr(value, 'all'):
+                data[name] = serializer_class(value.all(), many=True).data
+            else:
+                data[name] = serializer_class(value).data if value is not None else None
+        return data
+
+    @classmethod
+    def narrow(cls, queryset, request, *columns):
+        """
+        `queryset` reading only what the fields requested by `request` need,
+        plus `columns` (e.g. those a pagination orders by).
+        """
+        serializer = cls(context={'request': request})
+        if serializer.get_request() is None:
+            return queryset
+        fields = serializer.fields
+        opts = queryset.model._meta
+        field_columns = getattr(cls.Meta, 'field_columns', {})
+        sources = {field.source.split('.')[0] for field in fields.values()}
+        needed = set(columns)
+        for name, field in fields.items():
+            needed.update(field_columns.get(name, ()))
+        for model_field in opts.concrete_fields:
+            if model_field.name in sources:
+                needed.add(model_field.name)
+
+        if query_names(request, 'fields') is not None:
+            queryset = queryset.only(*needed)
+        elif query_names(request, 'exclude'):
+            queryset = queryset.defer(*(
+                model_field.name for model_field in opts.concrete_fields
+                if model_field.name not in needed and not model_field.primary_key
+            ))
+
+        # Prefetches only for fields still serialized
+        lookups = queryset._prefetch_related_lookups
+        kept_lookups = [
+            lookup for lookup in lookups
+            if getattr(lookup, 'prefetch_to', lookup).split('__')[0] in sources
+        ]
+        if len(kept_lookups) != len(lookups):
+            queryset = queryset.prefetch_related(None).prefetch_related(*kept_lookups)
+
+        for name in serializer.get_expand() & set(fields):
+            if opts.get_field(fields[name].source).many_to_many:
+                queryset = queryset.prefetch_related(fields[name].source)
+            else:
+                queryset = queryset.select_related(fields[name].source)
+        return queryset
+
+
+class ShelterSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = Shelter
         fields = '__all__'
+        read_only_fields = ('thumbnail_hash', 'latitude', 'longitude')
+        field_columns = {'srcset': ('thumbnail_hash',)}
+
+    def get_srcset(self, obj):
+        return thumbnail_srcset(obj.thumbnail_hash)
         
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = '__all__'
 
-class PetTagSerializer(serializers.ModelSerializer):
+class PetTagSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Pet_Tag
         fields = '__all__'
         
-class PetSerializer(serializers.ModelSerializer):
+class PetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     tags = serializers.PrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Pet
         fields = '__all__'
-        read_only_fields = ('id', 'date_posted')
+        read_only_fields = ('id', 'date_posted', 'like_count', 'comment_count', 'thumbnail_hash', 'latitude', 'longitude', 'geohash')
+        field_columns = {'srcset': ('thumbnail_hash',)}
+        expandable_fields = {'shelter': ShelterSerializer, 'tags': TagSerializer}
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Load the tags of every pet in one query instead of one per pet.
+        """
+        return queryset.prefetch_related('tags')
+
+    def get_srcset(self, obj):
+        return thumbnail_srcset(obj.thumbnail_hash)
+
+
+
+class PetBulkSerializer(serializers.ModelSerializer):
+    """
+    One pet of a bulk intake request. The shelter and user come from the
+    request, and tags are given as ids or names and resolved in one query.
+    """
+    tags = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+
+    class Meta:
+        model = Pet
+        exclude = ('shelter', 'user')
+        read_only_fields = ('id', 'date_posted', 'like_count', 'comment_count', 'thumbnail_hash', 'latitude', 'longitude', 'geohash')
 
         
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = '__all__'
+        # Set on save, so polling for new comments (see CommentKeysetPagination) sees them all
+        read_only_fields = ('date_commented',)
 
-class LikeSerializer(serializers.ModelSerializer):
+class LikeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Like
         fields = '__all__'
+
+    def get_validators(self):
+        validators = super().get_validators()
+        if self.instance is None:
+            # Liking a pet twice is not an error, see create(); moving a like onto one still is
+            return [validator for validator in validators if not isinstance(validator, UniqueTogetherValidator)]
+        return validators
+
+    def create(self, validated_data):
+        """
+        The like of the user for the pet, inserted unless it exists.
+        `self.created` tells which; get_or_create keeps the counter signals.
+        """
+        # Built like ModelSerializer would, so defaults and save(user_id=...) apply
+        unsaved = Like(**validated_data)
+        like, self.created = Like.objects.get_or_create(pet_id=unsaved.pet_id, user_id=unsaved.user_id)
+        return like
         
+class UploadSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Bytes per PUT the client should send, see pets/uploads.py
+    chunk_size = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Upload
+        fields = ('id', 'target', 'pet', 'filename', 'size', 'sha256', 'received', 'status', 'chunk_size', 'date_created')
+        read_only_fields = ('id', 'received', 'status', 'date_created')
+
+    def get_chunk_size(self, obj):
+        return settings.UPLOAD_CHUNK_SIZE
+
 class UserLikesSerializer(serializers.ModelSerializer):
     class Meta:
         model = Like
@@ -59,24 +235,62 @@ class UserSheltersSerializer(serializers.ModelSerializer):
         model = Shelter
         fields = '__all__'
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     location = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
-    likes = UserLikesSerializer(many=True, read_only=True, source='like_set')
-    comments = UserCommentsSerializer(many=True, read_only=True, source='comment_set')
-    pets = UserPetsSerializer(many=True, read_only=True, source='pet_set')
-    shelters = UserSheltersSerializer(many=True, read_only=True, source='shelter_set')
+    srcset = serializers.SerializerMethodField()
+    likes = UserLikesSerializer(many=True, read_only=True, source='recent_likes')
+    comments = UserCommentsSerializer(many=True, read_only=True, source='recent_comments')
+    pets = UserPetsSerializer(many=True, read_only=True, source='recent_pets')
+    shelters = UserSheltersSerializer(many=True, read_only=True, source='recent_shelters')
+
+    # Most recent rows embedded per nested set
+    nested_limit = 20
 
     class Meta:
         model = User
         fields = ('username', 'first_name', 'last_name', 'email', 'password', 'id', 
-                  'location', 'image', 'likes', 'comments', 'pets', 'shelters')
+                  'location', 'image', 'srcset', 'likes', 'comments', 'pets', 'shelters')
         extra_kwargs = {'password': {'write_only': True}}
-        
+
+    @staticmethod
+    def nested_sets():
+        """`(related name, attribute, rows most recent first)` of each nested set."""
+        return (
+            ('likes', 'recent_likes', Like.objects.order_by('-id')),
+            ('comment_set', 'recent_comments', Comment.objects.order_by('-id')),
+            ('pet_set', 'recent_pets', Pet.objects.prefetch_related('tags').order_by('-id')),
+            ('shelters', 'recent_shelters', Shelter.objects.order_by('-id')),
+        )
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        Load profiles and the bounded nested sets up front, so serializing any
+        number of users costs a fixed number of queries.
+        """
+        return queryset.select_related('userprofile').prefetch_related(*(
+            Prefetch(related_name, queryset=rows[:cls.nested_limit], to_attr=attribute)
+            for related_name, attribute, rows in cls.nested_sets()
+        ))
+
+    def to_representation(self, instance):
+        # Users not fetched through setup_eager_loading (e.g. one just created
+        # or updated) load the same bounded sets, one query each
+        sources = {field.source for field in self.fields.values()}
+        for _, attribute, rows in self.nested_sets():
+            if attribute in sources and not hasattr(instance, attribute):
+                setattr(instance, attribute, list(rows.filter(user=instance)[:self.nested_limit]))
+        return super().to_representation(instance)
+
     def get_location(self, obj):
-      profile = UserProfile.objects.filter(user=obj).first()
+      profile = getattr(obj, 'userprofile', None)
       return profile.location if profile else "Heaven"
 
     def get_image(self, obj):
-      profile = UserProfile.objects.filter(user=obj).first()
-      return profile.image.url if profile and profile.image else "https://cdn-icons-png.flaticon.com/512/1581/1581594.png"
\ No newline at end of file
+      profile = getattr(obj, 'userprofile', None)
+      return profile.image.url if profile and profile.image else "https://cdn-icons-png.flaticon.com/512/1581/1581594.png"
+
+    def get_srcset(self, obj):
+      profile = getattr(obj, 'userprofile', None)
+      return thumbnail_srcset(profile.thumbnail_hash) if profile else None
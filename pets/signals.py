@@ -0,0 +1,379 @@
+from django.contrib.auth.models import User
+from django.db.models import F, QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_token, forget_user
+from .cache import bump_version, invalidate_responses
+from .facets import FACET_NAMESPACE
+from .geo import geocode_instance, geocode_rows
+from .models import (
+    Comment, Like, Pet, Pet_Tag, Shelter, SimilarPet, SimilarPetRefresh, Tag, UserProfile, UserRecommendationRefresh,
+)
+from .search import INDEXED_FIELDS, index_pet, index_pets, unindex_pet
+from .thumbnails import IMAGE_FIELDS, refresh_thumbnails
+
+
+# Sent with `pets=[...]` after pets are inserted with bulk_create(), which
+# bypasses post_save (see pets/bulk.py)
+pets_bulk_created = Signal()
+
+
+# Like / comment counters on Pet
+COUNTER_FIELDS = {Like: 'like_count', Comment: 'comment_count'}
+
+
+def adjust_counter(model, pet_id, delta):
+    """
+    Atomically add `delta` to the counter of `model` on the pet, never below zero.
+    """
+    field = COUNTER_FIELDS[model]
+    pets = Pet.objects.filter(pk=pet_id)
+    if delta < 0:
+        pets = pets.filter(**{f'{field}__gte': -delta})
+    pets.update(**{field: F(field) + delta, 'date_updated': timezone.now()})
+    # Every pet list shows the counters, and ordering=popular sorts by them
+    invalidate_responses('pets', pet_id)
+
+
+@receiver(pre_save, sender=Like)
+@receiver(pre_save, sender=Comment)
+def remember_counted_pet(sender, instance, **kwargs):
+    """Remember the pet an existing row counted towards, in case it is moved."""
+    if not instance._state.adding and instance.pk is not None:
+        instance._counted_pet_id = sender.objects.filter(pk=instance.pk).values_list('pet_id', flat=True).first()
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Comment)
+def count_saved(sender, instance, created, **kwargs):
+    if created:
+        adjust_counter(sender, instance.pet_id, 1)
+        return
+    previous_pet_id = getattr(instance, '_counted_pet_id', None)
+    if previous_pet_id is not None and previous_pet_id != instance.pet_id:
+        adjust_counter(sender, previous_pet_id, -1)
+        adjust_counter(sender, instance.pet_id, 1)
+
+
+@receiver(post_delete, sender=Like)
+@receiver(post_delete, sender=Comment)
+def count_deleted(sender, instance, **kwargs):
+    # Also fires for rows removed by cascade (user or pet deletion)
+    adjust_counter(sender, instance.pet_id, -1)
+
+
+# Full-text search index
+@receiver(post_save, sender=Pet)
+def index_saved_pet(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS):
+        return
+    index_pet(instance)
+
+
+@receiver(post_delete, sender=Pet)
+def unindex_deleted_pet(sender, instance, **kwargs):
+    unindex_pet(instance.pk)
+
+
+@receiver(pets_bulk_created)
+def index_bulk_created_pets(sender, pets, **kwargs):
+    index_pets(pets)
+
+
+# Facet counts (shelter and tag names are facet labels)
+@receiver(post_save, sender=Pet)
+@receiver(post_delete, sender=Pet)
+@receiver(post_save, sender=Pet_Tag)
+@receiver(post_delete, sender=Pet_Tag)
+@receiver(post_save, sender=Shelter)
+@receiver(post_delete, sender=Shelter)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(pets_bulk_created)
+def invalidate_facets(sender, **kwargs):
+    bump_version(FACET_NAMESPACE)
+
+
+@receiver(m2m_changed, sender=Pet.tags.through)
+def invalidate_facets_on_tagging(sender, action, **kwargs):
+    # pet.tags.add()/remove()/clear() bypass Pet_Tag's own save/delete signals
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_version(FACET_NAMESPACE)
+
+
+# Cached API responses (pets.views.mixins.CachedReadMixin)
+@receiver(post_save, sender=Pet)
+@receiver(post_delete, sender=Pet)
+def invalidate_pet_responses(sender, instance, **kwargs):
+    invalidate_responses('pets', instance.pk)
+
+
+@receiver(pets_bulk_created)
+def invalidate_pet_lists(sender, **kwargs):
+    invalidate_responses('pets')
+
+
+@receiver(post_save, sender=Shelter)
+@receiver(post_delete, sender=Shelter)
+def invalidate_shelter_responses(sender, instance, **kwargs):
+    invalidate_responses('shelters', instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_responses(sender, instance, **kwargs):
+    invalidate_responses('tags', instance.pk)
+
+
+@receiver(post_save, sender=Pet_Tag)
+@receiver(post_delete, sender=Pet_Tag)
+def invalidate_pet_tag_responses(sender, instance, **kwargs):
+    invalidate_responses('pets', instance.pet_id)
+    invalidate_responses('tags')
+
+
+@receiver(m2m_changed, sender=Pet.tags.through)
+def invalidate_responses_on_tagging(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # Forward: pet.tags.add(tag). Reverse: tag.pets.add(pet), where pk_set holds pets
+    pet_ids = (pk_set or ()) if reverse else (instance.pk,)
+    invalidate_responses('pets', *pet_ids)
+    invalidate_responses('tags')
+
+
+# Export change tracking: `date_updated` also moves when a pet's tags change
+
+
+def touch_pets(*pet_ids):
+    if pet_ids:
+        Pet.objects.filter(pk__in=pet_ids).update(date_updated=timezone.now())
+
+
+@receiver(post_save, sender=Pet_Tag)
+@receiver(post_delete, sender=Pet_Tag)
+def touch_tagged_pet(sender, instance, **kwargs):
+    touch_pets(instance.pet_id)
+
+
+@receiver(m2m_changed, sender=Pet.tags.through)
+def touch_pets_on_tagging(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    touch_pets(*((pk_set or ()) if reverse else (instance.pk,)))
+
+
+# Similar pets: queue the pets whose features changed for
+# `build_similar_pets --pending` (pets/similarity.py)
+SIMILARITY_FIELDS = ('pet_type', 'shelter', 'age')
+
+
+def queue_similarity_refresh(*pet_ids):
+    if pet_ids:
+        # A pet queued again keeps one entry, with the latest request date
+        SimilarPetRefresh.objects.bulk_create(
+            [SimilarPetRefresh(pet_id=pet_id) for pet_id in pet_ids],
+            update_conflicts=True, unique_fields=['pet'], update_fields=['date_requested'],
+        )
+
+
+@receiver(post_save, sender=Pet)
+def queue_saved_pet(sender, instance, created, update_fields=None, **kwargs):
+    if not created and update_fields is not None and not set(update_fields) & set(SIMILARITY_FIELDS):
+        return
+    queue_similarity_refresh(instance.pk)
+
+
+@receiver(pets_bulk_created)
+def queue_bulk_created_pets(sender, pets, **kwargs):
+    queue_similarity_refresh(*(pet.pk for pet in pets))
+
+
+@receiver(pre_delete, sender=Pet)
+def queue_pets_listing_deleted_pet(sender, instance, **kwargs):
+    # Their row for this pet goes with it by cascade, leaving a gap to fill
+    queue_similarity_refresh(*SimilarPet.objects.filter(similar=instance).values_list('pet_id', flat=True))
+
+
+@receiver(post_save, sender=Pet_Tag)
+def queue_tagged_pet(sender, instance, **kwargs):
+    queue_similarity_refresh(instance.pet_id)
+
+
+@receiver(post_delete, sender=Pet_Tag)
+def queue_untagged_pet(sender, instance, origin=None, **kwargs):
+    # Not when the pet itself is being deleted, its queue entry would outlive it
+    deleting = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if deleting is not Pet:
+        queue_similarity_refresh(instance.pet_id)
+
+
+@receiver(m2m_changed, sender=Pet.tags.through)
+def queue_pets_on_tagging(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    queue_similarity_refresh(*((pk_set or ()) if reverse else (instance.pk,)))
+
+
+# Recommendations: queue the users whose likes changed for
+# `build_recommendations --pending` (pets/recommendations.py)
+
+
+def queue_recommendation_refresh(*user_ids):
+    if user_ids:
+        UserRecommendationRefresh.objects.bulk_create(
+            [UserRecommendationRefresh(user_id=user_id) for user_id in user_ids],
+            update_conflicts=True, unique_fields=['user'], update_fields=['date_requested'],
+        )
+
+
+@receiver(post_save, sender=Like)
+def queue_liking_user(sender, instance, **kwargs):
+    queue_recommendation_refresh(instance.user_id)
+
+
+@receiver(post_delete, sender=Like)
+def queue_unliking_user(sender, instance, origin=None, **kwargs):
+    # Not when the user is being deleted, as for tags of deleted pets
+    deleting = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if deleting is not User:
+        queue_recommendation_refresh(instance.user_id)
+
+
+# Values a row had when loaded or last saved, so saves compare against them
+# instead of reading the row again
+TRACKED_FIELDS = {
+    Pet: ('img', 'location', 'shelter'),
+    Shelter: ('img', 'location'),
+    UserProfile: ('image', 'location'),
+}
+
+
+def tracked_values(instance, names):
+    values = {}
+    for name in names:
+        attname = instance._meta.get_field(name).attname
+        # Deferred fields are missing from __dict__, their values unknown
+        if attname in instance.__dict__:
+            value = instance.__dict__[attname]
+            values[name] = getattr(value, 'name', value)
+    return values
+
+
+@receiver(post_init, sender=Pet)
+@receiver(post_init, sender=Shelter)
+@receiver(post_init, sender=UserProfile)
+def remember_loaded_values(sender, instance, **kwargs):
+    instance._tracked = tracked_values(instance, TRACKED_FIELDS[sender])
+
+
+@receiver(post_save, sender=Pet)
+@receiver(post_save, sender=Shelter)
+@receiver(post_save, sender=UserProfile)
+def remember_saved_values(sender, instance, update_fields=None, **kwargs):
+    names = TRACKED_FIELDS[sender] if update_fields is None else set(TRACKED_FIELDS[sender]) & set(update_fields)
+    # Instances unpickled from the cache may predate tracking
+    instance._tracked = {**getattr(instance, '_tracked', {}), **tracked_values(instance, names)}
+
+
+def tracked_changed(instance, *names):
+    """Whether any of the fields may differ from what the row stores."""
+    if instance._state.adding:
+        return True
+    tracked, current = getattr(instance, '_tracked', {}), tracked_values(instance, names)
+    return any(name not in tracked or tracked[name] != current.get(name) for name in names)
+
+
+# Coordinates of free-text locations (pets/geo.py)
+
+
+@receiver(pre_save, sender=Pet)
+@receiver(pre_save, sender=Shelter)
+@receiver(pre_save, sender=UserProfile)
+def geocode_saved_location(sender, instance, update_fields=None, **kwargs):
+    # A pet without a known location of its own takes its shelter's
+    located_by = ('location', 'shelter') if sender is Pet else ('location',)
+    instance._moved = update_fields is None and tracked_changed(instance, *located_by) and geocode_instance(instance)
+
+
+@receiver(post_save, sender=Pet)
+@receiver(post_save, sender=Shelter)
+@receiver(post_save, sender=UserProfile)
+def geocode_updated_location(sender, instance, update_fields=None, **kwargs):
+    # save(update_fields=...) would not write coordinates set in pre_save
+    if update_fields is not None and {'location', 'shelter'} & set(update_fields):
+        instance._moved = geocode_rows(sender.objects.filter(pk=instance.pk)) > 0
+    if sender is Shelter and getattr(instance, '_moved', False):
+        # Its pets without a known location of their own move with it
+        geocode_rows(Pet.objects.filter(shelter=instance))
+
+
+@receiver(pets_bulk_created)
+def geocode_bulk_created_pets(sender, pets, **kwargs):
+    geocode_rows(Pet.objects.filter(pk__in=[pet.pk for pet in pets]))
+
+
+# Cached token authentication
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    forget_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_changed_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+# Thumbnail variants of uploaded images
+
+
+@receiver(pre_save, sender=Pet)
+@receiver(pre_save, sender=Shelter)
+@receiver(pre_save, sender=UserProfile)
+def remember_stored_image(sender, instance, update_fields=None, **kwargs):
+    """Remember the image an existing row stores, so only a replaced one is rendered."""
+    field = IMAGE_FIELDS[sender._meta.model_name]
+    if update_fields is not None and field not in update_fields:
+        return
+    tracked = getattr(instance, '_tracked', {})
+    if field in tracked:
+        instance._stored_image = tracked[field]
+    elif not instance._state.adding and instance.pk is not None:
+        # Loaded without the image field
+        instance._stored_image = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+def image_replaced(instance, name, created, update_fields):
+    if update_fields is not None and IMAGE_FIELDS[instance._meta.model_name] not in update_fields:
+        return False
+    return created or getattr(instance, '_stored_image', None) != name
+
+
+@receiver(post_save, sender=Pet)
+@receiver(post_save, sender=Shelter)
+def thumbnail_saved_img(sender, instance, created, update_fields=None, **kwargs):
+    if image_replaced(instance, instance.img, created, update_fields):
+        refresh_thumbnails(sender, [instance.pk], instance.img, instance.thumbnail_hash)
+
+
+@receiver(post_save, sender=UserProfile)
+def thumbnail_saved_profile_image(sender, instance, created, update_fields=None, **kwargs):
+    if image_replaced(instance, instance.image.name, created, update_fields):
+        refresh_thumbnails(sender, [instance.pk], instance.image.name, instance.thumbnail_hash)
+
+
+@receiver(pets_bulk_created)
+def thumbnail_bulk_created_pets(sender, pets, **kwargs):
+    # Imports tend to reuse a few images, render each one once
+    pks_by_img = {}
+    for pet in pets:
+        pks_by_img.setdefault(pet.img, []).append(pet.pk)
+    for img, pks in pks_by_img.items():
+        refresh_thumbnails(Pet, pks, img)
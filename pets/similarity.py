@@ -0,0 +1,314 @@
+"""
+"You may also like": the most similar pets of every pet, precomputed.
+
+Each pet is a sparse vector with one feature per tag plus its pet type,
+shelter and age bucket. Features are weighted by inverse document frequency
+(a tag carried by 40 pets says more than the pet type "Dog") times the
+weight of their kind (FEATURE_WEIGHTS), and two pets' similarity is the
+cosine of their vectors. The best SIMILAR_PETS_K neighbors of each pet are
+stored in `SimilarPet`, so serving them is one indexed read.
+
+Neighbors are computed in batches of pets on a process pool; workers only
+run NumPy over the arrays of a `FeatureIndex`, the main process does the
+database work. The candidates of a pet are the pets sharing a feature with
+it, found through an inverted index. The DENSE_FEATURES most common features
+(pet types, big shelters, popular tags) would make every pet a candidate, so
+they only propose their CANDIDATES_PER_FEATURE most liked pets, and so do the
+pets with exactly the same dense features. Their contribution to a
+candidate's score is still exact, read from a bitmask of those features per
+pet.
+
+`refresh_similar_pets` is incremental: it recomputes the pets queued in
+`SimilarPetRefresh` by the signals in pets/signals.py (new pets, changed
+tags, type, shelter or age), the pets listing them as neighbors and their
+new neighbors. Feature weights come from the current data, so run a full
+`build_similar_pets` now and then as well.
+"""
+import multiprocessing
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .models import Pet, Pet_Tag, SimilarPet, SimilarPetRefresh
+
+# Kind of feature -> weight, on top of inverse document frequency
+FEATURE_WEIGHTS = {'tag': 1.0, 'pet_type': 1.0, 'shelter': 0.5, 'age': 0.5}
+# Upper bounds (months) of the age buckets: under 6 months, under a year, ...
+AGE_BUCKETS = (6, 12, 36, 84)
+# Features handled through per-pet bitmasks instead of full posting lists
+DENSE_FEATURES = 64
+# Candidates proposed by each dense feature, its most liked pets
+CANDIDATES_PER_FEATURE = 300
+BATCH_SIZE = 500
+
+
+def ranges(starts, lengths):
+    """Concatenation of `arange(start, start + length)` for each pair."""
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+def best_per_row(local, candidates, scores, k):
+    """
+    Keep the best `k` scores of each row, ranked, ties to the lower candidate.
+    The arrays must be sorted by row then candidate, and scores within 0 to 1.
+    """
+    # A stable sort on one key keeps the candidate order, and is much faster
+    # than a lexsort
+    order = np.argsort(local + (1 - scores) / 2, kind='stable')
+    local, candidates, scores = local[order], candidates[order], scores[order]
+    ranks = np.arange(len(local)) - np.searchsorted(local, local, side='left')
+    best = ranks < k
+    return local[best], candidates[best], ranks[best], scores[best]
+
+
+class RowIndex:
+    """
+    Rows numbered by ascending id, scored in batches by `compute`: subclasses
+    implement `top(rows, k)`. Picklable, for the worker processes.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.size = len(ids)
+
+    def find(self, ids):
+        """`(rows, found)`: the row of each id and whether it is in the index."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not self.size:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        rows = np.minimum(np.searchsorted(self.ids, ids), self.size - 1)
+        return rows, self.ids[rows] == ids
+
+    def rows_of(self, ids):
+        """Rows of the ids in `ids` that are in the index."""
+        rows, found = self.find(ids)
+        return rows[found]
+
+    def top(self, rows, k):
+        """`(row ids, pet ids, ranks, scores)` of the best `k` pets of each row, as flat arrays."""
+        raise NotImplementedError
+
+
+class FeatureIndex(RowIndex):
+    """Pet feature vectors in the two layouts scoring needs."""
+
+    def __init__(self, ids, pet_types, shelter_ids, ages, like_counts, tag_pet_ids, tag_ids):
+        super().__init__(ids)
+        n = self.size
+
+        # (row, feature) entries of every kind, features numbered kind by kind
+        rows, cols, kinds = [], [], []
+        offset = 0
+
+        def add(kind, entry_rows, values):
+            nonlocal offset
+            if not len(entry_rows):
+                return
+            unique, inverse = np.unique(values, return_inverse=True)
+            rows.append(entry_rows)
+            cols.append(inverse + offset)
+            kinds.append(np.full(len(unique), FEATURE_WEIGHTS[kind]))
+            offset += len(unique)
+
+        # Tags of pets created since the pets were read are left out
+        tag_rows, known = self.find(tag_pet_ids)
+        add('tag', tag_rows[known], tag_ids[known])
+        add('pet_type', np.arange(n), pet_types)
+        has_shelter = shelter_ids >= 0
+        add('shelter', np.flatnonzero(has_shelter), shelter_ids[has_shelter])
+        has_age = ages >= 0
+        add('age', np.flatnonzero(has_age), np.searchsorted(AGE_BUCKETS, ages[has_age], side='right'))
+
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        kind_weights = np.concatenate(kinds) if kinds else np.zeros(0)
+        features = offset
+
+        # Inverse document frequency; a feature every pet has weighs nothing
+        frequency = np.bincount(cols, minlength=features)
+        weights = kind_weights * np.log(n / np.maximum(frequency, 1))
+        entry_weights = weights[cols]
+        norms = np.sqrt(np.bincount(rows, weights=entry_weights ** 2, minlength=n))
+        # Featureless pets score 0 against everything
+        self.norms = np.where(norms > 0, norms, np.inf)
+
+        # Most common features go to per-pet bitmasks
+        dense = np.argsort(-frequency, kind='stable')[:DENSE_FEATURES]
+        dense = dense[frequency[dense] > 0]
+        dense_bit = np.full(features, -1)
+        dense_bit[dense] = np.arange(len(dense))
+        self.bits = np.zeros(n, dtype=np.uint64)
+        is_dense = dense_bit[cols] >= 0
+        np.bitwise_or.at(self.bits, rows[is_dense], np.left_shift(np.uint64(1), dense_bit[cols[is_dense]].astype(np.uint64)))
+        # Summed squared weights of the bits set in each byte of a mask
+        squared = np.zeros(64)
+        squared[:len(dense)] = weights[dense] ** 2
+        byte_values = np.arange(256)
+        self.byte_weights = np.array([
+            sum(((byte_values >> bit) & 1) * squared[8 * byte + bit] for bit in range(8))
+            for byte in range(8)
+        ])
+
+        # Candidate-only features, weighing nothing: pets with the same set of
+        # dense features, the best candidates on that side of the score
+        has_bits = np.flatnonzero(self.bits)
+        signatures, signature_cols = np.unique(self.bits[has_bits], return_inverse=True)
+        rows = np.concatenate((rows, has_bits))
+        cols = np.concatenate((cols, signature_cols.ravel() + features))
+        features += len(signatures)
+        frequency = np.bincount(cols, minlength=features)
+        self.weights = np.concatenate((weights, np.zeros(len(signatures))))
+        self.dense_bit = np.concatenate((dense_bit, np.full(len(signatures), -1)))
+        capped = np.zeros(features, dtype=bool)
+        capped[dense] = True
+        capped[features - len(signatures):] = True
+
+        # Row layout (CSR): the features of each pet
+        order = np.lexsort((cols, rows))
+        self.row_ptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n))))
+        self.row_cols = cols[order]
+
+        # Column layout (inverted index): the pets of each feature, most liked
+        # first, dense and signature features cut to their top candidates
+        popularity = np.empty(n, dtype=np.int64)
+        popularity[np.lexsort((ids, -like_counts))] = np.arange(n)
+        order = np.lexsort((popularity[rows], cols))
+        sorted_cols = cols[order]
+        starts = np.concatenate(([0], np.cumsum(frequency)))[:-1]
+        position = np.arange(len(order)) - starts[sorted_cols]
+        keep = ~capped[sorted_cols] | (position < CANDIDATES_PER_FEATURE)
+        self.col_ptr = np.concatenate(([0], np.cumsum(np.bincount(sorted_cols[keep], minlength=features))))
+        self.col_rows = rows[order][keep]
+
+    def top(self, rows, k):
+        """
+        `(pet ids, neighbor ids, ranks, scores)` of the best `k` neighbors of
+        each pet in `rows`, as flat arrays.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.row_ptr[rows + 1] - self.row_ptr[rows]
+        entry_local = np.repeat(np.arange(len(rows)), lengths)
+        entry_cols = self.row_cols[ranges(self.row_ptr[rows], lengths)]
+
+        # Candidates through the inverted index, with the exact weight of sparse features
+        posting_lengths = self.col_ptr[entry_cols + 1] - self.col_ptr[entry_cols]
+        pair_local = np.repeat(entry_local, posting_lengths)
+        pair_candidates = self.col_rows[ranges(self.col_ptr[entry_cols], posting_lengths)]
+        sparse_weights = np.where(self.dense_bit[entry_cols] < 0, self.weights[entry_cols] ** 2, 0.0)
+        keys, inverse = np.unique(pair_local * self.size + pair_candidates, return_inverse=True)
+        dots = np.bincount(inverse.ravel(), weights=np.repeat(sparse_weights, posting_lengths), minlength=len(keys))
+        local, candidates = keys // self.size, keys % self.size
+
+        # Dense features shared by each pair
+        shared = self.bits[rows[local]] & self.bits[candidates]
+        for byte in range(8):
+            dots += self.byte_weights[byte][((shared >> np.uint64(8 * byte)) & np.uint64(255)).astype(np.int64)]
+
+        scores = np.minimum(dots / (self.norms[rows[local]] * self.norms[candidates]), 1.0)
+        keep = (candidates != rows[local]) & (scores > 0)
+        local, candidates, scores = local[keep], candidates[keep], scores[keep]
+
+        local, candidates, ranks, scores = best_per_row(local, candidates, scores, k)
+        return self.ids[rows[local]], self.ids[candidates], ranks, scores
+
+
+def load_index():
+    """A `FeatureIndex` of every pet, read in two queries."""
+    pets = list(Pet.objects.order_by('id').values_list('id', 'pet_type', 'shelter_id', 'age', 'like_count').iterator(chunk_size=10000))
+    ids, pet_types, shelter_ids, ages, like_counts = zip(*pets) if pets else ((),) * 5
+    tagging = np.array(list(Pet_Tag.objects.values_list('pet_id', 'tag_id').iterator(chunk_size=10000)), dtype=np.int64).reshape(-1, 2)
+    return FeatureIndex(
+        np.array(ids, dtype=np.int64),
+        np.array([pet_type or '' for pet_type in pet_types], dtype=str),
+        np.array([-1 if shelter_id is None else shelter_id for shelter_id in shelter_ids], dtype=np.int64),
+        np.array([-1 if age is None else age for age in ages], dtype=np.int64),
+        np.array(like_counts, dtype=np.int64),
+        tagging[:, 0], tagging[:, 1],
+    )
+
+
+# Worker processes
+
+_index = None
+
+
+def init_worker(index):
+    global _index
+    _index = index
+
+
+def score_batch(task):
+    rows, k = task
+    return _index.ids[rows], _index.top(rows, k)
+
+
+def compute(index, rows, workers, k):
+    """Yield `(ids, arrays of index.top)` for `rows` of a `RowIndex`, batch by batch."""
+    batches = [(rows[start:start + BATCH_SIZE], k) for start in range(0, len(rows), BATCH_SIZE)]
+    if workers <= 1 or len(batches) <= 1:
+        init_worker(index)
+        yield from map(score_batch, batches)
+        return
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(index,)) as pool:
+        yield from pool.imap(score_batch, batches)
+
+
+def store(model, fields, owner_ids, results):
+    """
+    Replace the rows of `model` owned by `owner_ids` with `results`, in one
+    transaction. `fields` name the result arrays, the owner first.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    rows = list(zip(*(array.tolist() for array in results)))
+    with transaction.atomic(), connection.cursor() as cursor:
+        model.objects.filter(**{f'{fields[0]}__in': owner_ids}).delete()
+        # Plain executemany: building model instances for bulk_create took
+        # four times as long as the inserts themselves
+        cursor.executemany(f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows)
+    return len(rows)
+
+
+def write_top(model, fields, index, rows, workers, k):
+    """Compute and store the best `k` pets of `rows`. Returns the set of those pet ids."""
+    pet_ids = set()
+    for owner_ids, results in compute(index, rows, workers, k):
+        store(model, fields, owner_ids.tolist(), results)
+        pet_ids.update(results[1].tolist())
+    return pet_ids
+
+
+def write_neighbors(index, rows, workers):
+    return write_top(SimilarPet, ('pet', 'similar', 'rank', 'score'), index, rows, workers, settings.SIMILAR_PETS_K)
+
+
+def build_similar_pets(workers=1):
+    """Recompute the neighbors of every pet. Returns the number of pets."""
+    # Changes queued from here on are not in the index
+    queued_before = SimilarPetRefresh.objects.aggregate(latest=Max('date_requested'))['latest']
+    index = load_index()
+    write_neighbors(index, np.arange(index.size), workers)
+    if queued_before is not None:
+        SimilarPetRefresh.objects.filter(date_requested__lte=queued_before).delete()
+    return index.size
+
+
+def refresh_similar_pets(workers=1):
+    """Recompute the pets queued for a refresh and the pets around them. Returns the number of pets."""
+    queued = dict(SimilarPetRefresh.objects.values_list('pet_id', 'date_requested'))
+    if not queued:
+        return 0
+    index = load_index()
+    changed = index.rows_of(sorted(queued))
+    # Pets that listed a changed pet may drop it, its new neighbors may take it
+    listing = set(SimilarPet.objects.filter(similar_id__in=list(queued)).values_list('pet_id', flat=True).distinct())
+    neighbor_ids = write_neighbors(index, changed, workers)
+    around = index.rows_of(sorted((listing | neighbor_ids) - set(index.ids[changed].tolist())))
+    write_neighbors(index, around, workers)
+    # Entries queued again while this ran stay for the next refresh
+    SimilarPetRefresh.objects.filter(pet_id__in=list(queued), date_requested__lte=max(queued.values())).delete()
+    return len(changed) + len(around)
@@ -0,0 +1,910 @@
+import csv
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse, UnreadablePostError
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APITestCase
+
+from . import authentication
+from .db_routers import _read_alias, finish_request, start_request
+from .export import EXPORT_FORMATS, aexport_pets, export_pets
+from .geo import geocode_rows, geohash
+from .models import Comment, ImportCheckpoint, Like, Pet, Pet_Tag, Shelter, Tag, Upload, UserProfile
+from .search import IndexNotReady, rebuild_index
+from .serializers import UserSerializer
+from .uploads import UploadError, write_chunk
+from .views.pet_viewset import PetViewSet
+
+
+class UserListingQueryTests(APITestCase):
+    """
+    Listing users must cost a fixed number of queries, whatever the user count.
+    """
+
+    def create_users(self, count):
+        tag, _ = Tag.objects.get_or_create(name='Playful')
+        for _ in range(count):
+            n = User.objects.count()
+            user = User.objects.create_user(username=f'user{n}', email=f'user{n}@example.com')
+            UserProfile.objects.create(user=user, location='Brussels')
+            shelter = Shelter.objects.create(user=user)
+            pet = Pet.objects.create(user=user, shelter=shelter)
+            pet.tags.add(tag)
+            Like.objects.create(user=user, pet=pet)
+            Comment.objects.create(user=user, pet=pet)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_all_users_query_count_is_constant(self):
+        self.create_users(2)
+        few = self.count_queries('/api/users/all/')
+        self.create_users(8)
+        many = self.count_queries('/api/users/all/')
+        self.assertEqual(few, many)
+
+    def test_all_users_embeds_nested_sets(self):
+        self.create_users(1)
+        data = self.client.get('/api/users/all/').json()[0]
+        self.assertEqual(data['location'], 'Brussels')
+        for key in ('likes', 'comments', 'pets', 'shelters'):
+            self.assertEqual(len(data[key]), 1)
+
+    def add_activity(self, user, count):
+        shelter = Shelter.objects.create(user=user)
+        for _ in range(count):
+            pet = Pet.objects.create(user=user, shelter=shelter)
+            Like.objects.create(user=user, pet=pet)
+            Comment.objects.create(user=user, pet=pet)
+
+    def test_profile_query_count_is_constant(self):
+        self.create_users(1)
+        user = User.objects.first()
+        self.client.force_authenticate(user)
+        few = self.count_queries(f'/api/users/{user.id}/profile/')
+        self.add_activity(user, 5)
+        many = self.count_queries(f'/api/users/{user.id}/profile/')
+        self.assertEqual(few, many)
+
+    def test_users_not_eagerly_loaded_embed_nested_sets(self):
+        self.create_users(1)
+        data = UserSerializer(User.objects.get()).data
+        for key in ('likes', 'comments', 'pets', 'shelters'):
+            self.assertEqual(len(data[key]), 1)
+
+
+class LikeTests(APITestCase):
+    """
+    Liking is idempotent, but a like still cannot be moved onto an existing one.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='liker', email='liker@example.com')
+        shelter = Shelter.objects.create(user=self.user)
+        self.pets = [Pet.objects.create(user=self.user, shelter=shelter) for _ in range(2)]
+        self.client.force_authenticate(self.user)
+
+    def test_liking_again_returns_the_existing_like(self):
+        first = self.client.post('/api/likes/', {'pet': self.pets[0].id})
+        again = self.client.post('/api/likes/', {'pet': self.pets[0].id})
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json()['id'], first.json()['id'])
+        self.pets[0].refresh_from_db()
+        self.assertEqual(self.pets[0].like_count, 1)
+
+    def test_like_action_returns_the_pet_id(self):
+        response = self.client.put(f'/api/pets/{self.pets[0].id}/like/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['pet'], self.pets[0].id)
+        again = self.client.put(f'/api/pets/{self.pets[0].id}/like/')
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data, response.data)
+
+    def test_like_action_on_an_unknown_pet_is_not_found(self):
+        self.assertEqual(self.client.put('/api/pets/abc/like/').status_code, 404)
+        self.assertEqual(self.client.delete('/api/pets/abc/like/').status_code, 404)
+        self.assertEqual(self.client.put(f'/api/pets/{self.pets[-1].id + 1}/like/').status_code, 404)
+
+    def test_moving_a_like_onto_another_is_rejected(self):
+        like, other = (Like.objects.create(user=self.user, pet=pet) for pet in self.pets)
+        response = self.client.put(f'/api/likes/{like.id}/', {'pet': other.pet_id, 'user': self.user.id})
+        self.assertEqual(response.status_code, 400)
+
+
+class ResponseCacheTests(APITestCase):
+    """
+    Anonymous pet responses are cached until the rows behind them change.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        shelter = Shelter.objects.create(user=self.user)
+        self.pets = [Pet.objects.create(user=self.user, shelter=shelter) for _ in range(2)]
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['X-Cache'], response.json()
+
+    def test_like_expires_the_cached_lists(self):
+        url = '/api/pets/?ordering=popular'
+        self.assertEqual(self.get(url)[0], 'MISS')
+        outcome, data = self.get(url)
+        self.assertEqual(outcome, 'HIT')
+        self.assertEqual(data['results'][0]['id'], self.pets[1].id)
+
+        Like.objects.create(user=self.user, pet=self.pets[0])
+        outcome, data = self.get(url)
+        self.assertEqual(outcome, 'MISS')
+        self.assertEqual(data['results'][0]['id'], self.pets[0].id)
+        self.assertEqual(data['results'][0]['like_count'], 1)
+        self.assertEqual(self.get(f'/api/pets/{self.pets[0].id}/')[1]['like_count'], 1)
+
+    def test_saving_a_pet_expires_only_its_own_detail(self):
+        urls = [f'/api/pets/{pet.id}/' for pet in self.pets]
+        for url in urls:
+            self.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(urls[0])[0], 'HIT')
+        self.pets[0].name = 'Renamed'
+        self.pets[0].save()
+        outcome, data = self.get(urls[0])
+        self.assertEqual((outcome, data['name']), ('MISS', 'Renamed'))
+        self.assertEqual(self.get(urls[1])[0], 'HIT')
+
+    def test_tagging_expires_the_pet_and_tag_lists(self):
+        tag = Tag.objects.create(name='Playful')
+        for url in ('/api/pets/', '/api/tags/'):
+            self.get(url)
+        self.pets[0].tags.add(tag)
+        self.assertEqual(self.get('/api/pets/')[0], 'MISS')
+        self.assertEqual(self.get('/api/tags/')[0], 'MISS')
+
+    def test_signed_in_requests_skip_the_cache(self):
+        self.get('/api/pets/')
+        token = Token.objects.create(user=self.user)
+        response = self.client.get('/api/pets/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Cache', response)
+
+
+@override_settings(DATABASE_REPLICAS=['default'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(APITestCase):
+    """
+    Reads go to a replica unless the same credentials wrote moments ago.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def route(self, request, response=None):
+        """The alias the request reads from, None for the primary."""
+        start_request(request)
+        alias = _read_alias.get()
+        finish_request(request, response or HttpResponse())
+        return alias
+
+    def test_writer_reads_its_writes_from_the_primary(self):
+        token = {'HTTP_AUTHORIZATION': 'Token writer'}
+        self.assertEqual(self.route(self.factory.get('/api/pets/', **token)), 'default')
+        self.route(self.factory.post('/api/pets/', **token))
+        self.assertIsNone(self.route(self.factory.get('/api/pets/', **token)))
+        self.assertEqual(self.route(self.factory.get('/api/pets/', HTTP_AUTHORIZATION='Token other')), 'default')
+
+    def test_writes_without_credentials_pin_nobody(self):
+        self.route(self.factory.post('/api/users/login/'))
+        self.assertEqual(self.route(self.factory.get('/api/pets/')), 'default')
+
+    def test_login_pins_the_issued_token(self):
+        User.objects.create_user(username='reader', email='reader@example.com', password='secret')
+        token = self.client.post('/api/users/login/', {'username': 'reader', 'password': 'secret'}).json()['token']
+        self.assertIsNone(self.route(self.factory.get('/api/pets/', HTTP_AUTHORIZATION=f'Token {token}')))
+
+    def test_new_session_is_pinned(self):
+        response = HttpResponse()
+        response.set_cookie(settings.SESSION_COOKIE_NAME, 'new-session')
+        self.route(self.factory.post('/api-auth/login/'), response)
+        request = self.factory.get('/api/pets/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = 'new-session'
+        self.assertIsNone(self.route(request))
+
+
+class SearchTests(APITestCase):
+    """
+    BM25 search ranks the best matches first and fills pages under any filter.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.shelters = [Shelter.objects.create(user=self.user) for _ in range(2)]
+        self.exact = Pet.objects.create(user=self.user, shelter=self.shelters[0], name='Playful puppy')
+        self.partial = Pet.objects.create(user=self.user, shelter=self.shelters[0], name='Playful cat')
+        self.other = Pet.objects.create(user=self.user, shelter=self.shelters[0], name='Sleepy tortoise')
+        # The weakest match: one query term in a long text
+        self.far = Pet.objects.create(
+            user=self.user, shelter=self.shelters[1], name='Rex',
+            description='A calm, quiet and gentle companion who enjoys long naps and is only rarely playful.',
+        )
+        # Test saves journal on commit, which never comes: index what is there now
+        rebuild_index()
+
+    def search(self, params):
+        response = self.client.get('/api/pets/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [pet['id'] for pet in response.json()['results']]
+
+    def test_best_match_first(self):
+        # "playing" and "playful" share a stem
+        self.assertEqual(self.search({'q': 'playing puppies'}), [self.exact.id, self.partial.id, self.far.id])
+        self.assertNotIn(self.other.id, self.search({'q': 'playful'}))
+
+    def test_selective_filter_reaches_past_the_best_matches(self):
+        with mock.patch.object(PetViewSet, 'max_search_results', 2):
+            self.assertEqual(self.search({'q': 'playful', 'shelter': self.shelters[1].id}), [self.far.id])
+            self.assertEqual(self.search({'q': 'playful', 'shelter': self.shelters[0].id}), [self.exact.id, self.partial.id])
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get('/api/pets/search/').status_code, 400)
+
+    def test_unavailable_while_the_first_index_builds(self):
+        with mock.patch('pets.views.pet_viewset.search_pets', side_effect=IndexNotReady):
+            response = self.client.get('/api/pets/search/', {'q': 'playful'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '10')
+
+
+class NearbyTests(APITestCase):
+    """
+    Nearby search measures distances across the antimeridian, and geocoding
+    moves `date_updated` so exports pick up the new coordinates.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+
+    def create_pet_at(self, name, latitude, longitude):
+        pet = Pet.objects.create(user=self.user, name=name)
+        Pet.objects.filter(pk=pet.pk).update(latitude=latitude, longitude=longitude, geohash=geohash(latitude, longitude))
+        return pet
+
+    def nearby(self, params):
+        response = self.client.get('/api/pets/nearby/', params)
+        self.assertEqual(response.status_code, 200)
+        return [(pet['id'], round(pet['distance_km'])) for pet in response.json()['results']]
+
+    def test_radius_crosses_the_antimeridian(self):
+        east = self.create_pet_at('East', 0, 179.9)
+        west = self.create_pet_at('West', 0, -179.9)
+        self.create_pet_at('Far', 0, 170)
+        # 0.2 degrees of longitude at the equator
+        self.assertEqual(self.nearby({'lat': 0, 'lon': 179.9, 'radius_km': 50}), [(east.id, 0), (west.id, 22)])
+        self.assertEqual(self.nearby({'lat': 0, 'lon': -179.9, 'radius_km': 50}), [(west.id, 0), (east.id, 22)])
+
+    def test_geocoding_rows_moves_date_updated(self):
+        pet = Pet.objects.create(user=self.user, name='Kiwi')
+        Pet.objects.filter(pk=pet.pk).update(location='Auckland')
+        before = Pet.objects.get(pk=pet.pk).date_updated
+        self.assertEqual(geocode_rows(Pet.objects.all()), 1)
+        pet = Pet.objects.get(pk=pet.pk)
+        self.assertEqual((pet.latitude, pet.longitude), (-36.8485, 174.7633))
+        self.assertGreater(pet.date_updated, before)
+
+
+class SaveSignalTests(APITestCase):
+    """
+    Saving a pet compares its location, shelter and image with the values it
+    was loaded with, instead of reading the row or its shelter again.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.paris = Shelter.objects.create(user=self.user, location='Paris')
+        self.pet = Pet.objects.create(user=self.user, shelter=self.paris, location='Couch')
+
+    def test_unchanged_location_and_image_read_nothing(self):
+        pet = Pet.objects.get(pk=self.pet.pk)
+        pet.name = 'Renamed'
+        with CaptureQueriesContext(connection) as ctx:
+            pet.save()
+        self.assertEqual([q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')], [])
+
+    def test_changed_shelter_moves_the_pet(self):
+        auckland = Shelter.objects.create(user=self.user, location='Auckland')
+        pet = Pet.objects.get(pk=self.pet.pk)
+        pet.shelter = auckland
+        pet.save()
+        self.assertEqual((pet.latitude, pet.longitude), (auckland.latitude, auckland.longitude))
+        # Saved again unchanged, it keeps its coordinates
+        pet.save()
+        self.assertEqual(Pet.objects.values_list('latitude', 'longitude').get(pk=pet.pk), (-36.8485, 174.7633))
+
+    def test_only_a_replaced_image_is_rendered(self):
+        pet = Pet.objects.get(pk=self.pet.pk)
+        with mock.patch('pets.signals.refresh_thumbnails') as refresh:
+            pet.save()
+            refresh.assert_not_called()
+            pet.img = 'new.jpg'
+            pet.save()
+            refresh.assert_called_once()
+            pet.save()
+            refresh.assert_called_once()
+
+    def test_deferred_image_is_read_from_the_row(self):
+        pet = Pet.objects.only('pk', 'name').get(pk=self.pet.pk)
+        with mock.patch('pets.signals.refresh_thumbnails') as refresh:
+            pet.save(update_fields=['name', 'img'])
+        refresh.assert_not_called()
+
+
+class CounterTests(APITestCase):
+    """
+    Like and comment counters follow their rows, and `rebuild_pet_counters`
+    repairs the ones that drifted.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.other = User.objects.create_user(username='other', email='other@example.com')
+        self.pets = [Pet.objects.create(user=self.user) for _ in range(3)]
+
+    def counters(self):
+        return list(Pet.objects.order_by('id').values_list('like_count', 'comment_count'))
+
+    def test_counters_follow_likes_and_comments(self):
+        like = Like.objects.create(user=self.user, pet=self.pets[0])
+        Like.objects.create(user=self.other, pet=self.pets[0])
+        Comment.objects.create(user=self.user, pet=self.pets[1])
+        self.assertEqual(self.counters(), [(2, 0), (0, 1), (0, 0)])
+        like.pet = self.pets[2]
+        like.save()
+        self.assertEqual(self.counters(), [(1, 0), (0, 1), (1, 0)])
+        self.other.delete()
+        self.assertEqual(self.counters(), [(0, 0), (0, 1), (1, 0)])
+
+    def test_rebuild_fixes_drifted_counters_in_batches(self):
+        Like.objects.create(user=self.user, pet=self.pets[0])
+        Comment.objects.create(user=self.user, pet=self.pets[2])
+        Pet.objects.update(like_count=5, comment_count=5)
+        out = StringIO()
+        call_command('rebuild_pet_counters', '--dry-run', stdout=out)
+        self.assertIn('3 drifted pet counter(s) found.', out.getvalue())
+        self.assertEqual(self.counters(), [(5, 5)] * 3)
+
+        out = StringIO()
+        call_command('rebuild_pet_counters', '--batch-size=2', stdout=out)
+        self.assertIn('3 drifted pet counter(s) fixed.', out.getvalue())
+        self.assertEqual(self.counters(), [(1, 0), (0, 0), (0, 1)])
+        out = StringIO()
+        call_command('rebuild_pet_counters', stdout=out)
+        self.assertIn('0 drifted pet counter(s) fixed.', out.getvalue())
+
+
+class UploadTests(APITestCase):
+    """
+    Chunked uploads resume from the last stored byte and start over on a
+    checksum mismatch.
+    """
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, UPLOAD_TEMP_DIR=os.path.join(media_root, '.uploads'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.client.force_authenticate(self.user)
+        image = BytesIO()
+        Image.new('RGB', (32, 32), 'teal').save(image, 'PNG')
+        self.image = image.getvalue()
+
+    def start(self, sha256=None):
+        response = self.client.post('/api/uploads/', {
+            'target': 'profile', 'filename': 'me.png', 'size': len(self.image),
+            'sha256': sha256 or hashlib.sha256(self.image).hexdigest(),
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['chunk_size'], settings.UPLOAD_CHUNK_SIZE)
+        return response.json()['id']
+
+    def put(self, upload_id, start, end):
+        return self.client.put(
+            f'/api/uploads/{upload_id}/', self.image[start:end + 1], content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.image)}',
+        )
+
+    def test_interrupted_chunk_resumes_from_the_stored_bytes(self):
+        upload_id = self.start()
+        self.assertEqual(self.put(upload_id, 0, 9).json()['received'], 10)
+
+        # The connection drops 20 bytes into the next chunk
+        stream = mock.Mock(read=mock.Mock(side_effect=[self.image[10:30], UnreadablePostError]))
+        upload = Upload.objects.get(pk=upload_id)
+        with self.assertRaises(UploadError):
+            write_chunk(upload, stream, 10, len(self.image) - 10)
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').json()['received'], 30)
+
+        self.assertEqual(self.put(upload_id, 10, 19).status_code, 409)
+        response = self.put(upload_id, 30, len(self.image) - 1)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['status'], 'complete')
+        self.assertEqual(UserProfile.objects.get(user=self.user).image.read(), self.image)
+
+    def test_checksum_mismatch_starts_over(self):
+        upload_id = self.start(sha256='0' * 64)
+        response = self.put(upload_id, 0, len(self.image) - 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['received'], 0)
+        self.assertFalse(UserProfile.objects.filter(user=self.user).exists())
+
+
+class PetPaginationTests(APITestCase):
+    """
+    Pet listings page by keyset: no COUNT(*), and pets added while a client
+    pages through are neither repeated nor make it skip any.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.shelter = Shelter.objects.create(user=self.user)
+        self.pets = [Pet.objects.create(user=self.user, shelter=self.shelter) for _ in range(5)]
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, between_pages=lambda: None):
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                data = self.client.get(url).json()
+            self.assertFalse([q['sql'] for q in ctx.captured_queries if 'COUNT(' in q['sql']])
+            ids.extend(pet['id'] for pet in data['results'])
+            url = data['next']
+            between_pages()
+        return ids
+
+    def add_pet(self):
+        self.pets.append(Pet.objects.create(user=self.user, shelter=self.shelter))
+
+    def test_inserts_while_paging_are_not_repeated_nor_skipped(self):
+        ids = self.walk('/api/pets/?page_size=2', self.add_pet)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(ids[:5], [pet.id for pet in self.pets[:5]])
+
+    def test_nested_listings_page_by_keyset(self):
+        for url in (f'/api/shelters/{self.shelter.id}/pets/?page_size=2', f'/api/users/{self.user.id}/pets/?page_size=2'):
+            self.assertEqual(self.walk(url), [pet.id for pet in self.pets])
+
+    def test_popular_pages_step_over_ties(self):
+        likers = [User.objects.create_user(username=f'liker{n}', email=f'liker{n}@example.com') for n in range(2)]
+        for user in likers:
+            Like.objects.create(user=user, pet=self.pets[3])
+        Like.objects.create(user=likers[0], pet=self.pets[1])
+        original = {pet.id for pet in self.pets}
+        ids = self.walk('/api/pets/?ordering=popular&page_size=2', self.add_pet)
+        self.assertEqual(len(ids), len(set(ids)))
+        # Ties on like_count are broken by id, newest first
+        self.assertEqual(
+            [pet_id for pet_id in ids if pet_id in original],
+            [pet.id for pet in (self.pets[3], self.pets[1], self.pets[4], self.pets[2], self.pets[0])],
+        )
+
+    def test_previous_link_returns_the_same_page(self):
+        first = self.client.get('/api/pets/?ordering=popular&page_size=2').json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get('/api/pets/?ordering=popular&cursor=bogus').status_code, 404)
+
+
+class PetTagLoadingTests(APITestCase):
+    """
+    Pet and tag listings load tag memberships in one query per page, also
+    with tags or the shelter inlined through `?expand=`.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.tags = [Tag.objects.create(name=name) for name in ('Playful', 'Calm', 'Loud')]
+        self.client.force_authenticate(self.user)
+        self.add_pets(2)
+
+    def add_pets(self, count):
+        shelter = Shelter.objects.create(user=self.user, name=f'Shelter {Shelter.objects.count()}')
+        for _ in range(count):
+            pet = Pet.objects.create(user=self.user, shelter=shelter)
+            pet.tags.add(*self.tags)
+
+    def test_pet_list_query_count_is_constant(self):
+        for url, queries in (('/api/pets/', 2), ('/api/pets/?expand=shelter,tags', 2)):
+            with self.assertNumQueries(queries):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_pets(6)
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/pets/?expand=shelter,tags').json()['results']
+        self.assertEqual(len(data), 8)
+        self.assertEqual(data[-1]['tags'], [{'id': tag.id, 'name': tag.name} for tag in self.tags])
+        self.assertEqual(data[-1]['shelter']['name'], 'Shelter 1')
+
+    def test_tags_of_a_pet_in_one_query(self):
+        pet = Pet.objects.first()
+        with self.assertNumQueries(1):
+            data = self.client.get(f'/api/pets/{pet.id}/tags/').json()
+        self.assertEqual(sorted(tag['id'] for tag in data), [tag.id for tag in self.tags])
+
+
+class FacetTests(APITestCase):
+    """
+    Facet counts follow the listing filters, are served from the cache when
+    repeated, and are recomputed once pets, tags or shelters change.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.shelter = Shelter.objects.create(user=self.user, name='Happy Tails')
+        self.tag = Tag.objects.create(name='Playful')
+        self.pets = [
+            Pet.objects.create(user=self.user, shelter=self.shelter, pet_type=pet_type, gender=gender)
+            for pet_type, gender in (('Dog', 'Male'), ('Dog', 'Female'), ('Cat', 'Female'))
+        ]
+        self.pets[0].tags.add(self.tag)
+
+    def facets(self, params=None):
+        response = self.client.get('/api/pets/facets/', params or {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_follow_the_filters(self):
+        data = self.facets()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['facets']['pet_type'], [
+            {'value': 'Dog', 'label': 'Dog', 'count': 2}, {'value': 'Cat', 'label': 'Cat', 'count': 1},
+        ])
+        self.assertEqual(data['facets']['shelter'], [{'value': self.shelter.id, 'label': 'Happy Tails', 'count': 3}])
+        self.assertEqual(data['facets']['tag'], [{'value': self.tag.id, 'label': 'Playful', 'count': 1}])
+        data = self.facets({'gender': 'Female'})
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['facets']['tag'], [])
+
+    def test_repeated_counts_come_from_the_cache(self):
+        first = self.facets()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.facets(), first)
+
+    def test_changes_expire_the_counts(self):
+        self.facets()
+        self.pets[2].tags.add(self.tag)
+        self.assertEqual(self.facets()['facets']['tag'][0]['count'], 2)
+        Pet.objects.create(user=self.user, shelter=self.shelter, pet_type='Cat')
+        self.assertEqual(self.facets()['count'], 4)
+        self.shelter.name = 'Sad Tails'
+        self.shelter.save()
+        self.assertEqual(self.facets()['facets']['shelter'][0]['label'], 'Sad Tails')
+        self.pets[0].delete()
+        self.assertEqual(self.facets()['facets']['pet_type'][0], {'value': 'Cat', 'label': 'Cat', 'count': 2})
+
+
+class BulkIntakeTests(APITestCase):
+    """
+    Bulk intake inserts a batch of pets in a fixed number of queries, all or
+    nothing in atomic mode and the valid ones in partial mode.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.shelter = Shelter.objects.create(user=self.user)
+        self.tag = Tag.objects.create(name='Playful')
+        self.url = f'/api/shelters/{self.shelter.id}/pets/bulk/'
+        self.client.force_authenticate(self.user)
+
+    def post(self, items, mode=None):
+        url = f'{self.url}?mode={mode}' if mode else self.url
+        return self.client.post(url, items, format='json')
+
+    def test_batch_is_inserted_with_its_tags(self):
+        items = [{'name': f'Pet {n}', 'tags': ['Playful', str(self.tag.id)]} for n in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(items)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 3)
+        pets = Pet.objects.filter(shelter=self.shelter, user=self.user)
+        self.assertEqual(sorted(pets.values_list('id', flat=True)), response.json()['ids'])
+        self.assertEqual(Pet_Tag.objects.filter(pet__in=pets, tag=self.tag).count(), 3)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        counts = []
+        for size in (2, 20):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.post([{'name': 'Rex', 'tags': ['Playful']}] * size).status_code, 201)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_atomic_batch_with_an_invalid_pet_inserts_nothing(self):
+        response = self.post([{'name': 'Rex'}, {'age': 'old'}, {'tags': ['Unknown']}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2])
+        self.assertFalse(Pet.objects.exists())
+
+    def test_partial_batch_inserts_the_valid_pets(self):
+        response = self.post([{'name': 'Rex'}, {'age': 'old'}, {'name': 'Tom'}], mode='partial')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1])
+        self.assertEqual(sorted(Pet.objects.values_list('name', flat=True)), ['Rex', 'Tom'])
+
+    def test_unknown_mode_is_rejected(self):
+        self.assertEqual(self.post([{'name': 'Rex'}], mode='sometimes').status_code, 400)
+        self.assertFalse(Pet.objects.exists())
+
+    def test_only_the_shelter_owner_can_add_pets(self):
+        self.client.force_authenticate(User.objects.create_user(username='other', email='other@example.com'))
+        self.assertEqual(self.post([{'name': 'Rex'}]).status_code, 403)
+
+
+class ImportPetsTests(APITestCase):
+    """
+    `import_pets` commits batches with a checkpoint, so a failed run resumes
+    after the last committed row without importing any row twice.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='importer', email='importer@example.com')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'pets.csv')
+
+    def write_rows(self, ages):
+        with open(self.path, 'w', newline='', encoding='utf-8') as f:
+            f.write('name,age,shelter,tags\n')
+            for n, age in enumerate(ages, start=1):
+                f.write(f'Pet {n},{age},Shelter {n % 2},Calm|Playful\n')
+
+    def import_pets(self, *args):
+        call_command('import_pets', self.path, '--user=importer', '--batch-size=2', *args, stdout=StringIO(), stderr=StringIO())
+
+    def test_failed_run_resumes_after_the_last_committed_batch(self):
+        self.write_rows([1, 2, 3, 'old', 5])
+        with self.assertRaises(CommandError):
+            self.import_pets('--strict')
+        self.assertEqual(list(Pet.objects.order_by('id').values_list('name', flat=True)), ['Pet 1', 'Pet 2'])
+        self.assertEqual(ImportCheckpoint.objects.get(name=self.path).row, 2)
+
+        self.write_rows([1, 2, 3, 4, 5])
+        self.import_pets('--strict', '--resume')
+        self.assertEqual(list(Pet.objects.order_by('id').values_list('name', flat=True)), [f'Pet {n}' for n in range(1, 6)])
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        self.assertEqual(Shelter.objects.count(), 2)
+        self.assertEqual(Pet_Tag.objects.count(), 10)
+
+    def test_invalid_rows_are_skipped_unless_strict(self):
+        self.write_rows([1, 'old', 3])
+        self.import_pets()
+        self.assertEqual(list(Pet.objects.order_by('id').values_list('age', flat=True)), [1, 3])
+
+
+class ExportTests(APITestCase):
+    """
+    The export streams every pet as NDJSON or CSV, or only those changed
+    since `updated_since`, tag changes included.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.tags = [Tag.objects.create(name=name) for name in ('Calm', 'Playful')]
+        self.old, self.new = (Pet.objects.create(user=self.user, name=name) for name in ('Old', 'New'))
+        self.old.tags.add(*self.tags)
+        Pet.objects.filter(pk=self.old.pk).update(date_updated=datetime(2020, 1, 1, tzinfo=dt_timezone.utc))
+
+    def export(self, params):
+        response = self.client.get('/api/pets/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_has_one_pet_per_line(self):
+        rows = [json.loads(line) for line in self.export({}).splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Old', 'New'])
+        self.assertEqual(rows[0]['tags'], [tag.id for tag in self.tags])
+
+    def test_csv_joins_tags(self):
+        rows = list(csv.DictReader(StringIO(self.export({'output': 'csv'}))))
+        self.assertEqual([row['name'] for row in rows], ['Old', 'New'])
+        self.assertEqual(rows[0]['tags'], '|'.join(str(tag.id) for tag in self.tags))
+
+    def test_async_export_matches(self):
+        pets = Pet.objects.all()
+        for output in EXPORT_FORMATS:
+            lines = async_to_sync(self.collect)(aexport_pets(pets, output, chunk_size=1))
+            self.assertEqual(''.join(lines), ''.join(export_pets(pets, output)))
+
+    @staticmethod
+    async def collect(lines):
+        return [line async for line in lines]
+
+    def test_updated_since_skips_unchanged_pets(self):
+        self.assertEqual([json.loads(line)['name'] for line in self.export({'updated_since': '2021-01-01'}).splitlines()], ['New'])
+        self.old.tags.remove(self.tags[0])
+        self.assertEqual(len(self.export({'updated_since': '2021-01-01T00:00:00Z'}).splitlines()), 2)
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/pets/export/', {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/pets/export/', {'updated_since': 'yesterday'}).status_code, 400)
+
+
+class CachedAuthenticationTests(APITestCase):
+    """
+    Tokens and users are looked up once, then served from the cache until
+    the user is saved or deleted or the token is rotated.
+    """
+
+    def setUp(self):
+        cache.clear()
+        authentication._local.clear()
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = authentication.CachedTokenAuthentication()
+
+    def test_repeated_lookups_read_nothing(self):
+        with self.assertNumQueries(2):
+            self.auth.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            user, _ = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual(user.username, 'owner')
+        # Also after the per-process layer expired
+        authentication._local.clear()
+        with self.assertNumQueries(0):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_saved_user_is_read_again(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_deleted_user_is_forgotten(self):
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_rotated_token_is_forgotten(self):
+        old_key = self.token.key
+        self.auth.authenticate_credentials(old_key)
+        self.token.delete()
+        rotated = Token.objects.create(user=self.user)
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(old_key)
+        self.assertEqual(self.auth.authenticate_credentials(rotated.key)[0].pk, self.user.pk)
+
+    def test_jwt_user_comes_from_the_cache(self):
+        token = authentication.issue_jwt(self.user)['token']
+        jwt_auth = authentication.CachedJWTAuthentication()
+        with self.assertNumQueries(1):
+            jwt_auth.get_user(jwt_auth.get_validated_token(token))
+        with self.assertNumQueries(0):
+            self.assertEqual(jwt_auth.get_user(jwt_auth.get_validated_token(token)).pk, self.user.pk)
+
+
+class CommentPaginationTests(APITestCase):
+    """
+    Comment threads page newest first by `(date_commented, id)` in one query
+    per page, and the poll link returns only the comments posted since.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.pet = Pet.objects.create(user=self.user)
+        self.comments = [Comment.objects.create(user=self.user, pet=self.pet, text=f'#{n}') for n in range(5)]
+        # Two comments posted in the same instant
+        Comment.objects.filter(pk=self.comments[2].pk).update(date_commented=self.comments[1].date_commented)
+        self.url = f'/api/pets/{self.pet.id}/comments/?page_size=2'
+
+    def get(self, url):
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, data):
+        return [comment['id'] for comment in data['results']]
+
+    def test_older_pages_step_over_ties(self):
+        ids, url = [], self.url
+        while url:
+            data = self.get(url)
+            ids.extend(self.ids(data))
+            url = data['next']
+        self.assertEqual(ids, [comment.id for comment in reversed(self.comments)])
+
+    def test_newer_link_returns_the_previous_page(self):
+        first = self.get(self.url)
+        second = self.get(first['next'])
+        self.assertIsNone(first['previous'])
+        self.assertEqual(self.ids(self.get(second['previous'])), self.ids(first))
+
+    def test_poll_returns_only_new_comments(self):
+        poll = self.get(self.url)['poll']
+        data = self.get(poll)
+        self.assertEqual(data['results'], [])
+        new = [Comment.objects.create(user=self.user, pet=self.pet, text=f'new #{n}') for n in range(3)]
+        data = self.get(data['poll'])
+        # Oldest first, so the poll link resumes after the last one
+        self.assertEqual(self.ids(data), [new[0].id, new[1].id])
+        self.assertEqual(self.ids(self.get(data['poll'])), [new[2].id])
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get(f'{self.url}&cursor=x').status_code, 404)
+        self.assertEqual(self.client.get(f'{self.url}&since=%%%').status_code, 404)
+
+
+class SparseFieldsTests(APITestCase):
+    """
+    `?fields=` / `?exclude=` trim the response and the columns read, and
+    `?expand=` inlines related objects without extra queries.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com')
+        self.shelter = Shelter.objects.create(user=self.user, name='Happy Tails')
+        self.pet = Pet.objects.create(user=self.user, shelter=self.shelter, name='Rex', description='A long story.')
+        self.client.force_authenticate(self.user)
+
+    def get(self, url, queries=2):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), queries)
+        data = response.json()
+        return (data['results'] if 'results' in data else data)[0], ctx.captured_queries[0]['sql']
+
+    def test_fields_keeps_the_named_fields_and_reads_their_columns(self):
+        data, sql = self.get('/api/pets/?fields=name,srcset', queries=1)
+        self.assertEqual(set(data), {'id', 'name', 'srcset'})
+        self.assertIn('"thumbnail_hash"', sql)
+        self.assertNotIn('"description"', sql)
+
+    def test_exclude_drops_the_named_fields_and_their_columns(self):
+        data, sql = self.get('/api/pets/?exclude=description,characteristics')
+        self.assertNotIn('description', data)
+        self.assertIn('tags', data)
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('"characteristics"', sql)
+
+    def test_expand_joins_the_shelter_untrimmed(self):
+        data, sql = self.get('/api/pets/?fields=name,shelter&expand=shelter', queries=1)
+        self.assertEqual(data['shelter']['name'], 'Happy Tails')
+        self.assertIn('description', data['shelter'])
+        self.assertIn('"pets_shelter"', sql)
+
+    def test_other_listings_are_trimmed(self):
+        data, _ = self.get('/api/shelters/?fields=name', queries=1)
+        self.assertEqual(data, {'id': self.shelter.id, 'name': 'Happy Tails'})
+
+    def test_writes_are_never_trimmed(self):
+        response = self.client.post('/api/pets/?fields=name', {'name': 'Tom', 'description': 'Short.', 'tags': []}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['description'], 'Short.')
@@ -0,0 +1,188 @@
+"""
+Fixed-size thumbnail variants of uploaded images.
+
+Every source image is rendered at `THUMBNAIL_WIDTHS` in WebP and JPEG under
+`thumbnails/` in MEDIA_ROOT, named after a hash of the source content, e.g.
+`thumbnails/3f/3f9c...e1-320.webp`. Identical uploads share their variants,
+and a name never changes content, so browsers and CDNs can cache variants
+forever.
+
+Rendering happens on a bounded process pool once the saving transaction has
+committed, never on the request path. When the variants are ready the content
+hash is stored in the row's `thumbnail_hash`, and serializers turn it into a
+`srcset`. Jobs that find the pool saturated are dropped (and logged); the
+`generate_thumbnails` command renders whatever is missing.
+
+Only images stored in MEDIA_ROOT are processed. `Pet.img` and `Shelter.img`
+may also hold external URLs or placeholder names, which are left alone.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .cache import invalidate_responses
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = 'thumbnails'
+THUMBNAIL_WIDTHS = (160, 320, 640)
+# extension -> (Pillow format, save options)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+HASH_LENGTH = 32
+
+# Cached response resources showing the thumbnails of each model
+RESOURCES = {'pet': 'pets', 'shelter': 'shelters'}
+# Image field of each model with thumbnails
+IMAGE_FIELDS = {'pet': 'img', 'shelter': 'img', 'userprofile': 'image'}
+
+
+def variant_name(content_hash, width, extension):
+    return f'{THUMBNAIL_DIR}/{content_hash[:2]}/{content_hash}-{width}.{extension}'
+
+
+def thumbnail_srcset(content_hash):
+    """`{'webp': '<url> 160w, ...', 'jpeg': ...}`, or None before the variants exist."""
+    if not content_hash:
+        return None
+    return {
+        extension: ', '.join(
+            f'{default_storage.url(variant_name(content_hash, width, extension))} {width}w'
+            for width in THUMBNAIL_WIDTHS
+        )
+        for extension in THUMBNAIL_FORMATS
+    }
+
+
+def render_variants(source_path, media_root):
+    """
+    Write every variant of the image at `source_path` and return its content
+    hash. Runs in pool workers, so it only touches Pillow and the filesystem.
+    """
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    content_hash = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    paths = {
+        (width, extension): os.path.join(media_root, variant_name(content_hash, width, extension))
+        for width in THUMBNAIL_WIDTHS
+        for extension in THUMBNAIL_FORMATS
+    }
+    if all(os.path.exists(path) for path in paths.values()):
+        return content_hash
+
+    with Image.open(io.BytesIO(data)) as image:
+        # Let the JPEG decoder downscale by a power of two while decoding
+        largest = max(THUMBNAIL_WIDTHS)
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            # JPEG has no alpha channel, flatten transparency onto white
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, 'white')
+            image.paste(rgba, mask=rgba.getchannel('A'))
+
+        os.makedirs(os.path.dirname(next(iter(paths.values()))), exist_ok=True)
+        # Largest first, each variant is downscaled from the previous one
+        variant = image
+        for width in sorted(THUMBNAIL_WIDTHS, reverse=True):
+            if variant.width > width:
+                variant = variant.resize((width, max(1, round(variant.height * width / variant.width))), Image.LANCZOS)
+            for extension, (image_format, options) in THUMBNAIL_FORMATS.items():
+                path = paths[(width, extension)]
+                temp_path = f'{path}.{os.getpid()}.tmp'
+                variant.save(temp_path, image_format, **options)
+                os.replace(temp_path, path)
+    return content_hash
+
+
+def source_path(name):
+    """Filesystem path of the media file `name`, or None when it is not one."""
+    if not name or name.startswith(('http://', 'https://', '/')):
+        return None
+    try:
+        path = default_storage.path(name)
+    except (NotImplementedError, ValueError):
+        # Remote storage, or a name outside MEDIA_ROOT
+        return None
+    return path if os.path.isfile(path) else None
+
+
+def store_hash(model, pks, content_hash, name):
+    """Store `content_hash` on the rows `pks` of `model` whose image is still `name`."""
+    # A row whose image was replaced while rendering keeps waiting for its own job
+    rows = model.objects.filter(pk__in=pks, **{IMAGE_FIELDS[model._meta.model_name]: name})
+    updated = rows.exclude(thumbnail_hash=content_hash).update(thumbnail_hash=content_hash)
+    resource = RESOURCES.get(model._meta.model_name)
+    if updated and resource:
+        invalidate_responses(resource, *pks)
+
+
+# Process pool
+
+
+_executor = None
+_executor_pid = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The process pool of this process, with a semaphore bounding pending jobs."""
+    global _executor, _executor_pid, _slots
+    with _executor_lock:
+        # A pool inherited through fork() belongs to the parent process
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS)
+            _executor_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(settings.THUMBNAIL_MAX_PENDING)
+        return _executor, _slots
+
+
+def submit(model, pks, name, path):
+    if settings.THUMBNAIL_WORKERS == 0:
+        # Inline rendering, for development and tests
+        store_hash(model, pks, render_variants(path, str(settings.MEDIA_ROOT)), name)
+        return
+    executor, slots = get_executor()
+    if not slots.acquire(blocking=False):
+        logger.warning('Thumbnail queue full, skipped %s. Run generate_thumbnails to catch up.', path)
+        return
+    future = executor.submit(render_variants, path, str(settings.MEDIA_ROOT))
+    future.add_done_callback(partial(finish, model, pks, name, slots))
+
+
+def finish(model, pks, name, slots, future):
+    """Runs on the pool's result thread once a job is done."""
+    slots.release()
+    try:
+        store_hash(model, pks, future.result(), name)
+    except Exception:
+        logger.exception('Thumbnail rendering failed for %s %s', model._meta.label, list(pks))
+    finally:
+        # This thread is not managed by a request, so close its connection ourselves
+        connection.close()
+
+
+def refresh_thumbnails(model, pks, name, current_hash=''):
+    """
+    Schedule the variants of image `name` for rows `pks` of `model` after
+    the current transaction commits. Rows whose image is no longer a media
+    file lose their thumbnails.
+    """
+    pks = tuple(pks)
+    path = source_path(name)
+    if path is not None:
+        transaction.on_commit(partial(submit, model, pks, name, path))
+    elif current_hash:
+        store_hash(model, pks, '', name)
@@ -0,0 +1,167 @@
+"""
+Chunked, resumable image uploads.
+
+A client announces an upload (file name, size and SHA-256) and then sends the
+file in any number of `PUT` requests carrying `Content-Range: bytes a-b/size`.
+Each body is copied to a part file in UPLOAD_TEMP_DIR in `UPLOAD_BLOCK_SIZE`
+blocks, and the client resumes from the upload's `received` offset.
+
+Under WSGI the body is read from the socket as it is copied, so the view holds
+one block in memory whatever the chunk size, and bytes that arrived before a
+dropped connection are kept. Under ASGI (uvicorn, see the Procfile) Django
+reads the whole body before the view runs, in memory up to
+FILE_UPLOAD_MAX_MEMORY_SIZE and then in a temporary file, and a dropped
+connection discards the chunk in progress: only completed chunks are kept.
+Clients should therefore send chunks of about UPLOAD_CHUNK_SIZE, which bounds
+both the buffering and what a dropped connection costs.
+
+Once the last byte is in, the part file is hashed block by block, checked
+with Pillow and moved into MEDIA_ROOT with `os.replace` (UPLOAD_TEMP_DIR is on
+the same filesystem, so nothing is copied), then attached to the profile or
+pet. Saving the image schedules its thumbnails.
+"""
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import UnreadablePostError
+from PIL import Image
+
+from .models import Upload, UserProfile
+from .search import FileLock
+
+UPLOAD_BLOCK_SIZE = 64 * 1024
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+# Upload target -> media directory of the finished file
+UPLOAD_DIRS = {'profile': 'user_images', 'pet': 'pet_images'}
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    """A rejected chunk or file, with the HTTP status to answer with."""
+
+    def __init__(self, detail, status=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+def part_path(upload):
+    return os.path.join(settings.UPLOAD_TEMP_DIR, f'{upload.pk}.part')
+
+
+def parse_content_range(header):
+    """`(start, end, total)` of a `bytes start-end/total` header, or None."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        return None
+    start, end, total = (int(value) for value in match.groups())
+    return (start, end, total) if start <= end < total else None
+
+
+def start_upload(upload):
+    os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    open(part_path(upload), 'wb').close()
+
+
+def write_chunk(upload, stream, start, length):
+    """
+    Copy `length` bytes of `stream` to the part file at offset `start`, which
+    must be where the previous chunk ended. Returns the new offset.
+    """
+    path = part_path(upload)
+    with FileLock(f'{path}.lock'):
+        # Another request may have written a chunk since `upload` was read
+        upload.refresh_from_db(fields=['received', 'status'])
+        if upload.status != 'pending':
+            raise UploadError('The upload is already complete.', status=409)
+        if start != upload.received:
+            raise UploadError(f'Expected a chunk starting at byte {upload.received}.', status=409)
+
+        written = 0
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            f.truncate()
+            while written < length:
+                try:
+                    block = stream.read(min(UPLOAD_BLOCK_SIZE, length - written))
+                except UnreadablePostError:
+                    # Dropped connection, keep what arrived
+                    break
+                if not block:
+                    break
+                f.write(block)
+                written += len(block)
+
+        upload.received = start + written
+        Upload.objects.filter(pk=upload.pk).update(received=upload.received)
+    if written < length:
+        raise UploadError(f'Chunk interrupted, resume from byte {upload.received}.')
+    return upload.received
+
+
+def finish_upload(upload):
+    """
+    Verify the complete part file, move it into media storage and attach it.
+    Returns the stored file name.
+    """
+    path = part_path(upload)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    if digest.hexdigest() != upload.sha256.lower():
+        restart_upload(upload)
+        raise UploadError('Checksum mismatch, upload the file again from byte 0.')
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except Exception:
+        restart_upload(upload)
+        raise UploadError('The file is not a valid image.')
+
+    extension = os.path.splitext(upload.filename)[1].lower()
+    name = f'{UPLOAD_DIRS[upload.target]}/{upload.pk.hex}{extension}'
+    try:
+        destination = default_storage.path(name)
+    except NotImplementedError:
+        # Remote storage: stream the file over in chunks
+        with open(path, 'rb') as f:
+            name = default_storage.save(name, File(f))
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(path, destination)
+
+    with transaction.atomic():
+        if upload.target == 'profile':
+            profile, _ = UserProfile.objects.get_or_create(user=upload.user)
+            profile.image.name = name
+            profile.save(update_fields=['image'])
+        else:
+            upload.pet.img = name
+            upload.pet.save(update_fields=['img', 'date_updated'])
+        upload.status = 'complete'
+        upload.save(update_fields=['status'])
+    remove_files(upload)
+    return name
+
+
+def restart_upload(upload):
+    open(part_path(upload), 'wb').close()
+    upload.received = 0
+    upload.save(update_fields=['received'])
+
+
+def remove_files(upload):
+    """Delete the part file and its lock, if any."""
+    path = part_path(upload)
+    for leftover in (path, f'{path}.lock'):
+        try:
+            os.remove(leftover)
+        except FileNotFoundError:
+            pass
@@ -7,7 +7,11 @@ from pets.views.tag_viewset import TagViewSet
 from pets.views.pet_tag_viewset import PetTagViewSet
 from pets.views.like_viewset import LikeViewSet
 from pets.views.user_viewset import UserViewSet
+from pets.views.upload_viewset import UploadViewSet
+from pets.views.metrics import CacheMetricsView
+from pets.views import async_views
 from rest_framework.documentation import include_docs_urls
+from rest_framework_simplejwt.views import TokenRefreshView
 from rest_framework.schemas import get_schema_view
 
 router = routers.DefaultRouter()
@@ -18,6 +22,8 @@ router.register(r'shelters', ShelterViewSet, basename='shelter')
 router.register(r'users', UserViewSet, basename='user')
 router.register(r'tags', TagViewSet, basename='tags')
 router.register(r'comments',CommentViewSet, basename='comments')
+router.register(r'likes', LikeViewSet, basename='likes')
+router.register(r'uploads', UploadViewSet, basename='upload')
 
 # Nested routes for users
 users_router = routers.NestedSimpleRouter(router, r'users', lookup='user')
@@ -36,6 +42,17 @@ pets_router.register(r'pet_tags', PetTagViewSet, basename='pet_tag')
 shelters_router = routers.NestedSimpleRouter(router, r'shelters', lookup='shelter')
 shelters_router.register(r'pets', PetViewSet)
 
+# Async read endpoints, see pets/views/async_views.py
+async_urlpatterns = [
+    path('pets/', async_views.pet_list, name='async-pet-list'),
+    path('pets/<int:pk>/', async_views.pet_detail, name='async-pet-detail'),
+    path('pets/<int:pet_pk>/comments/', async_views.comment_list, name='async-pet-comments'),
+    path('shelters/', async_views.shelter_list, name='async-shelter-list'),
+    path('shelters/<int:pk>/', async_views.shelter_detail, name='async-shelter-detail'),
+    path('users/<int:user_pk>/comments/', async_views.comment_list, name='async-user-comments'),
+    path('comments/', async_views.comment_list, name='async-comment-list'),
+]
+
 urlpatterns = [
 # Existing routes
     path('', include(router.urls)),
@@ -44,6 +61,9 @@ urlpatterns = [
     path('', include(users_router.urls)),
     path('register/', UserViewSet.as_view({'post': 'register'}), name='user-register'),
     path('login/', UserViewSet.as_view({'post': 'login'}), name='user-login'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('metrics/cache/', CacheMetricsView.as_view(), name='cache-metrics'),
+    path('async/', include(async_urlpatterns)),
     path('docs/', include_docs_urls(title='PetAdoption API', description='Welcome to the PetAdoption API documentation. This API is designed to facilitate the development of a pet adoption platform that seeks to provide an efficient, streamlined process for connecting prospective pet owners with animal shelters. Our backend is built using a robust stack including PostgreSQL, Python, and Django REST Framework, aiming for high scalability, data integrity, and easy maintainability.')),
     path('schema/', get_schema_view(
         title='PetAdoption API',
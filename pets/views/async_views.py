@@ -0,0 +1,134 @@
+"""
+Native async read endpoints, mounted under `/api/async/`.
+
+They answer like the matching viewset actions (same JSON, same anonymous
+response cache rules) but query through Django's async ORM, so under an ASGI
+server a worker keeps serving other requests while one waits on the database.
+Only JSON is rendered; writes and the browsable API stay on the viewsets.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from ..cache import record_access
+from ..filters import filter_pets
+from ..models import Comment, Pet, Shelter
+from ..pagination import CommentKeysetPagination, PetCursorPagination
+from ..serializers import CommentSerializer, PetSerializer, ShelterSerializer
+from .mixins import response_cache_key
+from .pet_viewset import PetViewSet
+from .shelter_viewset import ShelterViewSet
+
+
+def json_response(data, status=200):
+    """The same bytes DRF's JSONRenderer would send."""
+    return JsonResponse(
+        data, status=status, safe=False, encoder=JSONEncoder,
+        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')},
+    )
+
+
+def get_only(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return HttpResponseNotAllowed(['GET'])
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def cache_lookup(request, resource, pk, dependencies):
+    """`(key, cached entry)`, with a None key for requests that must not be cached."""
+    key = response_cache_key(request, resource, pk, dependencies)
+    if key is None:
+        return None, None
+    cached = cache.get(key)
+    record_access('responses', hit=cached is not None)
+    return key, cached
+
+
+def cached_read(viewset):
+    """
+    Serve anonymous requests from the response cache, with the resource,
+    dependencies and timeout of `viewset` (see `CachedReadMixin`).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, **kwargs):
+            key, cached = await sync_to_async(cache_lookup)(
+                request, viewset.cache_resource, kwargs.get('pk'), viewset.cache_dependencies,
+            )
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            response = await view(request, **kwargs)
+            if key is not None and response.status_code == 200:
+                await cache.aset(key, (response.content, response['Content-Type']), viewset.cache_timeout)
+            response['X-Cache'] = 'MISS'
+            return response
+        return get_only(wrapper)
+    return decorator
+
+
+@cached_read(PetViewSet)
+async def pet_list(request):
+    """Filtered pets, one cursor page at a time, like `GET /pets/`."""
+    drf_request = Request(request)
+    pets = filter_pets(PetSerializer.setup_eager_loading(Pet.objects.all()), drf_request.query_params)
+    pets = PetSerializer.narrow(pets, drf_request, 'like_count')
+    paginator = PetCursorPagination()
+    # CursorPagination fetches the page itself, so it runs where the ORM can block
+    page = await sync_to_async(paginator.paginate_queryset)(pets, drf_request)
+    serializer = PetSerializer(page, many=True, context={'request': drf_request})
+    return json_response(paginator.get_paginated_response(serializer.data).data)
+
+
+@cached_read(PetViewSet)
+async def pet_detail(request, pk):
+    drf_request = Request(request)
+    try:
+        pet = await PetSerializer.narrow(PetSerializer.setup_eager_loading(Pet.objects.all()), drf_request).aget(pk=pk)
+    except Pet.DoesNotExist:
+        return HttpResponse(status=404)
+    return json_response(PetSerializer(pet, context={'request': drf_request}).data)
+
+
+@cached_read(ShelterViewSet)
+async def shelter_list(request):
+    drf_request = Request(request)
+    shelters = [shelter async for shelter in ShelterSerializer.narrow(Shelter.objects.all(), drf_request)]
+    return json_response(ShelterSerializer(shelters, many=True, context={'request': drf_request}).data)
+
+
+@cached_read(ShelterViewSet)
+async def shelter_detail(request, pk):
+    drf_request = Request(request)
+    try:
+        shelter = await ShelterSerializer.narrow(Shelter.objects.all(), drf_request).aget(pk=pk)
+    except Shelter.DoesNotExist:
+        return HttpResponse(status=404)
+    return json_response(ShelterSerializer(shelter, context={'request': drf_request}).data)
+
+
+@get_only
+async def comment_list(request, pet_pk=None, user_pk=None):
+    """All comments, or those of a pet or user, one keyset page at a time, like `GET /comments/`."""
+    drf_request = Request(request)
+    if pet_pk is not None:
+        comments = Comment.objects.filter(pet_id=pet_pk)
+    elif user_pk is not None:
+        comments = Comment.objects.filter(user_id=user_pk)
+    else:
+        comments = Comment.objects.all()
+    comments = CommentSerializer.narrow(comments, drf_request, 'date_commented')
+    paginator = CommentKeysetPagination()
+    page = await sync_to_async(paginator.paginate_queryset)(comments, drf_request)
+    serializer = CommentSerializer(page, many=True, context={'request': drf_request})
+    return json_response(paginator.get_paginated_response(serializer.data).data)
@@ -1,6 +1,7 @@
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from ..models import Comment, Pet, User
+from ..pagination import CommentKeysetPagination
 from ..serializers import CommentSerializer
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 
@@ -8,7 +9,7 @@ class CommentViewSet(viewsets.ModelViewSet):
     """
     API endpoint for interacting with Comments.
     
-    - `list`: Lists comments based on optional pet_pk or user_pk.
+    - `list`: Lists comments based on optional pet_pk or user_pk, newest first, see `CommentKeysetPagination`.
     - `retrieve`: Retrieves a specific comment by ID. Restricted to the authenticated user who created the comment.
     - `create`: Creates a new comment. Requires authentication.
     - `update`: Updates a specific comment. Restricted to the authenticated user who created the comment.
@@ -29,7 +30,8 @@ class CommentViewSet(viewsets.ModelViewSet):
     
     def list(self, request, pet_pk=None, user_pk=None):
       """
-      Add pet_pk or user_pk to filter comments by pet or user.
+      Add pet_pk or user_pk to filter comments by pet or user. Pages seek
+      through the `(date_commented, id)` indexes, newest first.
       """
       if pet_pk is not None:
           comments = Comment.objects.filter(pet_id=pet_pk)
@@ -38,8 +40,12 @@ class CommentViewSet(viewsets.ModelViewSet):
       else:
           comments = Comment.objects.all()
 
-      serializer = CommentSerializer(comments, many=True)
-      return Response(serializer.data)
+      # date_commented: the keyset of the pages
+      comments = CommentSerializer.narrow(comments, request, 'date_commented')
+      paginator = CommentKeysetPagination()
+      page = paginator.paginate_queryset(comments, request, view=self)
+      serializer = CommentSerializer(page, many=True, context={'request': request})
+      return paginator.get_paginated_response(serializer.data)
 
     def create(self, request, pet_pk=None):
         """
@@ -73,12 +79,12 @@ class CommentViewSet(viewsets.ModelViewSet):
         Retrieve a specific comment by ID, but only if it belongs to the authenticated user.
         """
         try:
-            comment = Comment.objects.get(pk=pk)
+            comment = CommentSerializer.narrow(Comment.objects.all(), request, 'user').get(pk=pk)
         except Comment.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-        if request.user.is_authenticated and comment.user == request.user:
-            serializer = CommentSerializer(comment)
+        if request.user.is_authenticated and comment.user_id == request.user.id:
+            serializer = CommentSerializer(comment, context={'request': request})
             return Response(serializer.data)
         else:
             return Response({'detail': 'You do not have permission to view this comment.'}, status=status.HTTP_403_FORBIDDEN)
@@ -1,4 +1,5 @@
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from ..models import Like
 from ..serializers import LikeSerializer
@@ -10,13 +11,16 @@ class LikeViewSet(viewsets.ModelViewSet):
     
     - `list`: Lists likes based on authentication and optional pet_pk or user_pk.
     - `retrieve`: Retrieves a specific like by ID, but only if it belongs to the authenticated user.
-    - `create`: Creates a new like. Requires authentication.
+    - `create`: Creates a new like, or returns the existing one. Requires authentication.
     - `update`: Updates a specific like. Only the user who created the like can update it.
     - `destroy`: Deletes a specific like. Only the user who created the like can delete it.
+    - `like_status`: Whether the authenticated user likes each of a list of pets: GET /likes/status/?pets=1,2,3
     """
     
     queryset = Like.objects.all()
     serializer_class = LikeSerializer
+    # Pets looked up by one status request
+    max_status_pets = 500
 
     def get_permissions(self):
         """Assign permissions based on action."""
@@ -41,12 +45,13 @@ class LikeViewSet(viewsets.ModelViewSet):
         else:
             return Response({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        serializer = LikeSerializer(likes, many=True)
+        serializer = LikeSerializer(LikeSerializer.narrow(likes, request), many=True, context={'request': request})
         return Response(serializer.data)
 
     def create(self, request, pet_pk=None, user_pk=None):
         """
         Create a new like. Requires authentication.
+        Liking a pet again returns the existing like with 200 instead of 201.
         """
         if request.user.is_authenticated:
             data = request.data.copy()
@@ -59,22 +64,39 @@ class LikeViewSet(viewsets.ModelViewSet):
             serializer = LikeSerializer(data=data)
             if serializer.is_valid():
                 serializer.save()
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
+                return Response(serializer.data, status=status.HTTP_201_CREATED if serializer.created else status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         else:
             return Response({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
 
+    @action(detail=False, methods=['GET'], url_path='status')
+    def like_status(self, request, pet_pk=None, user_pk=None):
+        """
+        Whether the authenticated user likes each pet of `pets`, a comma-separated
+        list of up to 500 pet IDs, as `{"<pet id>": true|false}`. One query.
+        """
+        if not request.user.is_authenticated:
+            return Response({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            pet_ids = {int(pet_id) for pet_id in request.query_params.get('pets', '').split(',') if pet_id.strip()}
+        except ValueError:
+            return Response({'detail': 'pets must be a comma-separated list of pet IDs.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(pet_ids) > self.max_status_pets:
+            return Response({'detail': f'At most {self.max_status_pets} pets per request.'}, status=status.HTTP_400_BAD_REQUEST)
+        liked = set(Like.objects.filter(user=request.user, pet_id__in=pet_ids).values_list('pet_id', flat=True)) if pet_ids else set()
+        return Response({str(pet_id): pet_id in liked for pet_id in sorted(pet_ids)})
+
     def retrieve(self, request, pk=None):
         """
         Retrieve a specific like by ID, but only if it belongs to the authenticated user.
         """
         try:
-            like = Like.objects.get(pk=pk)
+            like = LikeSerializer.narrow(Like.objects.all(), request, 'user').get(pk=pk)
         except Like.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-        if request.user.is_authenticated and like.user == request.user:
-            serializer = LikeSerializer(like)
+        if request.user.is_authenticated and like.user_id == request.user.id:
+            serializer = LikeSerializer(like, context={'request': request})
             return Response(serializer.data)
         else:
             return Response({'detail': 'You do not have permission to view this like.'}, status=status.HTTP_403_FORBIDDEN)
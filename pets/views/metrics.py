@@ -0,0 +1,19 @@
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..cache import access_metrics
+from ..facets import FACET_NAMESPACE
+
+
+class CacheMetricsView(APIView):
+    """
+    Cache hit and miss counters, shared by all workers. Admin only.
+
+    - `responses`: Anonymous GET responses of pets, shelters and tags
+    - `facets`: Facet counts of `/pets/facets/`
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(access_metrics(['responses', FACET_NAMESPACE]))
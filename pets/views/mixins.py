@@ -0,0 +1,77 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from ..cache import get_version, list_namespace, object_namespace, params_digest, record_access
+from ..db_routers import primary_if_written
+
+
+class CachedReadMixin:
+    """
+    Serve anonymous `list` and `retrieve` requests from Django's cache.
+
+    The key is the path, the normalized query parameters and the Accept header,
+    combined with the version of the resource list (for `list`) or of the
+    object (for `retrieve`) and of every namespace in `cache_dependencies`.
+    Model signals bump those versions (see pets/signals.py), so an entry is only
+    served while the rows behind it are unchanged.
+    Responses carry an `X-Cache: HIT|MISS` header.
+    """
+    cache_resource = None
+    cache_dependencies = ()
+    cached_actions = ('list', 'retrieve')
+    cache_timeout = 60 * 5
+
+    def dispatch(self, request, *args, **kwargs):
+        key = self.get_response_cache_key(request, kwargs)
+        if key is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        cached = cache.get(key)
+        record_access('responses', hit=cached is not None)
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            response.render()
+            # Skip the browsable API, whose HTML embeds per-visitor tokens
+            if response.get('Content-Type', '').startswith('application/json'):
+                cache.set(key, (response.content, response['Content-Type']), self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def get_response_cache_key(self, request, kwargs):
+        """The cache key for this request, or None when it must not be cached."""
+        action = self.action_map.get(request.method.lower())
+        if request.method != 'GET' or action not in self.cached_actions:
+            return None
+        pk = kwargs.get('pk') if action == 'retrieve' else None
+        return response_cache_key(request, self.cache_resource, pk, self.cache_dependencies)
+
+
+def response_cache_key(request, resource, pk=None, dependencies=()):
+    """
+    The cache key of an anonymous GET of the `resource` list, or of object
+    `pk`, or None when the request is authenticated and must not be cached.
+    Also keeps the request's reads on the primary when the resource changed
+    too recently for replicas to have caught up.
+    """
+    # Only anonymous requests: token or session users skip the cache
+    if 'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return None
+
+    if pk is not None:
+        namespace = object_namespace(resource, pk)
+    else:
+        namespace = list_namespace(resource)
+    # The response about to be cached must not come from a lagging replica
+    primary_if_written((namespace, *dependencies))
+    versions = '.'.join(str(get_version(name)) for name in (namespace, *dependencies))
+    variant = f"{request.path}|{request.META.get('HTTP_ACCEPT', '')}|{params_digest(request.GET)}"
+    return f'pets:response:{namespace}:{versions}:{hashlib.md5(variant.encode()).hexdigest()}'
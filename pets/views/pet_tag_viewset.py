@@ -19,7 +19,7 @@ class PetTagViewSet(viewsets.ModelViewSet):
         else:
             pet_tags = Pet_Tag.objects.all()
             
-        serializer = PetTagSerializer(pet_tags, many=True)
+        serializer = PetTagSerializer(PetTagSerializer.narrow(pet_tags, request), many=True, context={'request': request})
         return Response(serializer.data)
 
     def create(self, request):
@@ -34,10 +34,10 @@ class PetTagViewSet(viewsets.ModelViewSet):
 
     def retrieve(self, request, pk=None):
         try:
-            pet_tag = Pet_Tag.objects.get(pk=pk)
+            pet_tag = PetTagSerializer.narrow(Pet_Tag.objects.all(), request).get(pk=pk)
         except Pet_Tag.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        serializer = PetTagSerializer(pet_tag)
+        serializer = PetTagSerializer(pet_tag, context={'request': request})
         return Response(serializer.data)
 
     def update(self, request, pk=None):
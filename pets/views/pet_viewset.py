@@ -1,11 +1,23 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
-from ..models import Pet, Tag
-from ..serializers import PetSerializer
+from ..models import Like, Pet, SimilarPet, Tag, UserProfile
+from ..serializers import LikeSerializer, PetSerializer
+from ..filters import filter_pets
+from ..pagination import NearbyPagination, PetCursorPagination
+from ..search import IndexNotReady, search_pets
+from ..facets import pet_facets
+from ..export import EXPORT_FORMATS, aexport_pets, export_pets, parse_since
+from ..geo import MAX_RADIUS_KM, distance_km, nearest
+from .mixins import CachedReadMixin
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework import filters 
 
-class PetViewSet(viewsets.ModelViewSet):
+class PetViewSet(CachedReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing pets.
 
@@ -16,22 +28,44 @@ class PetViewSet(viewsets.ModelViewSet):
     - Update a pet by ID: PUT /pets/{id}/
     - Partially update a pet by ID: PATCH /pets/{id}/
     - Delete a pet by ID: DELETE /pets/{id}/
+    - Full-text search: GET /pets/search/?q=
+    - Facet counts for the browse UI: GET /pets/facets/
+    - Stream the whole catalogue: GET /pets/export/?output=ndjson|csv
+    - Pets similar to a pet: GET /pets/{id}/similar/
+    - Pets near a point: GET /pets/nearby/?lat=&lon=&radius_km=
+    - Like or unlike a pet, idempotently: PUT / DELETE /pets/{id}/like/
 
     Query Parameters:
     - `shelter`: Filter pets by shelter ID
     - `tags`: Filter pets by tags
     - `likes`: Filter pets by likes
     - `user`: Filter pets by user (creator)
+    - `gender`: Filter pets by gender
+    - `cursor` / `page_size`: Keyset pagination, see `PetCursorPagination`
+    - `fields` / `exclude`: Comma-separated fields to keep or drop, see `SparseFieldsMixin`
+    - `expand=shelter,tags`: Inline the shelter and tags as objects instead of IDs
 
     Permission Levels:
     - Any user can list and retrieve pets.
     - Only authenticated users can create pets.
     - Only admin users can update or delete pets.
+    - Only authenticated users can like pets.
+
+    Anonymous list and retrieve responses are cached, see `CachedReadMixin`.
     """
     queryset = Pet.objects.all()
     serializer_class = PetSerializer   
+    pagination_class = PetCursorPagination
+    cache_resource = 'pets'
+    # Pet responses can inline tags and shelters
+    cache_dependencies = ('tags-list', 'shelters-list')
     filter_backends = (filters.BaseFilterBackend,)
     filterset_fields = ['shelter', 'tags', 'likes', 'user', 'gender']
+    # Ranked matches considered by a search request
+    max_search_results = 1000
+    # Ranked ids checked against the filters per query
+    max_search_batch = 8000
+    default_radius_km = 25
 
     def get_permissions(self):
         """
@@ -42,16 +76,25 @@ class PetViewSet(viewsets.ModelViewSet):
             return [IsAuthenticated()]
         elif self.action in ['update', 'partial_update', 'destroy']:
             return [IsAdminUser()]
+        elif self.action == 'like':
+            return [IsAuthenticated()]
         else:
             return [AllowAny()]
 
-    def list(self, request):
+    def list(self, request, shelter_pk=None, user_pk=None):
         """
-        List all pets in the database.
+        List pets one cursor page at a time.
+        Add shelter_pk or user_pk (nested routes) to list pets of a shelter or user.
         """
-        pets = Pet.objects.all()
-        serializer = PetSerializer(pets, many=True)
-        return Response(serializer.data)
+        pets = self.get_queryset()
+        if shelter_pk is not None:
+            pets = pets.filter(shelter=shelter_pk)
+        if user_pk is not None:
+            pets = pets.filter(user=user_pk)
+
+        page = self.paginate_queryset(pets)
+        serializer = PetSerializer(page, many=True, context={'request': request})
+        return self.get_paginated_response(serializer.data)
         
     def create(self, request):
         """
@@ -87,10 +130,10 @@ class PetViewSet(viewsets.ModelViewSet):
         Retrieve a single pet by its ID.
         """
         try:
-            pet = Pet.objects.get(pk=pk)
+            pet = PetSerializer.narrow(PetSerializer.setup_eager_loading(Pet.objects.all()), request).get(pk=pk)
         except Pet.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        serializer = PetSerializer(pet)
+        serializer = PetSerializer(pet, context={'request': request})
         return Response(serializer.data)
         
     def update(self, request, pk=None):
@@ -126,37 +169,173 @@ class PetViewSet(viewsets.ModelViewSet):
         else:
             return Response({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
     
-    def get_queryset(self):
-       """
-       Get the list of pets for the current user based on the provided query parameters.
-       """
-       queryset = Pet.objects.all()
-    
-       # Filtering by shelter
-       shelter_id = self.request.query_params.get('shelter', None)
-       if shelter_id is not None:
-          queryset = queryset.filter(shelter=shelter_id)
-        
-       # Filtering by tags
-       tag_id = self.request.query_params.get('tag', None)
-       if tag_id is not None:
-          queryset = queryset.filter(tags__id=tag_id)
-        
-       # Filtering by likes
-       like_id = self.request.query_params.get('like', None)
-       if like_id is not None:
-          queryset = queryset.filter(likes__id=like_id)
-        
-      # Filtering by user (creator)
-       user_id = self.request.query_params.get('user', None)
-       if user_id is not None:
-          queryset = queryset.filter(user=user_id)
-          
-      # Filtering by Gender
-       gender = self.request.query_params.get('gender', None)
-       if gender is not None:
-           queryset = queryset.filter(gender=gender)
-            
-       return queryset
+    @action(detail=False, methods=['GET'])
+    def search(self, request):
+        """
+        Full-text search over name, description and characteristics, best match first.
 
-    
+        Query Parameters:
+        - `q`: Search terms (required)
+        - `limit` / `offset`: Page through the ranked results
+        - The pet listing filters (`shelter`, `tag`, `gender`, ...) narrow the results
+
+        Answers 503 with `Retry-After` while a host without an index snapshot
+        builds its first index.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'detail': 'The q query parameter is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            ranked_ids = self.search_ids(query, filter_pets(Pet.objects.all(), request.query_params))
+        except IndexNotReady:
+            return Response({'detail': 'The search index is being built, try again shortly.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '10'})
+
+        paginator = LimitOffsetPagination()
+        page = paginator.paginate_queryset(ranked_ids, request, view=self)
+        pets = PetSerializer.narrow(PetSerializer.setup_eager_loading(Pet.objects.filter(id__in=page)), request).in_bulk()
+        serializer = PetSerializer([pets[pet_id] for pet_id in page if pet_id in pets], many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+    def search_ids(self, query, pets):
+        """
+        Ids of `pets` matching `query`, best first, at most `max_search_results`.
+
+        The filters run in the database on batches of ranked ids until enough
+        pets pass them, so a broad filter never loads all of its ids and a
+        selective one still fills the pages. Every match is only ranked when
+        the best batch was not enough.
+        """
+        size = self.max_search_results
+        ranked = [pet_id for pet_id, _ in search_pets(query, limit=size)]
+        matching = []
+        offset, batch_size = 0, size
+        while offset < len(ranked) and len(matching) < size:
+            batch = ranked[offset:offset + batch_size]
+            # Also drops pets deleted since they were indexed
+            kept = set(pets.filter(id__in=batch).values_list('id', flat=True))
+            matching.extend(pet_id for pet_id in batch if pet_id in kept)
+            offset += len(batch)
+            if offset == size == len(ranked) and len(matching) < size:
+                ranked = [pet_id for pet_id, _ in search_pets(query)]
+            # Fewer round trips for selective filters, still bounded
+            batch_size = min(batch_size * 2, self.max_search_batch)
+        return matching[:size]
+
+    @action(detail=False, methods=['GET'])
+    def facets(self, request):
+        """
+        Count the pets matching the listing filters by pet_type, gender, status,
+        shelter and tag. Accepts the same query parameters as the pet list.
+        """
+        return Response(pet_facets(request.query_params))
+
+    @action(detail=False, methods=['GET'])
+    def export(self, request):
+        """
+        Stream every pet as NDJSON (default) or CSV, without pagination.
+
+        Query Parameters:
+        - `output`: `ndjson` or `csv`
+        - `updated_since`: Only pets changed at or after this ISO date or datetime
+        - The pet listing filters (`shelter`, `tag`, `gender`, ...) narrow the export
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response({'detail': f"Unknown output format, use one of: {', '.join(EXPORT_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        pets = filter_pets(Pet.objects.all(), request.query_params)
+        updated_since = request.query_params.get('updated_since')
+        if updated_since:
+            since = parse_since(updated_since)
+            if since is None:
+                return Response({'detail': 'updated_since must be an ISO 8601 date or datetime.'}, status=status.HTTP_400_BAD_REQUEST)
+            pets = pets.filter(date_updated__gte=since)
+
+        # ASGI servers need an async iterator to stream, WSGI ones a sync one
+        lines = aexport_pets(pets, output) if isinstance(request._request, ASGIRequest) else export_pets(pets, output)
+        response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="pets.{output}"'
+        return response
+
+    @action(detail=False, methods=['GET'])
+    def nearby(self, request):
+        """
+        Pets within a radius of a point, nearest first, each with its `distance_km`.
+
+        Query Parameters:
+        - `lat` / `lon`: The point, by default the signed-in user's profile location
+        - `radius_km`: Search radius in km, default 25, at most 500
+        - `limit` / `offset`: Page through the results, see `NearbyPagination`
+        - The pet listing filters (`shelter`, `tag`, `gender`, ...) narrow the results
+        """
+        params = request.query_params
+        try:
+            radius_km = float(params.get('radius_km', self.default_radius_km))
+            if 'lat' in params or 'lon' in params or not request.user.is_authenticated:
+                latitude, longitude = float(params['lat']), float(params['lon'])
+            else:
+                latitude, longitude = UserProfile.objects.filter(user=request.user, latitude__isnull=False).values_list('latitude', 'longitude').get()
+        except (KeyError, ValueError, UserProfile.DoesNotExist):
+            return Response({'detail': 'lat and lon are required, as numbers, unless your profile location is known.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return Response({'detail': 'lat must be within -90 to 90 and lon within -180 to 180.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < radius_km <= MAX_RADIUS_KM:
+            return Response({'detail': f'radius_km must be a number above 0 and at most {MAX_RADIUS_KM}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The page's ids are read from the geohash index alone, then its pets
+        paginator = NearbyPagination()
+        page = paginator.paginate_queryset(
+            nearest(filter_pets(Pet.objects.all(), params), latitude, longitude, radius_km).values_list('pk', 'distance_squared'),
+            request, view=self,
+        )
+        pets = PetSerializer.narrow(PetSerializer.setup_eager_loading(Pet.objects.all()), request).in_bulk([pk for pk, _ in page])
+        page = [(pk, distance_squared) for pk, distance_squared in page if pk in pets]
+        serializer = PetSerializer([pets[pk] for pk, _ in page], many=True, context={'request': request})
+        return paginator.get_paginated_response([
+            {**data, 'distance_km': round(distance_km(distance_squared), 3)}
+            for (_, distance_squared), data in zip(page, serializer.data)
+        ])
+
+    @action(detail=True, methods=['PUT', 'DELETE'])
+    def like(self, request, pk=None):
+        """
+        Like the pet (PUT) or take the like back (DELETE) as the authenticated
+        user. Repeating either is harmless: PUT returns the existing like with
+        200 instead of 201, DELETE returns 204 whether or not there was one.
+        """
+        # DRF's get_object_or_404 also answers 404 to a non-numeric pk
+        pet = get_object_or_404(Pet.objects.only('pk'), pk=pk)
+        if request.method == 'DELETE':
+            # Deleted row by row, so the like counter signals run
+            Like.objects.filter(pet=pet, user=request.user).delete()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        like, created = Like.objects.get_or_create(pet=pet, user=request.user)
+        return Response(LikeSerializer(like).data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    @action(detail=True, methods=['GET'])
+    def similar(self, request, pk=None):
+        """
+        Pets most like this one by tags, type, shelter and age, most similar
+        first, each with its `similarity` score (0 to 1). Read from the table
+        kept by `manage.py build_similar_pets`, see pets/similarity.py.
+        """
+        neighbors = list(
+            SimilarPet.objects.filter(pet=pk).order_by('rank')
+            .select_related('similar').prefetch_related('similar__tags')
+        )
+        if not neighbors and not Pet.objects.filter(pk=pk).exists():
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        serializer = PetSerializer([neighbor.similar for neighbor in neighbors], many=True, context={'request': request})
+        return Response([
+            {**data, 'similarity': round(neighbor.score, 4)}
+            for neighbor, data in zip(neighbors, serializer.data)
+        ])
+
+    def get_queryset(self):
+        """
+        Get the list of pets for the current user based on the provided query parameters.
+        """
+        queryset = PetSerializer.setup_eager_loading(Pet.objects.all())
+        # like_count: the cursor of `ordering=popular`
+        return PetSerializer.narrow(filter_pets(queryset, self.request.query_params), self.request, 'like_count')
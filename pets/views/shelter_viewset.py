@@ -1,11 +1,16 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
+from ..bulk import bulk_create_pets, resolve_tags
 from ..models import Shelter, Comment, Like, Pet
-from ..serializers import ShelterSerializer, CommentSerializer, LikeSerializer, PetSerializer
+from ..filters import filter_pets
+from ..pagination import PetCursorPagination
+from ..serializers import ShelterSerializer, CommentSerializer, LikeSerializer, PetSerializer, PetBulkSerializer
+from .mixins import CachedReadMixin
 
-class ShelterViewSet(viewsets.ModelViewSet):
+class ShelterViewSet(CachedReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for interacting with Shelters.
     
@@ -16,16 +21,22 @@ class ShelterViewSet(viewsets.ModelViewSet):
     
     Additional actions:
     - `pets`: List or add pets for a specific shelter.
+    - `pets_bulk`: Add up to 1000 pets to a shelter in one request.
     - `comments`: List or add comments for a specific shelter.
     - `likes`: List or add likes for a specific shelter.
+
+    Anonymous list and retrieve responses are cached, see `CachedReadMixin`.
     """
     
     queryset = Shelter.objects.all()
     serializer_class = ShelterSerializer
+    cache_resource = 'shelters'
+    # Largest batch accepted by pets_bulk
+    max_bulk_pets = 1000
 
     def get_permissions(self):
         """Assign permissions based on action."""
-        if self.action == 'create':
+        if self.action in ['create', 'pets_bulk']:
             return [IsAuthenticated()]
         elif self.action in ['update', 'partial_update', 'destroy']:
             return [IsAdminUser()]
@@ -34,8 +45,8 @@ class ShelterViewSet(viewsets.ModelViewSet):
 
     def list(self, request):
         """List all shelters."""
-        shelters = Shelter.objects.all()
-        serializer = ShelterSerializer(shelters, many=True)
+        shelters = ShelterSerializer.narrow(Shelter.objects.all(), request)
+        serializer = ShelterSerializer(shelters, many=True, context={'request': request})
         return Response(serializer.data)
 
     def create(self, request):
@@ -54,10 +65,10 @@ class ShelterViewSet(viewsets.ModelViewSet):
         Retrieve a specific shelter by ID.
         """
         try:
-            shelter = Shelter.objects.get(pk=pk)
+            shelter = ShelterSerializer.narrow(Shelter.objects.all(), request).get(pk=pk)
         except Shelter.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        serializer = ShelterSerializer(shelter)
+        serializer = ShelterSerializer(shelter, context={'request': request})
         return Response(serializer.data)
         
     def update(self, request, pk=None):
@@ -100,9 +111,12 @@ class ShelterViewSet(viewsets.ModelViewSet):
         List or add pets for a specific shelter.
         """
         if request.method == 'GET':
-            pets = Pet.objects.filter(shelter=pk)
-            serializer = PetSerializer(pets, many=True)
-            return Response(serializer.data)
+            pets = PetSerializer.setup_eager_loading(Pet.objects.filter(shelter=pk))
+            pets = PetSerializer.narrow(filter_pets(pets, request.query_params), request, 'like_count')
+            paginator = PetCursorPagination()
+            page = paginator.paginate_queryset(pets, request, view=self)
+            serializer = PetSerializer(page, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data)
         elif request.method == 'POST':
             serializer = PetSerializer(data=request.data)
             if serializer.is_valid():
@@ -110,6 +124,64 @@ class ShelterViewSet(viewsets.ModelViewSet):
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    # Custom action for bulk intake of a Shelter's Pets
+    @action(detail=True, methods=['POST'], url_path='pets/bulk', permission_classes=[IsAuthenticated])
+    def pets_bulk(self, request, pk=None):
+        """
+        Add a batch of pets to a shelter with batched inserts in one transaction.
+
+        Body: a JSON array of pets (same fields as a single pet; `tags` may hold tag ids or names).
+
+        Query Parameters:
+        - `mode=atomic` (default): Insert nothing if any pet is invalid.
+        - `mode=partial`: Insert the valid pets and report the invalid ones (207).
+
+        Only the shelter's owner or an admin can add pets.
+        """
+        try:
+            shelter = Shelter.objects.get(pk=pk)
+        except Shelter.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if shelter.user_id != request.user.id and not request.user.is_staff:
+            return Response({'detail': 'You can only add pets to your own shelter.'}, status=status.HTTP_403_FORBIDDEN)
+
+        mode = request.query_params.get('mode', 'atomic')
+        if mode not in ('atomic', 'partial'):
+            return Response({'detail': 'mode must be atomic or partial.'}, status=status.HTTP_400_BAD_REQUEST)
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({'detail': 'Expected a non-empty list of pets.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_bulk_pets:
+            return Response({'detail': f'At most {self.max_bulk_pets} pets per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One serializer validates every item, so its fields are built only once
+        validator = PetBulkSerializer()
+        validated, errors = {}, []
+        for index, item in enumerate(items):
+            try:
+                validated[index] = dict(validator.run_validation(item))
+            except ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+        tag_lookup, unknown_tags = resolve_tags({ref for data in validated.values() for ref in data['tags']})
+
+        pets, tag_ids = [], []
+        for index, data in validated.items():
+            tags = data.pop('tags')
+            missing = sorted(set(tags) & unknown_tags)
+            if missing:
+                errors.append({'index': index, 'errors': {'tags': [f'Unknown tag: {ref}' for ref in missing]}})
+                continue
+            pets.append(Pet(shelter=shelter, user=request.user, **data))
+            tag_ids.append([tag_lookup[ref] for ref in tags])
+        errors.sort(key=lambda error: error['index'])
+
+        if errors and mode == 'atomic':
+            return Response({'created': 0, 'ids': [], 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        created = bulk_create_pets(pets, tag_ids) if pets else []
+        response_status = status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED
+        return Response({'created': len(created), 'ids': [pet.pk for pet in created], 'errors': errors}, status=response_status)
+
     # Custom action for Shelter's Comments
     @action(detail=True, methods=['GET', 'POST'], permission_classes=[IsAuthenticated])
     def comments(self, request, pk=None):
@@ -118,7 +190,7 @@ class ShelterViewSet(viewsets.ModelViewSet):
         """
         if request.method == 'GET':
             comments = Comment.objects.filter(shelter=pk)
-            serializer = CommentSerializer(comments, many=True)
+            serializer = CommentSerializer(comments, many=True, context={'request': request})
             return Response(serializer.data)
         elif request.method == 'POST':
             serializer = CommentSerializer(data=request.data)
@@ -135,7 +207,7 @@ class ShelterViewSet(viewsets.ModelViewSet):
         """
         if request.method == 'GET':
             likes = Like.objects.filter(shelter=pk)
-            serializer = LikeSerializer(likes, many=True)
+            serializer = LikeSerializer(likes, many=True, context={'request': request})
             return Response(serializer.data)
         elif request.method == 'POST':
             serializer = LikeSerializer(data=request.data)
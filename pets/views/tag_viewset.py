@@ -1,10 +1,11 @@
 from rest_framework import viewsets, status
 from rest_framework.response import Response
-from ..models import Tag, Pet_Tag
+from ..models import Tag
 from ..serializers import TagSerializer
+from .mixins import CachedReadMixin
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(CachedReadMixin, viewsets.ModelViewSet):
     """
     API endpoint for interacting with Tags.
     
@@ -13,10 +14,13 @@ class TagViewSet(viewsets.ModelViewSet):
     - `create`: Creates a new tag. Requires authentication and a pet_pk.
     - `update`: Updates a specific tag. Requires authentication.
     - `destroy`: Deletes a specific tag. Requires admin privileges.
+
+    Anonymous list and retrieve responses are cached, see `CachedReadMixin`.
     """
     
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    cache_resource = 'tags'
 
     def get_permissions(self):
         """Assign permissions based on action."""
@@ -30,11 +34,10 @@ class TagViewSet(viewsets.ModelViewSet):
     def list(self, request, pet_pk=None):
         """List all tags. If pet_pk is provided, list tags associated with that pet."""
         if pet_pk is not None:
-            pet_tags = Pet_Tag.objects.filter(pet_id=pet_pk)
-            tags = [pt.tag for pt in pet_tags]
+            tags = Tag.objects.filter(pet_tag__pet_id=pet_pk)
         else:
             tags = Tag.objects.all()
-        serializer = TagSerializer(tags, many=True)
+        serializer = TagSerializer(TagSerializer.narrow(tags, request), many=True, context={'request': request})
         return Response(serializer.data)
 
     def create(self, request, pet_pk=None):
@@ -58,10 +61,10 @@ class TagViewSet(viewsets.ModelViewSet):
         Retrieve a specific tag by ID.
         """
         try:
-            tag = Tag.objects.get(pk=pk)
+            tag = TagSerializer.narrow(Tag.objects.all(), request).get(pk=pk)
         except Tag.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        serializer = TagSerializer(tag)
+        serializer = TagSerializer(tag, context={'request': request})
         return Response(serializer.data)
 
     def update(self, request, pk=None, pet_pk=None):
@@ -0,0 +1,115 @@
+import os
+
+from django.conf import settings
+from rest_framework import viewsets, status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from django.core.files.storage import default_storage
+from ..models import Upload
+from ..serializers import UploadSerializer
+from ..uploads import IMAGE_EXTENSIONS, UploadError, finish_upload, parse_content_range, remove_files, start_upload, write_chunk
+
+
+class UploadViewSet(viewsets.ViewSet):
+    """
+    API endpoint for chunked, resumable image uploads.
+
+    - Start an upload: POST /uploads/ with `target` (`profile` or `pet`), `pet`
+      (for pet images), `filename`, `size` and `sha256` (hex digest of the file)
+    - Send a chunk: PUT /uploads/{id}/ with the raw bytes as body and a
+      `Content-Range: bytes <start>-<end>/<size>` header. Chunks must follow
+      each other; the last one attaches the image and answers 201. Send
+      chunks of about `chunk_size` bytes: under ASGI a chunk is buffered
+      whole before it is stored, and one cut off is lost entirely.
+    - Check progress, e.g. after a dropped connection: GET /uploads/{id}/
+      (`received` is where the next chunk starts)
+    - Abort: DELETE /uploads/{id}/
+
+    Permission Levels:
+    - Only authenticated users can upload, and only to their own profile or pets
+      (staff can upload to any pet).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, pk):
+        try:
+            return Upload.objects.select_related('pet').get(pk=pk, user=request.user)
+        except (Upload.DoesNotExist, ValueError):
+            return None
+
+    def create(self, request):
+        """
+        Start an upload.
+        """
+        serializer = UploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        if os.path.splitext(data['filename'])[1].lower() not in IMAGE_EXTENSIONS:
+            return Response({'detail': f"Only {', '.join(IMAGE_EXTENSIONS)} images can be uploaded."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < data['size'] <= settings.MAX_UPLOAD_SIZE:
+            return Response({'detail': f'size must be between 1 and {settings.MAX_UPLOAD_SIZE} bytes.'}, status=status.HTTP_400_BAD_REQUEST)
+        pet = data.get('pet')
+        if data['target'] == 'pet':
+            if pet is None:
+                return Response({'detail': 'pet is required for pet images.'}, status=status.HTTP_400_BAD_REQUEST)
+            if pet.user_id != request.user.id and not request.user.is_staff:
+                return Response({'detail': 'You do not have permission to change this pet.'}, status=status.HTTP_403_FORBIDDEN)
+        elif pet is not None:
+            return Response({'detail': 'pet is only allowed for pet images.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = serializer.save(user=request.user)
+        start_upload(upload)
+        return Response(UploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        """
+        Progress of an upload.
+        """
+        upload = self.get_upload(request, pk)
+        if upload is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(UploadSerializer(upload, context={'request': request}).data)
+
+    def update(self, request, pk=None):
+        """
+        Store one chunk, copied to disk block by block. Under WSGI it is
+        streamed as it arrives; under ASGI Django has already buffered it.
+        """
+        upload = self.get_upload(request, pk)
+        if upload is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        content_range = parse_content_range(request.headers.get('Content-Range'))
+        if content_range is None or content_range[2] != upload.size:
+            return Response({'detail': f'A Content-Range header of the form bytes <start>-<end>/{upload.size} is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        start, end, _ = content_range
+        length = end - start + 1
+        if int(request.META.get('CONTENT_LENGTH') or 0) != length:
+            return Response({'detail': 'Content-Length does not match Content-Range.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # request.stream reads the raw body without parsing it
+            received = write_chunk(upload, request.stream, start, length)
+            if received < upload.size:
+                return Response(UploadSerializer(upload).data)
+            name = finish_upload(upload)
+        except UploadError as exc:
+            upload.refresh_from_db()
+            return Response({'detail': exc.detail, 'received': upload.received}, status=exc.status)
+
+        data = UploadSerializer(upload).data
+        data['image'] = default_storage.url(name)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def destroy(self, request, pk=None):
+        """
+        Abort an upload and delete what was received.
+        """
+        upload = self.get_upload(request, pk)
+        if upload is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        remove_files(upload)
+        upload.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
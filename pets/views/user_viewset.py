@@ -3,8 +3,13 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.contrib.auth.models import User
-from ..models import Comment, Like, Pet, Shelter , UserProfile
+from ..models import Comment, Like, Pet, Shelter , UserProfile, UserRecommendation
+from ..filters import filter_pets
+from ..pagination import PetCursorPagination
 from ..serializers import UserSerializer, CommentSerializer, LikeSerializer, PetSerializer, ShelterSerializer
+from ..authentication import issue_jwt
+from ..db_routers import stick_to_primary
+from django.conf import settings
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import ValidationError
@@ -24,6 +29,9 @@ class UserViewSet(viewsets.ModelViewSet):
             return [IsAuthenticated()]
         else:
             return []
+
+    def get_queryset(self):
+        return UserSerializer.narrow(UserSerializer.setup_eager_loading(User.objects.all()), self.request)
     
     # Custom action for User's Registration
     @action(detail=False, methods=['POST'], url_path='register')
@@ -60,6 +68,8 @@ class UserViewSet(viewsets.ModelViewSet):
 
         # Create Token
         token = Token.objects.create(user=user)
+        # The new user's first reads must see it, whichever replica they hit
+        stick_to_primary(f'Token {token.key}')
 
         return Response({'token': token.key}, status=status.HTTP_201_CREATED)
       return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -68,7 +78,14 @@ class UserViewSet(viewsets.ModelViewSet):
     def login(self, request):
         """
         Login a user.
+
+        Returns a database token by default. With `"token_type": "jwt"` (or
+        `AUTH_TOKEN_TYPE = 'jwt'`) it returns a signed access token, sent as
+        `Authorization: Bearer <token>`, and a refresh token for `/token/refresh/`.
         """
+        token_type = request.data.get('token_type', settings.AUTH_TOKEN_TYPE)
+        if token_type not in ('token', 'jwt'):
+            return Response({'error': 'token_type must be "token" or "jwt"'}, status=status.HTTP_400_BAD_REQUEST)
         username = request.data.get('username')
         email = request.data.get('email')
         password = request.data.get('password')
@@ -88,8 +105,14 @@ class UserViewSet(viewsets.ModelViewSet):
         if not user:
             return Response({'error': 'Invalid password'}, status=status.HTTP_400_BAD_REQUEST)
 
+        if token_type == 'jwt':
+            tokens = issue_jwt(user)
+            stick_to_primary(f"Bearer {tokens['token']}")
+            return Response(tokens, status=status.HTTP_200_OK)
+
         # Retrieve or create token
         token, _ = Token.objects.get_or_create(user=user)
+        stick_to_primary(f'Token {token.key}')
 
         return Response({'token': token.key}, status=status.HTTP_200_OK)
 
@@ -97,8 +120,8 @@ class UserViewSet(viewsets.ModelViewSet):
     #Get all users
     @action(detail=False, methods=['GET'])
     def all(self, request):
-        users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
+        users = UserSerializer.narrow(UserSerializer.setup_eager_loading(User.objects.all()), request)
+        serializer = UserSerializer(users, many=True, context={'request': request})
         return Response(serializer.data)
     
     # Custom action for User's Comments
@@ -111,8 +134,8 @@ class UserViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'You can only view or modify your own comments.'}, status=status.HTTP_403_FORBIDDEN)
         
         if request.method == 'GET':
-            comments = Comment.objects.filter(user=pk)
-            serializer = CommentSerializer(comments, many=True)
+            comments = CommentSerializer.narrow(Comment.objects.filter(user=pk), request)
+            serializer = CommentSerializer(comments, many=True, context={'request': request})
             return Response(serializer.data)
         
         elif request.method == 'POST':
@@ -131,16 +154,36 @@ class UserViewSet(viewsets.ModelViewSet):
         if request.user.id != int(pk):
             return Response({'detail': 'You can only view or modify your own likes.'}, status=status.HTTP_403_FORBIDDEN)
         if request.method == 'GET':
-            likes = Like.objects.filter(user=pk)
-            serializer = LikeSerializer(likes, many=True)
+            likes = LikeSerializer.narrow(Like.objects.filter(user=pk), request)
+            serializer = LikeSerializer(likes, many=True, context={'request': request})
             return Response(serializer.data)
         elif request.method == 'POST':
             serializer = LikeSerializer(data=request.data)
             if serializer.is_valid():
                 serializer.save(user_id=pk)
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
+                return Response(serializer.data, status=status.HTTP_201_CREATED if serializer.created else status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    # Custom action for User's Recommendations
+    @action(detail=True, methods=['GET'], permission_classes=[IsAuthenticated])
+    def recommendations(self, request, pk=None):
+        """
+        Pets recommended from the user's likes, best first, each with its
+        `score`. Read from the table kept by `manage.py build_recommendations`,
+        see pets/recommendations.py.
+        """
+        if request.user.id != int(pk):
+            return Response({'detail': 'You can only view your own recommendations.'}, status=status.HTTP_403_FORBIDDEN)
+        recommendations = list(
+            UserRecommendation.objects.filter(user=pk).order_by('rank')
+            .select_related('pet').prefetch_related('pet__tags')
+        )
+        serializer = PetSerializer([recommendation.pet for recommendation in recommendations], many=True, context={'request': request})
+        return Response([
+            {**data, 'score': round(recommendation.score, 4)}
+            for recommendation, data in zip(recommendations, serializer.data)
+        ])
+
     # Custom action for User's Pets
     @action(detail=True, methods=['GET', 'POST'], permission_classes=[IsAuthenticated])
     def pets(self, request, pk=None):
@@ -148,9 +191,12 @@ class UserViewSet(viewsets.ModelViewSet):
         Retrieve or add pets.
         """
         if request.method == 'GET':
-            pets = Pet.objects.filter(user=pk)
-            serializer = PetSerializer(pets, many=True)
-            return Response(serializer.data)
+            pets = PetSerializer.setup_eager_loading(Pet.objects.filter(user=pk))
+            pets = PetSerializer.narrow(filter_pets(pets, request.query_params), request, 'like_count')
+            paginator = PetCursorPagination()
+            page = paginator.paginate_queryset(pets, request, view=self)
+            serializer = PetSerializer(page, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data)
         elif request.method == 'POST':
             serializer = PetSerializer(data=request.data)
             if serializer.is_valid():
@@ -165,8 +211,8 @@ class UserViewSet(viewsets.ModelViewSet):
         Retrieve or add shelters.
         """
         if request.method == 'GET':
-            shelters = Shelter.objects.filter(user=pk)
-            serializer = ShelterSerializer(shelters, many=True)
+            shelters = ShelterSerializer.narrow(Shelter.objects.filter(user=pk), request)
+            serializer = ShelterSerializer(shelters, many=True, context={'request': request})
             return Response(serializer.data)
         elif request.method == 'POST':
             serializer = ShelterSerializer(data=request.data)
@@ -183,11 +229,11 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         if request.method == 'GET':
             try:
-                user = User.objects.get(pk=pk)
+                user = UserSerializer.narrow(UserSerializer.setup_eager_loading(User.objects.all()), request).get(pk=pk)
             except User.DoesNotExist:
                 return Response({'error': 'User does not exist'}, status=status.HTTP_404_NOT_FOUND)
             
-            serializer = UserSerializer(user)
+            serializer = UserSerializer(user, context={'request': request})
             return Response(serializer.data)
             
         elif request.method == 'PUT':
@@ -196,7 +242,7 @@ class UserViewSet(viewsets.ModelViewSet):
                 return Response({'detail': 'You can only modify your own profile.'}, status=status.HTTP_403_FORBIDDEN)
             
             try:
-                user = User.objects.get(pk=pk)
+                user = UserSerializer.setup_eager_loading(User.objects.all()).get(pk=pk)
             except User.DoesNotExist:
                 return Response({'error': 'User does not exist'}, status=status.HTTP_404_NOT_FOUND)
             